@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+from __future__ import unicode_literals
+import frappe
+import hashlib
+from frappe.utils import cstr, flt, get_first_day, getdate
+from frappe.model.document import Document
+from six import iteritems
+
+class AccountPeriodBalance(Document):
+	pass
+
+# dimensions of the monthly balances, the values of GL Entry columns except period_start_date
+# and is_period_closing, which are derived from posting_date and voucher_type
+BALANCE_KEY_FIELDS = ("company", "account", "period_start_date", "cost_center", "party_type",
+	"party", "is_period_closing")
+
+BALANCE_FIELDS = ("debit", "credit", "debit_in_account_currency", "credit_in_account_currency")
+
+def get_balance_key(gle):
+	return (gle.get("company"), gle.get("account"), getdate(get_first_day(gle.get("posting_date"))),
+		cstr(gle.get("cost_center")), cstr(gle.get("party_type")), cstr(gle.get("party")),
+		1 if gle.get("voucher_type") == "Period Closing Voucher" else 0)
+
+def get_key_of_balance(d):
+	return (d.company, d.account, getdate(d.period_start_date), cstr(d.cost_center), cstr(d.party_type),
+		cstr(d.party), d.is_period_closing)
+
+def add_balance(balances, key, d, sign=1):
+	balance = balances.setdefault(key, [0.0] * len(BALANCE_FIELDS))
+	for i, fieldname in enumerate(BALANCE_FIELDS):
+		balance[i] += sign * flt(d.get(fieldname))
+
+def get_balance_name(key):
+	# the name is derived from the key, so that balances can be upserted by primary key
+	return hashlib.md5("::".join(cstr(d) for d in key).encode("utf-8")).hexdigest()
+
+def update_account_period_balances(gl_entries, sign=1):
+	"""Add the amounts of the GL Entries to the monthly balances, called when GL Entries
+		are made (and with sign=-1 before they are deleted)"""
+	balances = {}
+	for gle in gl_entries:
+		add_balance(balances, get_balance_key(gle), gle, sign)
+
+	upsert_balances(balances)
+
+def remove_account_period_balances(voucher_type, voucher_no):
+	"""Subtract the GL Entries of the voucher from the monthly balances, before they are deleted"""
+	gl_entries = frappe.db.sql("""select company, account, posting_date, cost_center, party_type,
+			party, voucher_type, {0}
+		from `tabGL Entry` where voucher_type=%s and voucher_no=%s""".format(", ".join(BALANCE_FIELDS)),
+		(voucher_type, voucher_no), as_dict=1)
+
+	update_account_period_balances(gl_entries, sign=-1)
+
+def upsert_balances(balances, batch_size=500):
+	from erpnext.accounts.utils import upsert_rows
+
+	upsert_rows("Account Period Balance", ("name",) + BALANCE_KEY_FIELDS + BALANCE_FIELDS,
+		[(get_balance_name(key),) + tuple(key) + tuple(balance) for key, balance in iteritems(balances)],
+		add_fields=BALANCE_FIELDS, batch_size=batch_size)
+
+def get_balance(debit_field, credit_field, conditions, date=None, from_date=None):
+	"""Returns sum(debit) - sum(credit) of the GL Entries matching the conditions, from the
+		monthly balances and the GL Entries of the month of the date.
+
+		:param conditions: SQL conditions on account, cost_center, party_type, party or company, with alias `gle`
+		:param date: balance as on date, all entries if not set
+		:param from_date: only entries from this date, excluding Period Closing Vouchers (for P&L accounts)
+
+		Returns None if the balance can not be read from the monthly balances"""
+	if from_date and getdate(from_date) != getdate(get_first_day(from_date)):
+		return None
+
+	balance_conditions = list(conditions)
+	gl_conditions = list(conditions)
+
+	if from_date:
+		balance_conditions.append("gle.period_start_date >= {0} and gle.is_period_closing = 0"
+			.format(frappe.db.escape(cstr(getdate(from_date)))))
+		gl_conditions.append("gle.posting_date >= {0} and gle.voucher_type != 'Period Closing Voucher'"
+			.format(frappe.db.escape(cstr(getdate(from_date)))))
+
+	balance = flt(frappe.db.sql("""
+		select sum({0}) - sum({1})
+		from `tabAccount Period Balance` gle
+		where {2}""".format(debit_field, credit_field,
+			" and ".join(balance_conditions + (["gle.period_start_date < {0}".format(
+				frappe.db.escape(cstr(getdate(get_first_day(date)))))] if date else []))))[0][0])
+
+	if date:
+		# entries of the current month
+		gl_conditions.append("gle.posting_date >= {0} and gle.posting_date <= {1}".format(
+			frappe.db.escape(cstr(getdate(get_first_day(date)))), frappe.db.escape(cstr(getdate(date)))))
+
+		balance += flt(frappe.db.sql("""
+			select sum({0}) - sum({1})
+			from `tabGL Entry` gle
+			where {2}""".format(debit_field, credit_field, " and ".join(gl_conditions)))[0][0])
+
+	return balance
+
+def get_gl_balances(company=None):
+	"""Returns the monthly balances computed from GL Entries"""
+	from erpnext.utilities.db import iterate_sql
+
+	balances = {}
+	for gle in iterate_sql("""select company, account, posting_date, cost_center, party_type, party,
+			voucher_type, {0}
+		from `tabGL Entry` {1}""".format(", ".join(BALANCE_FIELDS),
+			"where company = {0}".format(frappe.db.escape(company)) if company else ""), as_dict=1):
+		add_balance(balances, get_balance_key(gle), gle)
+
+	return balances
+
+def rebuild_account_period_balances(company=None):
+	"""Rebuild the monthly balances from GL Entries"""
+	balances = get_gl_balances(company)
+
+	if company:
+		frappe.db.sql("delete from `tabAccount Period Balance` where company=%s", company)
+	else:
+		frappe.db.sql("delete from `tabAccount Period Balance`")
+
+	upsert_balances(balances)
+
+def verify_account_period_balances(company=None, precision=2):
+	"""Compare the monthly balances with the GL Entries,
+		returns a list of (key, balance, GL balance) which do not match"""
+	gl_balances = get_gl_balances(company)
+
+	balances = {}
+	for d in frappe.db.sql("""select {0}, {1} from `tabAccount Period Balance` {2}""".format(
+			", ".join(BALANCE_KEY_FIELDS), ", ".join(BALANCE_FIELDS),
+			"where company = {0}".format(frappe.db.escape(company)) if company else ""), as_dict=1):
+		add_balance(balances, get_key_of_balance(d), d)
+
+	differences = []
+	zero = [0.0] * len(BALANCE_FIELDS)
+	for key in sorted(set(balances) | set(gl_balances), key=lambda k: [cstr(d) for d in k]):
+		balance, gl_balance = balances.get(key, zero), gl_balances.get(key, zero)
+		if any(flt(a, precision) != flt(b, precision) for a, b in zip(balance, gl_balance)):
+			differences.append((key, balance, gl_balance))
+
+	return differences
+
+def update_balance_names(doc, method, old, new, merge=False):
+	"""Rename the balances of a renamed (or merged) company, account, cost center or party,
+		as the balances are named by their key"""
+	for fieldname in get_renamed_key_fields(doc.doctype):
+		conditions, values = "{0} = %s".format(fieldname), [new]
+		if fieldname == "party":
+			conditions += " and party_type = %s"
+			values.append(doc.doctype)
+
+		rows = frappe.db.sql("""select name, {0}, {1} from `tabAccount Period Balance` where {2}""".format(
+			", ".join(BALANCE_KEY_FIELDS), ", ".join(BALANCE_FIELDS), conditions), values, as_dict=1)
+
+		balances = {}
+		for d in rows:
+			add_balance(balances, get_key_of_balance(d), d)
+
+		# merged balances share a key
+		if len(balances) == len(rows) and all(d.name == get_balance_name(get_key_of_balance(d)) for d in rows):
+			continue
+
+		frappe.db.sql("""delete from `tabAccount Period Balance` where name in ({0})""".format(
+			", ".join(["%s"] * len(rows))), tuple(d.name for d in rows))
+		upsert_balances(balances)
+
+def get_renamed_key_fields(doctype):
+	fieldnames = [fieldname for fieldname, link_doctype in (("company", "Company"), ("account", "Account"),
+		("cost_center", "Cost Center"), ("party_type", "Party Type")) if link_doctype == doctype]
+
+	if frappe.db.exists("Party Type", doctype):
+		fieldnames.append("party")
+
+	return fieldnames
+
+def on_doctype_update():
+	frappe.db.add_index("Account Period Balance", ["company", "account", "period_start_date"])
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+from __future__ import unicode_literals
+
+import frappe
+import unittest
+from frappe.utils import add_days, flt, nowdate
+from erpnext.accounts.doctype.journal_entry.test_journal_entry import make_journal_entry
+from erpnext.accounts.doctype.sales_invoice.test_sales_invoice import create_sales_invoice
+from erpnext.accounts.doctype.account_period_balance.account_period_balance import (
+	rebuild_account_period_balances, verify_account_period_balances, get_balance_name, get_key_of_balance,
+	BALANCE_KEY_FIELDS)
+from erpnext.accounts.utils import get_balance_on, fix_total_debit_credit
+
+class TestAccountPeriodBalance(unittest.TestCase):
+	def test_balance_is_updated_on_posting_and_cancellation(self):
+		account = "_Test Bank - _TC"
+		rebuild_account_period_balances("_Test Company")
+
+		je = make_journal_entry("_Test Account Cost for Goods Sold - _TC", account, 100,
+			posting_date=add_days(nowdate(), -40), submit=True)
+		je2 = make_journal_entry("_Test Account Cost for Goods Sold - _TC", account, 50, submit=True)
+
+		for date in (add_days(nowdate(), -60), add_days(nowdate(), -40), nowdate(), None):
+			self.assertEqual(get_balance_on(account, date), get_gl_balance(account, date))
+
+		self.assertFalse(verify_account_period_balances("_Test Company"))
+
+		je.cancel()
+		je2.cancel()
+		self.assertEqual(get_balance_on(account), get_gl_balance(account))
+		self.assertFalse(verify_account_period_balances("_Test Company"))
+
+	def test_balance_is_updated_when_debit_credit_is_fixed(self):
+		rebuild_account_period_balances("_Test Company")
+		je = make_journal_entry("_Test Account Cost for Goods Sold - _TC", "_Test Bank - _TC", 100, submit=True)
+
+		# unbalanced voucher, as left by rounding differences
+		frappe.db.sql("""update `tabGL Entry` set debit = debit - 0.01
+			where voucher_type = 'Journal Entry' and voucher_no = %s and debit > 0""", je.name)
+		rebuild_account_period_balances("_Test Company")
+
+		fix_total_debit_credit()
+		self.assertFalse(verify_account_period_balances("_Test Company"))
+
+	def test_balances_are_renamed_with_the_party(self):
+		rebuild_account_period_balances("_Test Company")
+		create_sales_invoice(customer="_Test Customer 1", rate=100)
+
+		frappe.rename_doc("Customer", "_Test Customer 1", "_Test Customer 1 Renamed")
+		self.assertFalse(get_misnamed_balances())
+
+		# later postings are added to the renamed balance
+		create_sales_invoice(customer="_Test Customer 1 Renamed", rate=50)
+		self.assertFalse(get_misnamed_balances())
+		self.assertFalse(verify_account_period_balances("_Test Company"))
+
+		frappe.db.rollback()
+
+def get_misnamed_balances():
+	return [d.name for d in frappe.db.sql("""select name, {0} from `tabAccount Period Balance`""".format(
+		", ".join(BALANCE_KEY_FIELDS)), as_dict=1) if d.name != get_balance_name(get_key_of_balance(d))]
+
+def get_gl_balance(account, date=None):
+	return flt(frappe.db.sql("""select sum(debit_in_account_currency) - sum(credit_in_account_currency)
+		from `tabGL Entry` where account=%(account)s {0}""".format("and posting_date <= %(date)s" if date else ""),
+		{"account": account, "date": date})[0][0])
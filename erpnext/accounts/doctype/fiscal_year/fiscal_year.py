@@ -47,14 +47,18 @@ class FiscalYear(Document):
 				FiscalYearIncorrectDate)
 
 	def on_update(self):
+		from erpnext.accounts.utils import clear_fiscal_year_cache
+
 		check_duplicate_fiscal_year(self)
-		frappe.cache().delete_value("fiscal_years")
+		clear_fiscal_year_cache()
 	
 	def on_trash(self):
+		from erpnext.accounts.utils import clear_fiscal_year_cache
+
 		global_defaults = frappe.get_doc("Global Defaults")
 		if global_defaults.current_fiscal_year == self.name:
 			frappe.throw(_("You cannot delete Fiscal Year {0}. Fiscal Year {0} is set as default in Global Settings").format(self.name))
-		frappe.cache().delete_value("fiscal_years")
+		clear_fiscal_year_cache()
 
 	def validate_overlap(self):
 		existing_fiscal_years = frappe.db.sql("""select name from `tabFiscal Year`
@@ -23,3 +23,25 @@ class TestFiscalYear(unittest.TestCase):
 		})
 
 		self.assertRaises(FiscalYearIncorrectDate, fy.insert)
+
+	def test_cached_fiscal_year(self):
+		from erpnext.accounts.utils import (get_fiscal_year, get_fiscal_year_index, find_fiscal_year,
+			FiscalYearError)
+
+		for fy in get_fiscal_year_index().fiscal_years:
+			self.assertEqual(find_fiscal_year(get_fiscal_year_index(), fy.year_start_date), fy)
+			self.assertEqual(find_fiscal_year(get_fiscal_year_index(), fy.year_end_date), fy)
+
+		self.assertEqual(get_fiscal_year("2014-06-01")[0], "_Test Fiscal Year 2014")
+
+		# cache is cleared when a fiscal year is disabled
+		fy = frappe.get_doc("Fiscal Year", "_Test Fiscal Year 2014")
+		fy.disabled = 1
+		fy.save()
+		try:
+			self.assertRaises(FiscalYearError, get_fiscal_year, "2014-06-01", verbose=0)
+		finally:
+			fy.disabled = 0
+			fy.save()
+
+		self.assertEqual(get_fiscal_year("2014-06-01")[0], "_Test Fiscal Year 2014")
@@ -4,7 +4,7 @@
 from __future__ import unicode_literals
 import frappe, erpnext
 from frappe import _
-from frappe.utils import flt, fmt_money, getdate, formatdate
+from frappe.utils import add_days, cint, flt, fmt_money, getdate, formatdate, now, nowdate
 from frappe.model.document import Document
 from frappe.model.naming import set_name_from_naming_options
 from frappe.model.meta import get_field_precision
@@ -13,6 +13,7 @@ from erpnext.accounts.utils import get_account_currency
 from erpnext.accounts.utils import get_fiscal_year
 from erpnext.exceptions import InvalidAccountCurrency
 from erpnext.accounts.doctype.accounting_dimension.accounting_dimension import get_checks_for_pl_and_bs_accounts
+from six import iteritems
 
 exclude_from_linked_with = True
 class GLEntry(Document):
@@ -48,7 +49,7 @@ class GLEntry(Document):
 		if self.against_voucher_type in ['Journal Entry', 'Sales Invoice', 'Purchase Invoice', 'Fees'] \
 			and self.against_voucher and update_outstanding == 'Yes' and not from_repost:
 				update_outstanding_amt(self.account, self.party_type, self.party, self.against_voucher_type,
-					self.against_voucher)
+					self.against_voucher, gl_entries=[self])
 
 	def check_mandatory(self):
 		mandatory = ['account','voucher_type','voucher_no','company']
@@ -56,7 +57,7 @@ class GLEntry(Document):
 			if not self.get(k):
 				frappe.throw(_("{0} is required").format(_(self.meta.get_label(k))))
 
-		account_type = frappe.db.get_value("Account", self.account, "account_type")
+		account_type = self.get_account_details().account_type
 		if not (self.party_type and self.party):
 			if account_type == "Receivable":
 				frappe.throw(_("{0} {1}: Customer is required against Receivable account {2}")
@@ -71,7 +72,7 @@ class GLEntry(Document):
 				.format(self.voucher_type, self.voucher_no, self.account))
 
 	def pl_must_have_cost_center(self):
-		if frappe.db.get_value("Account", self.account, "report_type") == "Profit and Loss":
+		if self.get_account_details().report_type == "Profit and Loss":
 			if not self.cost_center and self.voucher_type != 'Period Closing Voucher':
 				frappe.throw(_("{0} {1}: Cost Center is required for 'Profit and Loss' account {2}. Please set up a default Cost Center for the Company.")
 					.format(self.voucher_type, self.voucher_no, self.account))
@@ -84,9 +85,12 @@ class GLEntry(Document):
 
 	def validate_dimensions_for_pl_and_bs(self):
 
-		account_type = frappe.db.get_value("Account", self.account, "report_type")
+		account_type = self.get_account_details().report_type
 
-		for dimension in get_checks_for_pl_and_bs_accounts():
+		if not hasattr(self, "pl_and_bs_dimensions"):
+			self.pl_and_bs_dimensions = get_checks_for_pl_and_bs_accounts()
+
+		for dimension in self.pl_and_bs_dimensions:
 
 			if account_type == "Profit and Loss" \
 				and self.company == dimension.company and dimension.mandatory_for_pl and not dimension.disabled:
@@ -103,7 +107,7 @@ class GLEntry(Document):
 
 	def check_pl_account(self):
 		if self.is_opening=='Yes' and \
-				frappe.db.get_value("Account", self.account, "report_type")=="Profit and Loss" and \
+				self.get_account_details().report_type=="Profit and Loss" and \
 				self.voucher_type not in ['Purchase Invoice', 'Sales Invoice']:
 			frappe.throw(_("{0} {1}: 'Profit and Loss' type account {2} not allowed in Opening Entry")
 				.format(self.voucher_type, self.voucher_no, self.account))
@@ -111,8 +115,7 @@ class GLEntry(Document):
 	def validate_account_details(self, adv_adj):
 		"""Account must be ledger, active and not freezed"""
 
-		ret = frappe.db.sql("""select is_group, docstatus, company
-			from tabAccount where name=%s""", self.account, as_dict=1)[0]
+		ret = self.get_account_details()
 
 		if ret.is_group==1:
 			frappe.throw(_("{0} {1}: Account {2} cannot be a Group")
@@ -126,6 +129,16 @@ class GLEntry(Document):
 			frappe.throw(_("{0} {1}: Account {2} does not belong to Company {3}")
 				.format(self.voucher_type, self.voucher_no, self.account, self.company))
 
+	def get_account_details(self):
+		"""Account fields used in validations, the map can be shared by entries posted together"""
+		if not hasattr(self, "account_details"):
+			self.account_details = {}
+
+		if self.account not in self.account_details:
+			self.account_details.update(get_account_details([self.account]))
+
+		return self.account_details.get(self.account) or frappe._dict()
+
 	def validate_cost_center(self):
 		if not hasattr(self, "cost_center_company"):
 			self.cost_center_company = {}
@@ -165,6 +178,42 @@ class GLEntry(Document):
 			self.fiscal_year = get_fiscal_year(self.posting_date, company=self.company)[0]
 
 
+def get_account_details(accounts):
+	return {d.name: d for d in frappe.db.sql("""select name, account_type, report_type,
+			is_group, docstatus, company, freeze_account, balance_must_be
+		from tabAccount where name in ({0})""".format(", ".join(["%s"] * len(accounts))),
+		tuple(accounts), as_dict=1)} if accounts else {}
+
+def bulk_insert_gl_entries(gl_entries, batch_size=500):
+	"""Insert validated GL Entry documents as submitted, with multi-row inserts"""
+	meta = frappe.get_meta("GL Entry")
+	defaults = {df.fieldname: df.default for df in meta.fields if df.default}
+	timestamp, user = now(), frappe.session.user
+
+	rows = []
+	for gle in gl_entries:
+		gle.autoname()
+		for fieldname, default in iteritems(defaults):
+			if gle.get(fieldname) is None:
+				gle.set(fieldname, default)
+
+		gle.update({
+			"docstatus": 1,
+			"owner": user,
+			"modified_by": user,
+			"creation": timestamp,
+			"modified": timestamp
+		})
+		rows.append(gle.get_valid_dict())
+
+	columns = list(rows[0]) if rows else []
+	for i in range(0, len(rows), batch_size):
+		batch = rows[i:i + batch_size]
+		frappe.db.sql("""insert into `tabGL Entry` ({columns}) values {values}""".format(
+			columns=", ".join("`{0}`".format(c) for c in columns),
+			values=", ".join(["({0})".format(", ".join(["%s"] * len(columns)))] * len(batch))
+		), tuple(row.get(c) for row in batch for c in columns))
+
 def validate_balance_type(account, adv_adj=False):
 	if not adv_adj and account:
 		balance_must_be = frappe.db.get_value("Account", account, "balance_must_be")
@@ -189,7 +238,19 @@ def check_freezing_date(posting_date, adv_adj=False):
 					and not frozen_accounts_modifier in frappe.get_roles():
 				frappe.throw(_("You are not authorized to add or update entries before {0}").format(formatdate(acc_frozen_upto)))
 
-def update_outstanding_amt(account, party_type, party, against_voucher_type, against_voucher, on_cancel=False):
+def update_outstanding_amt(account, party_type, party, against_voucher_type, against_voucher, on_cancel=False,
+	gl_entries=None):
+	"""Update outstanding amount of the against voucher.
+
+		If the GL Entries just posted (or, on cancel, deleted) against an invoice by another voucher
+		are passed, only their amount is applied to the outstanding, else it is recomputed
+		from all GL Entries against the voucher"""
+	if gl_entries and against_voucher_type in ["Sales Invoice", "Purchase Invoice", "Fees"] \
+		and not any(d.get("voucher_type") == against_voucher_type and d.get("voucher_no") == against_voucher
+			for d in gl_entries):
+		update_outstanding_amt_by_delta(against_voucher_type, against_voucher, gl_entries, on_cancel)
+		return
+
 	if party_type and party:
 		party_condition = " and party_type={0} and party={1}"\
 			.format(frappe.db.escape(party_type), frappe.db.escape(party))
@@ -234,9 +295,75 @@ def update_outstanding_amt(account, party_type, party, against_voucher_type, aga
 
 	# Update outstanding amt on against voucher
 	if against_voucher_type in ["Sales Invoice", "Purchase Invoice", "Fees"]:
-		ref_doc = frappe.get_doc(against_voucher_type, against_voucher)
-		ref_doc.db_set('outstanding_amount', bal)
-		ref_doc.set_status(update=True)
+		set_outstanding_amount(against_voucher_type, against_voucher, bal)
+
+def update_outstanding_amt_by_delta(against_voucher_type, against_voucher, gl_entries, on_cancel=False):
+	delta = sum(flt(d.get("debit_in_account_currency")) - flt(d.get("credit_in_account_currency"))
+		for d in gl_entries if d.get("voucher_type") != "Invoice Discounting")
+
+	if against_voucher_type == "Purchase Invoice":
+		delta = -delta
+	if on_cancel:
+		delta = -delta
+
+	if not delta:
+		return
+
+	# lock the invoice, so that concurrent payments are applied one after another
+	outstanding_amount = frappe.db.sql("""select outstanding_amount from `tab{0}`
+		where name=%s for update""".format(against_voucher_type), against_voucher)[0][0]
+
+	set_outstanding_amount(against_voucher_type, against_voucher, flt(outstanding_amount) + delta)
+
+def set_outstanding_amount(doctype, name, outstanding_amount):
+	precision = get_field_precision(frappe.get_meta(doctype).get_field("outstanding_amount"))
+	frappe.db.set_value(doctype, name, "outstanding_amount", flt(outstanding_amount, precision))
+	set_invoice_status(doctype, name)
+
+def set_invoice_status(doctype, name):
+	"""Set status of the invoice from the fields it depends on, without loading the whole document"""
+	meta = frappe.get_meta(doctype)
+	if not meta.has_field("status"):
+		return
+
+	fields = ["docstatus", "modified"] + [f for f in ("status", "outstanding_amount", "due_date",
+		"is_return", "is_discounted", "amended_from") if meta.has_field(f)]
+
+	values = frappe.db.get_value(doctype, name, fields, as_dict=1)
+	values.update({"doctype": doctype, "name": name})
+
+	frappe.get_doc(values).set_status(update=True)
+
+def verify_outstanding_amounts(days=7):
+	"""Recompute outstanding of invoices modified in the last days (or all, if days is None),
+		where the outstanding amount does not match their GL Entries (scheduled)"""
+	invoices = []
+	for doctype, party_type, party_field, account_field in (("Sales Invoice", "Customer", "customer", "debit_to"),
+			("Purchase Invoice", "Supplier", "supplier", "credit_to"), ("Fees", "Student", "student", "receivable_account")):
+		sign = -1 if doctype == "Purchase Invoice" else 1
+		invoices += frappe.db.sql("""
+			select %(doctype)s as doctype, inv.name, inv.{account_field} as account,
+				%(party_type)s as party_type, inv.{party_field} as party
+			from `tab{doctype}` inv
+			left join `tabGL Entry` gle on gle.against_voucher_type = %(doctype)s and gle.against_voucher = inv.name
+				and gle.account = inv.{account_field} and gle.party_type = %(party_type)s
+				and gle.party = inv.{party_field} and gle.voucher_type != 'Invoice Discounting'
+			where inv.docstatus = 1 {conditions}
+			group by inv.name, inv.outstanding_amount, inv.{account_field}, inv.{party_field}
+			having abs(inv.outstanding_amount
+				- %(sign)s * ifnull(sum(gle.debit_in_account_currency - gle.credit_in_account_currency), 0)) > 0.005
+		""".format(doctype=doctype, account_field=account_field, party_field=party_field,
+			conditions="and inv.modified >= %(from_date)s" if days is not None else ""), {
+				"doctype": doctype,
+				"party_type": party_type,
+				"sign": sign,
+				"from_date": add_days(nowdate(), -cint(days)) if days is not None else None
+			}, as_dict=1)
+
+	for d in invoices:
+		update_outstanding_amt(d.account, d.party_type, d.party, d.doctype, d.name)
+
+	return invoices
 
 def validate_frozen_account(account, adv_adj=None):
 	frozen_account = frappe.db.get_value("Account", account, "freeze_account")
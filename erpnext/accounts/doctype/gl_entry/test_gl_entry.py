@@ -5,7 +5,8 @@ from __future__ import unicode_literals
 import frappe, unittest
 from frappe.model.naming import parse_naming_series
 from erpnext.accounts.doctype.journal_entry.test_journal_entry import make_journal_entry
-from erpnext.accounts.doctype.gl_entry.gl_entry import rename_gle_sle_docs
+from erpnext.accounts.doctype.gl_entry.gl_entry import rename_gle_sle_docs, verify_outstanding_amounts
+from erpnext.accounts import general_ledger
 
 class TestGLEntry(unittest.TestCase):
 	def test_round_off_entry(self):
@@ -26,6 +27,60 @@ class TestGLEntry(unittest.TestCase):
 
 		self.assertTrue(round_off_entry)
 
+	def test_bulk_insert(self):
+		def get_gl_entries(voucher_no):
+			return frappe.get_all("GL Entry", filters={"voucher_type": "Journal Entry", "voucher_no": voucher_no},
+				fields=["account", "debit", "credit", "cost_center", "fiscal_year", "posting_date",
+					"is_opening", "is_advance", "to_rename", "docstatus", "account_currency"],
+				order_by="account")
+
+		je = make_journal_entry("_Test Account Cost for Goods Sold - _TC", "_Test Bank - _TC", 100, submit=True)
+
+		bulk_inserts = []
+		def make_entries_in_bulk(gl_map, *args, **kwargs):
+			bulk_inserts.append(len(gl_map))
+			return _make_entries_in_bulk(gl_map, *args, **kwargs)
+
+		threshold, _make_entries_in_bulk = general_ledger.BULK_INSERT_THRESHOLD, general_ledger.make_entries_in_bulk
+		general_ledger.BULK_INSERT_THRESHOLD = 2
+		general_ledger.make_entries_in_bulk = make_entries_in_bulk
+		try:
+			bulk_je = make_journal_entry("_Test Account Cost for Goods Sold - _TC", "_Test Bank - _TC", 100, submit=True)
+		finally:
+			general_ledger.BULK_INSERT_THRESHOLD = threshold
+			general_ledger.make_entries_in_bulk = _make_entries_in_bulk
+
+		self.assertEqual(bulk_inserts, [2])
+		self.assertEqual(get_gl_entries(bulk_je.name), get_gl_entries(je.name))
+
+	def test_hooks_disable_bulk_insert(self):
+		self.assertTrue(general_ledger.hooks_into_gl_entry({"GL Entry": {"on_update": "app.handler"}}))
+		self.assertTrue(general_ledger.hooks_into_gl_entry({("GL Entry", "Journal Entry"): {"validate": "app.handler"}}))
+		self.assertTrue(general_ledger.hooks_into_gl_entry({"*": {"on_submit": "app.handler"}}))
+
+		self.assertFalse(general_ledger.hooks_into_gl_entry({"*": {"after_rename": "app.handler"}}))
+		self.assertFalse(general_ledger.hooks_into_gl_entry({"Journal Entry": {"on_submit": "app.handler"}}))
+
+	def test_incremental_outstanding_amount(self):
+		from erpnext.accounts.doctype.sales_invoice.test_sales_invoice import create_sales_invoice
+		from erpnext.accounts.doctype.payment_entry.payment_entry import get_payment_entry
+
+		si = create_sales_invoice(rate=500)
+
+		pe = get_payment_entry("Sales Invoice", si.name, party_amount=200, bank_account="_Test Bank - _TC")
+		pe.reference_no = "1"
+		pe.reference_date = frappe.utils.nowdate()
+		pe.insert()
+		pe.submit()
+
+		self.assertEqual(frappe.db.get_value("Sales Invoice", si.name, "outstanding_amount"), 300)
+		self.assertEqual(frappe.db.get_value("Sales Invoice", si.name, "status"), "Partly Paid")
+
+		pe.cancel()
+		self.assertEqual(frappe.db.get_value("Sales Invoice", si.name, "outstanding_amount"), 500)
+
+		self.assertNotIn(si.name, [d.name for d in verify_outstanding_amounts()])
+
 	def test_rename_entries(self):
 		je = make_journal_entry("_Test Account Cost for Goods Sold - _TC", "_Test Bank - _TC", 100, submit=True)
 		rename_gle_sle_docs()
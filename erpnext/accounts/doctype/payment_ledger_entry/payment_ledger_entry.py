@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+from __future__ import unicode_literals
+import frappe, erpnext
+import hashlib
+from frappe.utils import cstr, flt
+from frappe.model.document import Document
+from six import iteritems
+
+class PaymentLedgerEntry(Document):
+	pass
+
+# one entry per invoice (or any voucher posting a receivable / payable balance), party and account,
+# with the amounts paid against it by other vouchers
+KEY_FIELDS = ("voucher_type", "voucher_no", "party_type", "party", "account")
+DETAIL_FIELDS = ("company", "posting_date", "due_date", "account_currency", "cost_center")
+AMOUNT_FIELDS = ("invoice_amount", "paid_amount", "outstanding_amount")
+
+def get_entry_name(key):
+	# the name is derived from the key, so that payments can be upserted by primary key
+	return hashlib.md5("::".join(cstr(d) for d in key).encode("utf-8")).hexdigest()
+
+def get_payment_ledger_amounts(gl_entries, sign=1, amounts=None):
+	"""Returns the invoiced and paid amounts of the party GL Entries by payment ledger key,
+		the same way `get_outstanding_invoices` summed up GL Entries"""
+	if amounts is None:
+		amounts = {}
+
+	for gle in gl_entries:
+		if not (gle.get("party_type") and gle.get("party")):
+			continue
+
+		# "debit - credit" for receivable and vice-versa for payable parties
+		balance = flt(gle.get("debit_in_account_currency")) - flt(gle.get("credit_in_account_currency"))
+		if erpnext.get_party_account_type(gle.get("party_type")) != "Receivable":
+			balance = -balance
+
+		if balance > 0 and (gle.get("voucher_type") not in ("Journal Entry", "Payment Entry")
+				or (gle.get("voucher_type") == "Journal Entry" and not gle.get("against_voucher"))):
+			# invoice
+			key = (gle.get("voucher_type"), gle.get("voucher_no"), gle.get("party_type"), gle.get("party"),
+				gle.get("account"))
+			entry = amounts.setdefault(key, frappe._dict(invoice_amount=0.0, paid_amount=0.0))
+			entry.update({f: gle.get(f) for f in DETAIL_FIELDS})
+			entry.invoice_amount += sign * balance
+
+		elif balance < 0 and gle.get("against_voucher"):
+			# payment or credit note against an invoice
+			key = (gle.get("against_voucher_type"), gle.get("against_voucher"), gle.get("party_type"),
+				gle.get("party"), gle.get("account"))
+			entry = amounts.setdefault(key, frappe._dict(invoice_amount=0.0, paid_amount=0.0))
+			if not entry.get("company"):
+				entry.update({f: gle.get(f) for f in DETAIL_FIELDS})
+			entry.paid_amount -= sign * balance
+
+	return amounts
+
+def update_payment_ledger(gl_entries, sign=1):
+	"""Add the amounts of the GL Entries to the payment ledger, called when GL Entries
+		are made (and with sign=-1 before they are deleted)"""
+	amounts = get_payment_ledger_amounts(gl_entries, sign)
+	if not amounts:
+		return
+
+	upsert_entries(amounts)
+
+	if sign < 0:
+		names = [get_entry_name(key) for key in amounts]
+		frappe.db.sql("""delete from `tabPayment Ledger Entry`
+			where name in ({0}) and invoice_amount = 0 and paid_amount = 0""".format(
+				", ".join(["%s"] * len(names))), tuple(names))
+
+def remove_payment_ledger_entries(voucher_type, voucher_no):
+	"""Subtract the party GL Entries of the voucher from the payment ledger, before they are deleted"""
+	gl_entries = frappe.db.sql("""select voucher_type, voucher_no, party_type, party, account,
+			against_voucher_type, against_voucher, debit_in_account_currency, credit_in_account_currency,
+			{0}
+		from `tabGL Entry`
+		where voucher_type=%s and voucher_no=%s and party is not null and party != ''""".format(
+			", ".join(DETAIL_FIELDS)), (voucher_type, voucher_no), as_dict=1)
+
+	update_payment_ledger(gl_entries, sign=-1)
+
+def upsert_entries(amounts, batch_size=500):
+	from erpnext.accounts.utils import upsert_rows
+
+	rows = [(get_entry_name(key),) + tuple(key) + tuple(d.get(f) for f in DETAIL_FIELDS)
+		+ (d.invoice_amount, d.paid_amount, d.invoice_amount - d.paid_amount) for key, d in iteritems(amounts)]
+
+	# details are taken from the invoice, once its amount is added
+	upsert_rows("Payment Ledger Entry", ("name",) + KEY_FIELDS + DETAIL_FIELDS + AMOUNT_FIELDS, rows,
+		add_fields=AMOUNT_FIELDS, replace_fields=DETAIL_FIELDS, replace_if="invoice_amount", batch_size=batch_size)
+
+def get_open_items(party_type, party, account, condition=None):
+	"""Returns the vouchers with outstanding of the party and account, oldest first
+
+		:param condition: SQL conditions on posting_date, due_date, company, cost_center,
+			voucher_type, voucher_no or invoice_amount, starting with `and`"""
+	return frappe.db.sql("""
+		select
+			voucher_no, voucher_type, posting_date, due_date, invoice_amount,
+			paid_amount as payment_amount, outstanding_amount
+		from
+			`tabPayment Ledger Entry`
+		where
+			party_type = %(party_type)s and party = %(party)s and account = %(account)s
+			and invoice_amount > 0 and outstanding_amount > 0
+			{condition}
+		order by posting_date, voucher_no""".format(condition=condition or ""), {
+			"party_type": party_type,
+			"party": party,
+			"account": account
+		}, as_dict=True)
+
+def rebuild_payment_ledger(company=None):
+	"""Rebuild the payment ledger from GL Entries"""
+	from erpnext.utilities.db import iterate_sql
+
+	# no other query may run while the rows are fetched
+	for party_type in frappe.db.sql_list("select name from `tabParty Type`"):
+		erpnext.get_party_account_type(party_type)
+
+	amounts = {}
+	for gle in iterate_sql("""select voucher_type, voucher_no, party_type, party, account,
+			against_voucher_type, against_voucher, debit_in_account_currency, credit_in_account_currency,
+			{0}
+		from `tabGL Entry`
+		where party is not null and party != '' {1}""".format(", ".join(DETAIL_FIELDS),
+			"and company = {0}".format(frappe.db.escape(company)) if company else ""), as_dict=1):
+		get_payment_ledger_amounts([gle], amounts=amounts)
+
+	if company:
+		frappe.db.sql("delete from `tabPayment Ledger Entry` where company=%s", company)
+	else:
+		frappe.db.sql("delete from `tabPayment Ledger Entry`")
+
+	upsert_entries(amounts)
+
+def update_entry_names(doc, method, old, new, merge=False):
+	"""Rename the payment ledger entries of a renamed (or merged) voucher, party or account,
+		as the entries are named by their key"""
+	for conditions, values in get_renamed_key_conditions(doc.doctype, new):
+		rows = frappe.db.sql("""select name, {0}, {1}, invoice_amount, paid_amount
+			from `tabPayment Ledger Entry` where {2}""".format(", ".join(KEY_FIELDS), ", ".join(DETAIL_FIELDS),
+			conditions), values, as_dict=1)
+
+		amounts = {}
+		for d in rows:
+			key = tuple(d.get(f) for f in KEY_FIELDS)
+			entry = amounts.setdefault(key, frappe._dict(invoice_amount=0.0, paid_amount=0.0))
+			if d.invoice_amount > 0 or not entry.get("company"):
+				entry.update({f: d.get(f) for f in DETAIL_FIELDS})
+			entry.invoice_amount += flt(d.invoice_amount)
+			entry.paid_amount += flt(d.paid_amount)
+
+		# merged entries share a key
+		if len(amounts) == len(rows) and all(d.name == get_entry_name(tuple(d.get(f) for f in KEY_FIELDS))
+				for d in rows):
+			continue
+
+		frappe.db.sql("""delete from `tabPayment Ledger Entry` where name in ({0})""".format(
+			", ".join(["%s"] * len(rows))), tuple(d.name for d in rows))
+		upsert_entries(amounts)
+
+def get_renamed_key_conditions(doctype, name):
+	"""Returns (conditions, values) of the entries with a key field linking to the renamed document"""
+	conditions = [("voucher_type = %s and voucher_no = %s", (doctype, name))]
+
+	if doctype == "Party Type":
+		conditions.append(("party_type = %s", (name,)))
+	elif doctype == "Account":
+		conditions.append(("account = %s", (name,)))
+	elif frappe.db.exists("Party Type", doctype):
+		conditions.append(("party_type = %s and party = %s", (doctype, name)))
+
+	return conditions
+
+def on_doctype_update():
+	frappe.db.add_index("Payment Ledger Entry", ["party_type", "party", "account"])
+	frappe.db.add_index("Payment Ledger Entry", ["voucher_type", "voucher_no"])
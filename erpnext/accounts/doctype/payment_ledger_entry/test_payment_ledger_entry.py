@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+from __future__ import unicode_literals
+
+import frappe
+import unittest
+from frappe.utils import flt, nowdate
+from erpnext.accounts.doctype.sales_invoice.test_sales_invoice import create_sales_invoice
+from erpnext.accounts.doctype.payment_entry.payment_entry import get_payment_entry
+from erpnext.accounts.doctype.purchase_invoice.test_purchase_invoice import unlink_payment_on_cancel_of_invoice
+from erpnext.accounts.doctype.payment_ledger_entry.payment_ledger_entry import get_open_items
+
+class TestPaymentLedgerEntry(unittest.TestCase):
+	def test_open_items_on_payment_and_cancellation(self):
+		si = create_sales_invoice(rate=500)
+		self.assertEqual(get_outstanding(si.name), 500)
+
+		pe = get_payment_entry("Sales Invoice", si.name, party_amount=200, bank_account="_Test Bank - _TC")
+		pe.reference_no = "1"
+		pe.reference_date = nowdate()
+		pe.insert()
+		pe.submit()
+		self.assertEqual(get_outstanding(si.name), 300)
+
+		pe.cancel()
+		self.assertEqual(get_outstanding(si.name), 500)
+
+		si.cancel()
+		self.assertEqual(get_outstanding(si.name), None)
+		self.assertFalse(frappe.db.exists("Payment Ledger Entry", {"voucher_no": si.name}))
+
+	def test_unlinked_payments_are_removed_on_cancellation(self):
+		unlink_payment_on_cancel_of_invoice()
+
+		si = create_sales_invoice(rate=500)
+		pe = get_payment_entry("Sales Invoice", si.name, party_amount=200, bank_account="_Test Bank - _TC")
+		pe.reference_no = "1"
+		pe.reference_date = nowdate()
+		pe.insert()
+		pe.submit()
+
+		si.load_from_db()
+		si.cancel()
+		self.assertFalse(frappe.db.exists("Payment Ledger Entry", {"voucher_no": si.name}))
+
+		unlink_payment_on_cancel_of_invoice(0)
+
+	def test_open_items_of_renamed_party(self):
+		si = create_sales_invoice(customer="_Test Customer 1", rate=500)
+		frappe.rename_doc("Customer", "_Test Customer 1", "_Test Customer 1 Renamed")
+		self.assertEqual(get_outstanding(si.name, "_Test Customer 1 Renamed"), 500)
+
+		# the payment is added to the entry of the invoice
+		pe = get_payment_entry("Sales Invoice", si.name, party_amount=200, bank_account="_Test Bank - _TC")
+		pe.reference_no = "1"
+		pe.reference_date = nowdate()
+		pe.insert()
+		pe.submit()
+		self.assertEqual(get_outstanding(si.name, "_Test Customer 1 Renamed"), 300)
+
+		pe.cancel()
+		si.load_from_db()
+		si.cancel()
+		self.assertFalse(frappe.db.exists("Payment Ledger Entry", {"voucher_no": si.name}))
+
+		frappe.db.rollback()
+
+def get_outstanding(invoice, customer="_Test Customer"):
+	for d in get_open_items("Customer", customer, "Debtors - _TC"):
+		if d.voucher_no == invoice:
+			return flt(d.outstanding_amount)
@@ -242,13 +242,11 @@ class PaymentReconciliation(Document):
 	def check_condition(self):
 		cond = " and posting_date >= {0}".format(frappe.db.escape(self.from_date)) if self.from_date else ""
 		cond += " and posting_date <= {0}".format(frappe.db.escape(self.to_date)) if self.to_date else ""
-		dr_or_cr = ("debit_in_account_currency" if erpnext.get_party_account_type(self.party_type) == 'Receivable'
-			else "credit_in_account_currency")
 
 		if self.minimum_amount:
-			cond += " and `{0}` >= {1}".format(dr_or_cr, flt(self.minimum_amount))
+			cond += " and invoice_amount >= {0}".format(flt(self.minimum_amount))
 		if self.maximum_amount:
-			cond += " and `{0}` <= {1}".format(dr_or_cr, flt(self.maximum_amount))
+			cond += " and invoice_amount <= {0}".format(flt(self.maximum_amount))
 
 		return cond
 
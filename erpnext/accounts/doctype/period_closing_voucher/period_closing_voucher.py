@@ -17,6 +17,9 @@ class PeriodClosingVoucher(AccountsController):
 		self.make_gl_entries()
 
 	def on_cancel(self):
+		from erpnext.accounts.doctype.account_period_balance.account_period_balance import remove_account_period_balances
+
+		remove_account_period_balances("Period Closing Voucher", self.name)
 		frappe.db.sql("""delete from `tabGL Entry`
 			where voucher_type = 'Period Closing Voucher' and voucher_no=%s""", self.name)
 
@@ -32,6 +32,19 @@ class PricingRule(Document):
 
 		if not self.margin_type: self.margin_rate_or_amount = 0.0
 
+	def on_change(self):
+		self.clear_pricing_rule_index()
+
+	def on_trash(self):
+		self.clear_pricing_rule_index()
+
+	def after_rename(self, old, new, merge):
+		self.clear_pricing_rule_index()
+
+	def clear_pricing_rule_index(self):
+		from erpnext.accounts.doctype.pricing_rule.utils import clear_pricing_rule_index
+		clear_pricing_rule_index()
+
 	def validate_duplicate_apply_on(self):
 		field = apply_on_dict.get(self.apply_on)
 		values = [d.get(frappe.scrub(self.apply_on)) for d in self.get(field)]
@@ -159,16 +172,89 @@ def apply_pricing_rule(args, doc=None):
 	set_serial_nos_based_on_fifo = frappe.db.get_single_value("Stock Settings",
 		"automatically_set_serial_nos_based_on_fifo")
 
-	for item in item_list:
-		args_copy = copy.deepcopy(args)
-		args_copy.update(item)
-		data = get_pricing_rule_for_item(args_copy, item.get('price_list_rate'), doc=doc)
-		out.append(data)
-		if not item.get("serial_no") and set_serial_nos_based_on_fifo and not args.get('is_return'):
-			out[0].update(get_serial_no_for_item(args_copy))
+	# the document, items and prices are loaded once for all the rows
+	if isinstance(doc, string_types):
+		doc = json.loads(doc)
+
+	if doc:
+		doc = frappe.get_doc(doc)
+
+	items = get_item_details_map(item_list)
+	item_prices = get_item_prices_for_rows(args, item_list, items)
+	if item_prices is not None and "price_list_uom_dependant" not in args:
+		from erpnext.stock.get_item_details import get_price_list_uom_dependant
+		args.price_list_uom_dependant = get_price_list_uom_dependant(args.price_list)
+
+	frappe.flags.pricing_rule_batch_cache = {}
+	try:
+		for item in item_list:
+			args_copy = copy.deepcopy(args)
+			args_copy.update(item)
+
+			item_details = items.get(item.get("item_code"))
+			if item_details:
+				if not (args_copy.item_group and args_copy.brand):
+					args_copy.item_group, args_copy.brand = item_details.item_group, item_details.brand
+				args_copy.variant_of = item_details.variant_of
+
+			price_list_rate = None
+			if item_prices is not None and not flt(item.get("price_list_rate")):
+				price_list_rate = get_price_list_rate_for_row(args_copy, item_details, item_prices)
+				args_copy.price_list_rate = price_list_rate
+
+			data = get_pricing_rule_for_item(args_copy, args_copy.get('price_list_rate'), doc=doc)
+			if price_list_rate is not None:
+				data.setdefault("price_list_rate", price_list_rate)
+
+			out.append(data)
+			if not item.get("serial_no") and set_serial_nos_based_on_fifo and not args.get('is_return'):
+				out[0].update(get_serial_no_for_item(args_copy))
+	finally:
+		frappe.flags.pricing_rule_batch_cache = None
 
 	return out
 
+def get_item_details_map(item_list):
+	item_codes = list(set(d.get("item_code") for d in item_list if d.get("item_code")))
+	if not item_codes:
+		return {}
+
+	return dict((d.name, d) for d in frappe.get_all("Item", filters={"name": ("in", item_codes)},
+		fields=["name", "item_group", "brand", "variant_of"]))
+
+def get_item_prices_for_rows(args, item_list, items):
+	"""Returns the Item Prices of the items (and templates) of the rows without a price list rate,
+		None if there are no such rows"""
+	from erpnext.stock.get_item_details import get_item_prices
+
+	if not args.price_list:
+		return None
+
+	item_codes = set()
+	for d in item_list:
+		if d.get("item_code") and not flt(d.get("price_list_rate")):
+			item_codes.add(d.get("item_code"))
+			if items.get(d.get("item_code")) and items[d.get("item_code")].variant_of:
+				item_codes.add(items[d.get("item_code")].variant_of)
+
+	if not item_codes:
+		return None
+
+	return get_item_prices(args.price_list, list(item_codes))
+
+def get_price_list_rate_for_row(args, item_details, item_prices):
+	"""Returns the price list rate of the row in the transaction currency, like `get_price_list_rate`"""
+	from erpnext.stock.get_item_details import get_price_list_rate_for
+
+	price_list_rate = get_price_list_rate_for(args, args.item_code, item_prices.get(args.item_code, []))
+
+	# variant
+	if not price_list_rate and item_details and item_details.variant_of:
+		price_list_rate = get_price_list_rate_for(args, item_details.variant_of,
+			item_prices.get(item_details.variant_of, []))
+
+	return flt(price_list_rate) * flt(args.plc_conversion_rate or 1) / flt(args.conversion_rate or 1)
+
 def get_serial_no_for_item(args):
 	from erpnext.stock.get_item_details import get_serial_no
 
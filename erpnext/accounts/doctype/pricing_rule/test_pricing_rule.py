@@ -8,6 +8,8 @@ import frappe
 from erpnext.selling.doctype.sales_order.test_sales_order import make_sales_order
 from erpnext.accounts.doctype.sales_invoice.test_sales_invoice import create_sales_invoice
 from erpnext.stock.get_item_details import get_item_details
+from erpnext.accounts.doctype.pricing_rule.pricing_rule import apply_pricing_rule
+from erpnext.accounts.doctype.pricing_rule.utils import clear_pricing_rule_index, get_pricing_rule_index
 from frappe import MandatoryError
 
 class TestPricingRule(unittest.TestCase):
@@ -91,6 +93,7 @@ class TestPricingRule(unittest.TestCase):
 		self.assertEqual(details.get("discount_percentage"), 5)
 
 		frappe.db.sql("update `tabPricing Rule` set priority=NULL where campaign='_Test Campaign'")
+		clear_pricing_rule_index()
 		from erpnext.accounts.doctype.pricing_rule.utils import MultiplePricingRuleConflict
 		self.assertRaises(MultiplePricingRuleConflict, get_item_details, args)
 
@@ -278,6 +281,105 @@ class TestPricingRule(unittest.TestCase):
 		self.assertEquals(item.discount_amount, 110)
 		self.assertEquals(item.rate, 990)
 
+	def test_pricing_rule_index_is_rebuilt_on_change(self):
+		args = frappe._dict({
+			"item_code": "_Test Item",
+			"company": "_Test Company",
+			"price_list": "_Test Price List",
+			"currency": "_Test Currency",
+			"doctype": "Sales Order",
+			"conversion_rate": 1,
+			"price_list_currency": "_Test Currency",
+			"plc_conversion_rate": 1,
+			"order_type": "Sales",
+			"customer": "_Test Customer",
+			"name": None
+		})
+
+		get_item_details(args)
+		version = get_pricing_rule_index().version
+
+		make_pricing_rule(selling=1, apply_on="Item Group", item_group="All Item Groups", discount_percentage=10)
+		self.assertNotEqual(get_pricing_rule_index().version, version)
+		self.assertEqual(get_item_details(args).get("discount_percentage"), 10)
+
+		frappe.db.set_value("Pricing Rule", "_Test Pricing Rule", "disable", 1)
+		clear_pricing_rule_index()
+		self.assertFalse(get_item_details(args).get("discount_percentage"))
+
+	def test_apply_pricing_rule_for_all_rows(self):
+		from erpnext.stock.get_item_details import get_price_list_rate_for
+
+		make_pricing_rule(selling=1, min_qty=5, discount_percentage=10)
+
+		args = {
+			"items": [{"doctype": "Sales Order Item", "name": "row{0}".format(qty), "item_code": "_Test Item",
+				"qty": qty, "stock_qty": qty, "uom": "_Test UOM", "stock_uom": "_Test UOM",
+				"conversion_factor": 1} for qty in (1, 10)],
+			"customer": "_Test Customer",
+			"currency": "INR",
+			"conversion_rate": 1,
+			"plc_conversion_rate": 1,
+			"price_list": "_Test Price List Rest of the World",
+			"company": "_Test Company",
+			"transaction_date": frappe.utils.nowdate(),
+			"doctype": "Sales Order",
+			"name": "_Test Sales Order"
+		}
+
+		out = apply_pricing_rule(args.copy())
+		for row, data in zip(args["items"], out):
+			row_args = frappe._dict(args)
+			row_args.update(row)
+			self.assertEqual(data.price_list_rate, get_price_list_rate_for(row_args, "_Test Item") or 0)
+
+		self.assertFalse(out[0].get("discount_percentage"))
+		self.assertEqual(out[1].discount_percentage, 10)
+
+	def test_apply_pricing_rule_reads_rules_from_index(self):
+		for i in range(20):
+			make_pricing_rule(title="_Test Pricing Rule {0}".format(i), selling=1, min_qty=i * 10,
+				max_qty=i * 10 + 9, discount_percentage=i)
+
+		make_pricing_rule(title="_Test Pricing Rule Item Group", selling=1, apply_on="Item Group",
+			item_group="_Test Item Group", min_qty=1000, discount_percentage=50)
+
+		so = make_sales_order(item_list=[{"item_code": "_Test Item", "warehouse": "_Test Warehouse - _TC",
+			"qty": i + 1, "rate": 100} for i in range(100)], do_not_save=True)
+
+		args = {
+			"items": [{"doctype": "Sales Order Item", "name": "row{0}".format(i), "item_code": d.item_code,
+				"qty": d.qty, "stock_qty": d.qty, "price_list_rate": 100} for i, d in enumerate(so.items)],
+			"customer": so.customer,
+			"currency": so.currency,
+			"price_list": "_Test Price List",
+			"company": so.company,
+			"transaction_date": so.transaction_date,
+			"doctype": "Sales Order",
+			"name": "_Test Pricing Rule Index"
+		}
+
+		get_pricing_rule_index()
+
+		queries = []
+		def sql(query, *args, **kwargs):
+			queries.append(query)
+			return _sql(query, *args, **kwargs)
+
+		_sql = frappe.db.sql
+		frappe.db.sql = sql
+		try:
+			out = apply_pricing_rule(args)
+		finally:
+			frappe.db.sql = _sql
+
+		# the rules of all the rows are looked up in the index, without a query per row
+		self.assertFalse([query for query in queries if "tabPricing Rule" in query])
+
+		self.assertEqual(out[0].discount_percentage, 0)
+		self.assertEqual(out[10].discount_percentage, 1)
+		self.assertEqual(out[99].discount_percentage, 10)
+
 def make_pricing_rule(**args):
 	args = frappe._dict(args)
 
@@ -318,4 +420,6 @@ def delete_existing_pricing_rules():
 	for doctype in ["Pricing Rule", "Pricing Rule Item Code",
 		"Pricing Rule Item Group", "Pricing Rule Brand"]:
 
-		frappe.db.sql("delete from `tab{0}`".format(doctype))
\ No newline at end of file
+		frappe.db.sql("delete from `tab{0}`".format(doctype))
+
+	clear_pricing_rule_index()
\ No newline at end of file
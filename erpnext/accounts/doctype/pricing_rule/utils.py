@@ -7,7 +7,7 @@ from __future__ import unicode_literals
 import frappe, copy, json
 from frappe import throw, _
 from six import string_types
-from frappe.utils import flt, cint, get_datetime
+from frappe.utils import flt, cint, cstr, get_datetime, getdate
 from erpnext.stock.doctype.warehouse.warehouse import get_child_warehouses
 from erpnext.stock.get_item_details import get_conversion_factor
 
@@ -19,12 +19,14 @@ apply_on_table = {
     'Brand': 'brands'
 }
 
+# compiled pricing rules by site, see `get_pricing_rule_index`
+pricing_rule_indexes = {}
+
 def get_pricing_rules(args, doc=None):
 	pricing_rules = []
-	values =  {}
 
 	for apply_on in ['Item Code', 'Item Group', 'Brand']:
-		pricing_rules.extend(_get_pricing_rules(apply_on, args, values))
+		pricing_rules.extend(_get_pricing_rules(apply_on, args))
 		if pricing_rules and not apply_multiple_pricing_rules(pricing_rules):
 			break
 
@@ -44,59 +46,154 @@ def get_pricing_rules(args, doc=None):
 
 	return rules
 
-def _get_pricing_rules(apply_on, args, values):
+def _get_pricing_rules(apply_on, args):
 	apply_on_field = frappe.scrub(apply_on)
 
 	if not args.get(apply_on_field): return []
 
-	child_doc = '`tabPricing Rule {0}`'.format(apply_on)
-
-	conditions = item_variant_condition = item_conditions = ""
-	values[apply_on_field] = args.get(apply_on_field)
-	if apply_on_field in ['item_code', 'brand']:
-		item_conditions = "{child_doc}.{apply_on_field}= %({apply_on_field})s".format(child_doc=child_doc,
-			apply_on_field = apply_on_field)
+	index = get_pricing_rule_index()
 
-		if apply_on_field == 'item_code':
-			if "variant_of" not in args:
-				args.variant_of = frappe.get_cached_value("Item", args.item_code, "variant_of")
+	keys = [args.get(apply_on_field)]
+	if apply_on_field == 'item_code':
+		if "variant_of" not in args:
+			args.variant_of = frappe.get_cached_value("Item", args.item_code, "variant_of")
 
-			if args.variant_of:
-				item_variant_condition = ' or {child_doc}.item_code=%(variant_of)s '.format(child_doc=child_doc)
-				values['variant_of'] = args.variant_of
+		if args.variant_of:
+			keys.append(args.variant_of)
 	elif apply_on_field == 'item_group':
-		item_conditions = _get_tree_conditions(args, "Item Group", child_doc, False)
-
-	conditions += get_other_conditions(conditions, values, args)
-	warehouse_conditions = _get_tree_conditions(args, "Warehouse", '`tabPricing Rule`')
-	if warehouse_conditions:
-		warehouse_conditions = " and {0}".format(warehouse_conditions)
+		keys = list(get_tree_ancestors(index, "Item Group", args.item_group))
 
 	if not args.price_list: args.price_list = None
 
-	conditions += " and ifnull(`tabPricing Rule`.for_price_list, '') in (%(price_list)s, '')"
-	values["price_list"] = args.get("price_list")
-
-	pricing_rules = frappe.db.sql("""select `tabPricing Rule`.*,
-			{child_doc}.{apply_on_field}, {child_doc}.uom
-		from `tabPricing Rule`, {child_doc}
-		where ({item_conditions} or (`tabPricing Rule`.apply_rule_on_other is not null
-			and `tabPricing Rule`.{apply_on_other_field}=%({apply_on_field})s) {item_variant_condition})
-			and {child_doc}.parent = `tabPricing Rule`.name
-			and `tabPricing Rule`.disable = 0 and
-			`tabPricing Rule`.{transaction_type} = 1 {warehouse_cond} {conditions}
-		order by `tabPricing Rule`.priority desc,
-			`tabPricing Rule`.name desc""".format(
-			child_doc = child_doc,
-			apply_on_field = apply_on_field,
-			item_conditions = item_conditions,
-			item_variant_condition = item_variant_condition,
-			transaction_type = args.transaction_type,
-			warehouse_cond = warehouse_conditions,
-			apply_on_other_field = "other_{0}".format(apply_on_field),
-			conditions = conditions), values, as_dict=1) or []
-
-	return pricing_rules
+	pricing_rules = []
+	for key in keys:
+		for rule in index.rules_by_apply_on.get((apply_on_field, key), []):
+			if rule not in pricing_rules and match_pricing_rule(index, rule, args):
+				pricing_rules.append(rule)
+
+	if len(keys) > 1:
+		pricing_rules.sort(key=get_pricing_rule_sort_key, reverse=True)
+
+	# callers set properties on the rules
+	return [frappe._dict(d) for d in pricing_rules]
+
+def match_pricing_rule(index, rule, args):
+	"""Returns True if the rule applies to the transaction, the same conditions as
+		`get_other_conditions` and the warehouse and price list conditions"""
+	if not rule.get(args.transaction_type):
+		return False
+
+	if cstr(rule.for_price_list) not in (args.price_list or "", ""):
+		return False
+
+	for field in ["company", "customer", "supplier", "campaign", "sales_partner"]:
+		if cstr(rule.get(field)) not in ((args.get(field), "") if args.get(field) else ("",)):
+			return False
+
+	for parenttype in ["Customer Group", "Territory", "Supplier Group", "Warehouse"]:
+		field = frappe.scrub(parenttype)
+		if (args.get(field) and rule.get(field)
+			and rule.get(field) not in get_tree_ancestors(index, parenttype, args.get(field))):
+			return False
+
+	if args.get("transaction_date"):
+		transaction_date = getdate(args.get("transaction_date"))
+		if ((rule.valid_from and getdate(rule.valid_from) > transaction_date)
+			or (rule.valid_upto and getdate(rule.valid_upto) < transaction_date)):
+			return False
+
+	return True
+
+def get_pricing_rule_sort_key(rule):
+	# same as "order by priority desc, name desc", priority is a Select field
+	return (cstr(rule.priority), rule.name)
+
+def get_tree_ancestors(index, parenttype, name):
+	"""Returns the names of the node and its ancestors"""
+	ancestors = index.tree_ancestors[parenttype].get(name)
+	if ancestors is None:
+		frappe.throw(_("Invalid {0}").format(name))
+
+	return ancestors
+
+def get_pricing_rule_index():
+	"""Returns the enabled pricing rules of the site by the item codes, item groups and brands
+		they apply on, with the ancestors of the nodes of the trees used in the conditions.
+
+		The index is built once per process and site, and rebuilt when `clear_pricing_rule_index`
+		changes the version (on changes of Pricing Rules, which Promotional Schemes make, or of the trees)"""
+	index = getattr(frappe.local, "pricing_rule_index", None)
+	if index:
+		return index
+
+	version = frappe.cache().get_value("pricing_rule_index_version")
+	if not version:
+		version = frappe.generate_hash(length=10)
+		frappe.cache().set_value("pricing_rule_index_version", version)
+
+	index = pricing_rule_indexes.get(frappe.local.site)
+	if not index or index.version != version:
+		index = build_pricing_rule_index(version)
+		pricing_rule_indexes[frappe.local.site] = index
+
+	# the version is checked once per request
+	frappe.local.pricing_rule_index = index
+	return index
+
+def build_pricing_rule_index(version):
+	index = frappe._dict(version=version, rules_by_apply_on={}, tree_ancestors={})
+
+	pricing_rules = dict((d.name, d) for d in frappe.db.sql("""select * from `tabPricing Rule`
+		where disable = 0""", as_dict=1))
+
+	for apply_on in ['Item Code', 'Item Group', 'Brand']:
+		apply_on_field = frappe.scrub(apply_on)
+		for d in frappe.db.sql("""select parent, {0}, uom from `tabPricing Rule {1}`
+			where parenttype = 'Pricing Rule' order by idx""".format(apply_on_field, apply_on), as_dict=1):
+			if d.parent not in pricing_rules: continue
+
+			# a rule row per item code, item group or brand, like the rows of the join
+			rule = frappe._dict(pricing_rules[d.parent])
+			rule.update({apply_on_field: d.get(apply_on_field), "uom": d.uom})
+
+			keys = [d.get(apply_on_field)]
+			if rule.get("other_" + apply_on_field) and rule.get("other_" + apply_on_field) not in keys:
+				keys.append(rule.get("other_" + apply_on_field))
+
+			for key in keys:
+				index.rules_by_apply_on.setdefault((apply_on_field, key), []).append(rule)
+
+	for rules in index.rules_by_apply_on.values():
+		rules.sort(key=get_pricing_rule_sort_key, reverse=True)
+
+	for parenttype in ["Item Group", "Customer Group", "Territory", "Supplier Group", "Warehouse"]:
+		index.tree_ancestors[parenttype] = get_ancestors_by_node(parenttype)
+
+	return index
+
+def get_ancestors_by_node(parenttype):
+	ancestors_by_node, ancestors = {}, []
+	for d in frappe.db.sql("select name, lft, rgt from `tab{0}` order by lft".format(parenttype), as_dict=1):
+		while ancestors and ancestors[-1].rgt < d.lft:
+			ancestors.pop()
+
+		ancestors.append(d)
+		ancestors_by_node[d.name] = frozenset(a.name for a in ancestors)
+
+	return ancestors_by_node
+
+def clear_pricing_rule_index(doc=None, method=None):
+	from erpnext.utilities.db import run_after_commit
+
+	reset_pricing_rule_index()
+
+	# another worker may rebuild the index before the changes are committed,
+	# so the version is reset again after the commit
+	run_after_commit("erpnext.accounts.doctype.pricing_rule.utils.reset_pricing_rule_index")
+
+def reset_pricing_rule_index():
+	frappe.cache().delete_value("pricing_rule_index_version")
+	frappe.local.pricing_rule_index = None
 
 def apply_multiple_pricing_rules(pricing_rules):
 	apply_multiple_rule = [d.apply_multiple_pricing_rules
@@ -173,7 +270,8 @@ def filter_pricing_rules(args, pricing_rules, doc=None):
 
 			if (field and pricing_rules[0].get('other_' + field) != args.get(field)): return
 
-		pr_doc = frappe.get_doc('Pricing Rule', pricing_rules[0].name)
+		pr_doc = get_for_batch(('Pricing Rule', pricing_rules[0].name),
+			frappe.get_doc, 'Pricing Rule', pricing_rules[0].name)
 
 		if pricing_rules[0].mixed_conditions and doc:
 			stock_qty, amount = get_qty_and_rate_for_mixed_conditions(doc, pr_doc, args)
@@ -275,7 +373,8 @@ def filter_pricing_rules_for_qty_amount(qty, rate, pricing_rules, args=None):
 		conversion_factor = 1
 
 		if rule.get("uom"):
-			conversion_factor = get_conversion_factor(rule.item_code, rule.uom).get("conversion_factor", 1)
+			conversion_factor = get_for_batch(("conversion_factor", rule.item_code, rule.uom),
+				get_conversion_factor, rule.item_code, rule.uom).get("conversion_factor", 1)
 
 		if (flt(qty) >= (flt(rule.min_qty) * conversion_factor)
 			and (flt(qty)<= (rule.max_qty * conversion_factor) if rule.max_qty else True)):
@@ -321,8 +420,9 @@ def get_qty_and_rate_for_mixed_conditions(doc, pr_doc, args):
 	apply_on = frappe.scrub(pr_doc.get('apply_on'))
 
 	if items and doc.get("items"):
+		item_set = set(items)
 		for row in doc.get('items'):
-			if row.get(apply_on) not in items: continue
+			if row.get(apply_on) not in item_set: continue
 
 			if pr_doc.mixed_conditions:
 				amt = args.get('qty') * args.get("price_list_rate")
@@ -373,30 +473,47 @@ def get_qty_amount_data_for_cumulative(pr_doc, doc, items=[]):
 		values.extend(warehouses)
 
 	if items:
-		condition = " and `tab{child_doc}`.{apply_on} in ({items})".format(child_doc = child_doctype,
+		condition += " and `tab{child_doc}`.{apply_on} in ({items})".format(child_doc = child_doctype,
 			apply_on = apply_on, items = ','.join(['%s'] * len(items)))
 
 		values.extend(items)
 
-	data_set = frappe.db.sql(""" SELECT `tab{child_doc}`.stock_qty,
-			`tab{child_doc}`.amount
-		FROM `tab{child_doc}`, `tab{parent_doc}`
-		WHERE
-			`tab{child_doc}`.parent = `tab{parent_doc}`.name and `tab{parent_doc}`.{date_field}
-			between %s and %s and `tab{parent_doc}`.docstatus = 1
-			{condition} group by `tab{child_doc}`.name
+	query = """ SELECT sum(stock_qty) as stock_qty, sum(amount) as amount from (
+			SELECT `tab{child_doc}`.stock_qty,
+				`tab{child_doc}`.amount
+			FROM `tab{child_doc}`, `tab{parent_doc}`
+			WHERE
+				`tab{child_doc}`.parent = `tab{parent_doc}`.name and `tab{parent_doc}`.{date_field}
+				between %s and %s and `tab{parent_doc}`.docstatus = 1
+				{condition} group by `tab{child_doc}`.name
+		) items
 	""".format(parent_doc = doctype,
 		child_doc = child_doctype,
 		condition = condition,
 		date_field = date_field
-	), tuple(values), as_dict=1)
+	)
+
+	# the totals are the same for all the rows of a batch
+	data_set = get_for_batch(("cumulative", query, tuple(values)), frappe.db.sql, query, tuple(values), as_dict=1)
 
 	for data in data_set:
-		sum_qty += data.get('stock_qty')
-		sum_amt += data.get('amount')
+		sum_qty += flt(data.get('stock_qty'))
+		sum_amt += flt(data.get('amount'))
 
 	return [sum_qty, sum_amt]
 
+def get_for_batch(key, method, *args, **kwargs):
+	"""Returns `method(*args, **kwargs)`, cached by key for the rows of a call of
+		`apply_pricing_rule`, which sets `frappe.flags.pricing_rule_batch_cache`"""
+	cache = frappe.flags.pricing_rule_batch_cache
+	if cache is None:
+		return method(*args, **kwargs)
+
+	if key not in cache:
+		cache[key] = method(*args, **kwargs)
+
+	return cache[key]
+
 def validate_pricing_rules(doc):
 	validate_pricing_rule_on_transactions(doc)
 
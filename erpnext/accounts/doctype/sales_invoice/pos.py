@@ -3,21 +3,100 @@
 from __future__ import unicode_literals
 
 import json
+import zlib
 
 import frappe
 from erpnext.accounts.party import get_party_account_currency
 from erpnext.controllers.accounts_controller import get_taxes_and_charges
 from erpnext.setup.utils import get_exchange_rate
 from erpnext.stock.get_item_details import get_pos_profile
+from erpnext.stock.doctype.item_price.item_price import get_price_list_item_prices, get_item_price_for_listing
 from frappe import _
 from frappe.core.doctype.communication.email import make
-from frappe.utils import nowdate, cint
+from frappe.utils import nowdate, add_to_date, cint, cstr, flt, now, now_datetime, time_diff_in_seconds
 
 from six import string_types, iteritems
 
 
+# the snapshot of the items, prices, stock and customers of a POS Profile is rebuilt after
+# this many seconds, to pick up changes which are not tracked by modified (e.g. item group moves)
+POS_SNAPSHOT_MAX_AGE = 6 * 3600
+POS_SYNC_CHUNK_SIZE = 500
+POS_SYNC_CHUNK_EXPIRY = 600
+# changes are fetched from this many seconds before the last sync, so that records written by
+# transactions still open at the time of the last sync are not missed
+POS_SYNC_OVERLAP = 300
+
 @frappe.whitelist()
 def get_pos_data():
+	doc, pos_profile = make_pos_invoice()
+	default_print_format = pos_profile.get('print_format') or "Point of Sale"
+	print_template = frappe.db.get_value('Print Format', default_print_format, 'html')
+	snapshot = get_pos_snapshot(pos_profile, doc)
+
+	return {
+		'doc': doc,
+		'default_customer': pos_profile.get('customer'),
+		'items': list(snapshot['items'].values()),
+		'item_groups': get_item_groups(pos_profile),
+		'customers': list(snapshot.customers.values()),
+		'address': snapshot.address,
+		'contacts': snapshot.contacts,
+		'serial_no_data': get_serial_no_data(pos_profile, doc.company),
+		'batch_no_data': get_batch_no_data(),
+		'barcode_data': snapshot.barcode_data,
+		'tax_data': get_item_tax_data(),
+		'price_list_data': convert_prices(snapshot.price_list_data, doc.plc_conversion_rate),
+		'customer_wise_price_list': snapshot.customer_wise_price_list,
+		'bin_data': snapshot.bin_data,
+		'pricing_rules': get_pricing_rule_data(doc),
+		'print_template': print_template,
+		'pos_profile': pos_profile,
+		'meta': get_meta(),
+		'sync_token': snapshot.sync_token
+	}
+
+@frappe.whitelist()
+def get_pos_data_changes(sync_token, changes_id=None, chunk=0):
+	"""Returns the items, prices, stock and customers of the POS Profile changed since `sync_token`
+		(returned by `get_pos_data` or the previous call), in chunks of `POS_SYNC_CHUNK_SIZE` records.
+
+		The first call returns the first chunk, the new sync token and the number of chunks, the other
+		chunks are fetched with the returned `changes_id`. Returns `reload` if the POS Profile was changed"""
+	if changes_id:
+		chunks = frappe.cache().get_value("pos_data_changes::" + changes_id)
+		if not chunks:
+			frappe.throw(_("POS data changes have expired, please reload the Point of Sale"))
+
+		return {
+			'changes_id': changes_id,
+			'chunks': len(chunks),
+			'changes': decompress_json(chunks[cint(chunk)])
+		}
+
+	doc, pos_profile = make_pos_invoice()
+	if cstr(pos_profile.get('modified')) >= sync_token:
+		return {'reload': 1}
+
+	changes = get_pos_data_changes_since(pos_profile, doc, sync_token)
+	changes.price_list_data = convert_prices(changes.price_list_data, doc.plc_conversion_rate)
+
+	chunks = split_pos_data_changes(changes, POS_SYNC_CHUNK_SIZE)
+	out = {
+		'sync_token': changes.sync_token,
+		'chunks': len(chunks),
+		'changes': chunks[0]
+	}
+
+	if len(chunks) > 1:
+		out['changes_id'] = frappe.generate_hash(length=10)
+		frappe.cache().set_value("pos_data_changes::" + out['changes_id'],
+			[compress_json(d) for d in chunks], expires_in_sec=POS_SYNC_CHUNK_EXPIRY)
+
+	return out
+
+def make_pos_invoice():
+	"""Returns a new POS Sales Invoice with the defaults of the POS Profile of the user, and the profile"""
 	doc = frappe.new_doc('Sales Invoice')
 	doc.is_pos = 1
 	pos_profile = get_pos_profile(doc.company) or {}
@@ -36,33 +115,201 @@ def get_pos_data():
 	company_data = get_company_data(doc.company)
 	update_pos_profile_data(doc, pos_profile, company_data)
 	update_multi_mode_option(doc, pos_profile)
-	default_print_format = pos_profile.get('print_format') or "Point of Sale"
-	print_template = frappe.db.get_value('Print Format', default_print_format, 'html')
+	doc.plc_conversion_rate = update_plc_conversion_rate(doc, pos_profile)
+
+	return doc, pos_profile
+
+def get_pos_snapshot(pos_profile, doc):
+	"""Returns the items, prices, stock and customers of the POS Profile, from the cached snapshot
+		of the profile updated with the changes made since it was taken"""
+	key = "{0}::{1}".format(pos_profile.get('name'), doc.selling_price_list)
+	snapshot = frappe.cache().hget("pos_data_snapshot", key)
+	snapshot = frappe._dict(decompress_json(snapshot)) if snapshot else None
+
+	if (snapshot and cstr(pos_profile.get('modified')) < snapshot.created
+		and time_diff_in_seconds(now(), snapshot.created) < POS_SNAPSHOT_MAX_AGE):
+		changes = get_pos_data_changes_since(pos_profile, doc, snapshot.sync_token)
+		apply_pos_data_changes(snapshot, changes)
+	else:
+		snapshot = make_pos_snapshot(pos_profile, doc)
+
+	frappe.cache().hset("pos_data_snapshot", key, compress_json(snapshot))
+	return snapshot
+
+def make_pos_snapshot(pos_profile, doc):
+	sync_token, created = get_sync_token(), now()
 	items_list = get_items_list(pos_profile, doc.company)
 	customers = get_customers_list(pos_profile)
 
-	doc.plc_conversion_rate = update_plc_conversion_rate(doc, pos_profile)
-
-	return {
-		'doc': doc,
-		'default_customer': pos_profile.get('customer'),
-		'items': items_list,
-		'item_groups': get_item_groups(pos_profile),
-		'customers': customers,
+	return frappe._dict({
+		'sync_token': sync_token,
+		'created': created,
+		'items': {d.name: d for d in items_list},
+		'customers': {d.name: d for d in customers},
 		'address': get_customers_address(customers),
 		'contacts': get_contacts(customers),
-		'serial_no_data': get_serial_no_data(pos_profile, doc.company),
-		'batch_no_data': get_batch_no_data(),
 		'barcode_data': get_barcode_data(items_list),
-		'tax_data': get_item_tax_data(),
-		'price_list_data': get_price_list_data(doc.selling_price_list, doc.plc_conversion_rate),
+		'price_list_data': get_listing_prices(doc.selling_price_list),
 		'customer_wise_price_list': get_customer_wise_price_list(),
-		'bin_data': get_bin_data(pos_profile),
-		'pricing_rules': get_pricing_rule_data(doc),
-		'print_template': print_template,
-		'pos_profile': pos_profile,
-		'meta': get_meta()
-	}
+		'bin_data': get_bin_data(pos_profile)
+	})
+
+def get_pos_data_changes_since(pos_profile, doc, sync_token):
+	"""Returns the items, prices (in the price list currency), stock and customers of the POS Profile
+		changed since `sync_token`, with the removed records and the new sync token"""
+	changes = frappe._dict({
+		'sync_token': get_sync_token(),
+		'items': {},
+		'removed_items': [],
+		'barcode_data': {},
+		'price_list_data': {},
+		'removed_prices': [],
+		'customer_wise_price_list': {},
+		'bin_data': {},
+		'customers': {},
+		'removed_customers': [],
+		'address': {},
+		'contacts': {}
+	})
+
+	# items, with their barcodes
+	item_codes = get_changed_names("Item", sync_token)
+	items_list = get_items_list(pos_profile, doc.company, item_codes) if item_codes else []
+	barcode_data = get_barcode_data(items_list)
+	for d in items_list:
+		changes['items'][d.name] = d
+		changes.barcode_data[d.name] = barcode_data.get(d.name, [])
+
+	changes.removed_items = [d for d in item_codes if d not in changes['items']]
+
+	# prices
+	price_lists = set()
+	for item_price in get_changed_item_prices(sync_token):
+		price_lists.add(item_price.price_list)
+		if item_price.price_list != doc.selling_price_list:
+			continue
+
+		listing_price = get_item_price_for_listing(doc.selling_price_list, item_price.item_code)
+		if listing_price:
+			changes.price_list_data[item_price.item_code] = flt(listing_price.price_list_rate)
+		elif item_price.item_code not in changes.removed_prices:
+			changes.removed_prices.append(item_price.item_code)
+
+	# customers, with their addresses and contacts
+	customer_names = set(get_changed_names("Customer", sync_token))
+	customer_names.update(frappe.db.sql_list("""select distinct dl.link_name
+		from `tabDynamic Link` dl
+		where dl.link_doctype = 'Customer' and dl.parenttype in ('Address', 'Contact')
+			and exists(select name from `tabAddress` where name = dl.parent and modified >= %(sync_token)s
+				union all select name from `tabContact` where name = dl.parent and modified >= %(sync_token)s)""",
+		{'sync_token': sync_token}))
+
+	customers = get_customers_list(pos_profile, list(customer_names)) if customer_names else []
+	changes.customers = {d.name: d for d in customers}
+	changes.removed_customers = [d for d in customer_names if d not in changes.customers]
+	changes.address = get_customers_address(customers)
+	# None for customers without a primary contact, so that it is removed
+	contacts = get_contacts(customers)
+	changes.contacts = {d.name: contacts.get(d.name) for d in customers}
+
+	# customer wise prices, of the changed price lists and customers
+	for price_list, customer in iteritems(get_customer_price_list_mapping()):
+		if price_list in price_lists or customer in customer_names:
+			changes.customer_wise_price_list[customer] = get_listing_prices(price_list)
+
+	# stock, all the bins of the items with a changed bin
+	bin_item_codes = frappe.db.sql_list("""select distinct item_code from `tabBin`
+		where modified >= %(sync_token)s {cond}""".format(
+			cond="and warehouse = %(warehouse)s" if pos_profile.get('warehouse') else ""),
+		{'sync_token': sync_token, 'warehouse': pos_profile.get('warehouse')})
+
+	if bin_item_codes:
+		bin_data = get_bin_data(pos_profile, bin_item_codes)
+		changes.bin_data = {d: bin_data.get(d, {}) for d in bin_item_codes}
+
+	return changes
+
+def get_sync_token():
+	"""Returns the token from which the next sync fetches changes. The changes of the overlap
+		are fetched again and merged by name, both into the snapshot and on the client"""
+	return cstr(add_to_date(now_datetime(), seconds=-POS_SYNC_OVERLAP))
+
+def get_changed_names(doctype, sync_token):
+	"""Returns the names of the records of the doctype modified or deleted since `sync_token`"""
+	return frappe.db.sql_list("""select name from `tab{0}` where modified >= %(sync_token)s
+		union select deleted_name from `tabDeleted Document`
+		where deleted_doctype = %(doctype)s and creation >= %(sync_token)s""".format(doctype),
+		{'doctype': doctype, 'sync_token': sync_token})
+
+def get_changed_item_prices(sync_token):
+	"""Returns the item codes and price lists of the Item Prices modified or deleted since `sync_token`"""
+	item_prices = frappe.db.sql("""select distinct item_code, price_list from `tabItem Price`
+		where modified >= %s""", sync_token, as_dict=1)
+
+	for data in frappe.db.sql_list("""select data from `tabDeleted Document`
+		where deleted_doctype = 'Item Price' and creation >= %s""", sync_token):
+		data = json.loads(data)
+		item_prices.append(frappe._dict({'item_code': data.get('item_code'), 'price_list': data.get('price_list')}))
+
+	return item_prices
+
+def apply_pos_data_changes(snapshot, changes):
+	"""Update the snapshot with the changes, the same way the Point of Sale page merges them.
+		Each section is merged on its own, as the records of an item or customer may be in other chunks"""
+	for fieldname, removed_fieldname, related_fieldnames in (
+		('items', 'removed_items', ('barcode_data',)),
+		('price_list_data', 'removed_prices', ()),
+		('customers', 'removed_customers', ('address', 'contacts'))):
+		for name in changes[removed_fieldname]:
+			for d in (fieldname,) + related_fieldnames:
+				snapshot[d].pop(name, None)
+
+	for fieldname in ('items', 'barcode_data', 'price_list_data', 'customer_wise_price_list',
+		'customers', 'address'):
+		snapshot[fieldname].update(changes[fieldname])
+
+	# empty contacts and bins are removed
+	for fieldname in ('contacts', 'bin_data'):
+		for name, value in iteritems(changes[fieldname]):
+			if value:
+				snapshot[fieldname][name] = value
+			else:
+				snapshot[fieldname].pop(name, None)
+
+	snapshot.sync_token = changes.sync_token
+
+def split_pos_data_changes(changes, chunk_size):
+	"""Split the records of the changes in chunks of `chunk_size` records"""
+	records = []
+	for fieldname, value in iteritems(changes):
+		if isinstance(value, dict):
+			records.extend((fieldname, key, d) for key, d in iteritems(value))
+		elif isinstance(value, list):
+			records.extend((fieldname, None, d) for d in value)
+
+	chunks = []
+	for i in range(0, len(records) or 1, chunk_size):
+		chunk = {fieldname: ({} if isinstance(value, dict) else [])
+			for fieldname, value in iteritems(changes) if isinstance(value, (dict, list))}
+
+		for fieldname, key, d in records[i:i + chunk_size]:
+			if key is None:
+				chunk[fieldname].append(d)
+			else:
+				chunk[fieldname][key] = d
+
+		chunks.append(chunk)
+
+	return chunks
+
+def compress_json(data):
+	return zlib.compress(frappe.as_json(data, indent=None).encode('utf-8'))
+
+def decompress_json(data):
+	return json.loads(zlib.decompress(data).decode('utf-8'))
+
+def convert_prices(prices, conversion_rate):
+	return {item_code: price_list_rate * flt(conversion_rate) for item_code, price_list_rate in iteritems(prices)}
 
 def update_plc_conversion_rate(doc, pos_profile):
 	conversion_rate = 1.0
@@ -162,7 +409,7 @@ def update_tax_table(doc):
 		doc.append('taxes', tax)
 
 
-def get_items_list(pos_profile, company):
+def get_items_list(pos_profile, company, item_codes=None):
 	cond = ""
 	args_list = []
 	if pos_profile.get('item_groups'):
@@ -172,6 +419,10 @@ def get_items_list(pos_profile, company):
 		if args_list:
 			cond = "and i.item_group in (%s)" % (', '.join(['%s'] * len(args_list)))
 
+	if item_codes:
+		cond += " and i.name in (%s)" % (', '.join(['%s'] * len(item_codes)))
+		args_list.extend(item_codes)
+
 	return frappe.db.sql("""
 		select
 			i.name, i.item_code, i.item_name, i.description, i.item_group, i.has_batch_no,
@@ -198,7 +449,7 @@ def get_item_groups(pos_profile):
 	return item_group_dict
 
 
-def get_customers_list(pos_profile={}):
+def get_customers_list(pos_profile={}, customer_names=None):
 	cond = "1=1"
 	customer_groups = []
 	if pos_profile.get('customer_groups'):
@@ -207,6 +458,10 @@ def get_customers_list(pos_profile={}):
 			customer_groups.extend([d.name for d in get_child_nodes('Customer Group', d.customer_group)])
 		cond = "customer_group in (%s)" % (', '.join(['%s'] * len(customer_groups)))
 
+	if customer_names:
+		cond += " and name in (%s)" % (', '.join(['%s'] * len(customer_names)))
+		customer_groups.extend(customer_names)
+
 	return frappe.db.sql(""" select name, customer_name, customer_group,
 		territory, customer_pos_id from tabCustomer where disabled = 0
 		and {cond}""".format(cond=cond), tuple(customer_groups), as_dict=1) or {}
@@ -217,35 +472,37 @@ def get_customers_address(customers):
 	if isinstance(customers, string_types):
 		customers = [frappe._dict({'name': customers})]
 
+	addresses = get_primary_linked_records('Address', """name, address_line1, address_line2, city, state,
+		email_id, phone, fax, pincode""", 'is_primary_address', [data.name for data in customers])
+
 	for data in customers:
-		address = frappe.db.sql(""" select name, address_line1, address_line2, city, state,
-			email_id, phone, fax, pincode from `tabAddress` where is_primary_address =1 and name in
-			(select parent from `tabDynamic Link` where link_doctype = 'Customer' and link_name = %s
-			and parenttype = 'Address')""", data.name, as_dict=1)
-		address_data = {}
-		if address:
-			address_data = address[0]
-
-		address_data.update({'full_name': data.customer_name, 'customer_pos_id': data.customer_pos_id})
+		address_data = addresses.get(data.name) or {}
+		address_data.update({'full_name': data.get('customer_name'), 'customer_pos_id': data.get('customer_pos_id')})
 		customer_address[data.name] = address_data
 
 	return customer_address
 
 
 def get_contacts(customers):
-	customer_contact = {}
 	if isinstance(customers, string_types):
 		customers = [frappe._dict({'name': customers})]
 
-	for data in customers:
-		contact = frappe.db.sql(""" select email_id, phone, mobile_no from `tabContact`
-			where is_primary_contact=1 and name in
-			(select parent from `tabDynamic Link` where link_doctype = 'Customer' and link_name = %s
-			and parenttype = 'Contact')""", data.name, as_dict=1)
-		if contact:
-			customer_contact[data.name] = contact[0]
+	return get_primary_linked_records('Contact', "email_id, phone, mobile_no", 'is_primary_contact',
+		[data.name for data in customers])
+
 
-	return customer_contact
+def get_primary_linked_records(doctype, fields, primary_field, customers, batch_size=1000):
+	# first primary Address / Contact of each customer
+	records = {}
+	for i in range(0, len(customers), batch_size):
+		batch = customers[i:i + batch_size]
+		for d in frappe.db.sql(""" select dl.link_name as customer, {fields} from `tab{doctype}` t, `tabDynamic Link` dl
+			where dl.parent = t.name and dl.parenttype = %s and dl.link_doctype = 'Customer'
+			and dl.link_name in ({names}) and t.{primary_field} = 1""".format(fields=fields, doctype=doctype,
+				primary_field=primary_field, names=', '.join(['%s'] * len(batch))), tuple([doctype] + batch), as_dict=1):
+			records.setdefault(d.pop('customer'), d)
+
+	return records
 
 
 def get_child_nodes(group_type, root):
@@ -295,20 +552,19 @@ def get_batch_no_data():
 
 
 def get_barcode_data(items_list):
-	# get itemwise batch no data
-	# exmaple: {'LED-GRE': [Batch001, Batch002]}
-	# where LED-GRE is item code, SN0001 is serial no and Pune is warehouse
+	# get itemwise barcode data
+	# exmaple: {'LED-GRE': ['8901234567890']}
 
 	itemwise_barcode = {}
-	for item in items_list:
+	item_codes = [item.get('item_code') for item in items_list]
+	for i in range(0, len(item_codes), 1000):
+		batch = item_codes[i:i + 1000]
 		barcodes = frappe.db.sql("""
-			select barcode from `tabItem Barcode` where parent = %s
-		""", item.item_code, as_dict=1)
+			select parent, barcode from `tabItem Barcode` where parent in ({0}) order by idx
+		""".format(', '.join(['%s'] * len(batch))), tuple(batch), as_dict=1)
 
 		for barcode in barcodes:
-			if item.item_code not in itemwise_barcode:
-				itemwise_barcode.setdefault(item.item_code, [])
-			itemwise_barcode[item.item_code].append(barcode.get("barcode"))
+			itemwise_barcode.setdefault(barcode.parent, []).append(barcode.get("barcode"))
 
 	return itemwise_barcode
 
@@ -330,40 +586,49 @@ def get_item_tax_data():
 
 def get_price_list_data(selling_price_list, conversion_rate):
 	itemwise_price_list = {}
-	price_lists = frappe.db.sql("""Select ifnull(price_list_rate, 0) as price_list_rate,
-		item_code from `tabItem Price` ip where price_list = %(price_list)s""",
-        {'price_list': selling_price_list}, as_dict=1)
-
-	for item in price_lists:
-		itemwise_price_list[item.item_code] = item.price_list_rate * conversion_rate
+	for item_code, price_list_rate in iteritems(get_listing_prices(selling_price_list)):
+		itemwise_price_list[item_code] = price_list_rate * conversion_rate
 
 	return itemwise_price_list
 
-def get_customer_wise_price_list():
-	customer_wise_price = {}
-	customer_price_list_mapping = frappe._dict(frappe.get_all('Customer',fields = ['default_price_list', 'name'], as_list=1))
+def get_listing_prices(price_list):
+	"""Returns the price list rates of the items, from the cached Item Prices of the price list"""
+	prices = {}
+	if not price_list:
+		return prices
 
-	price_lists = frappe.db.sql(""" Select ifnull(price_list_rate, 0) as price_list_rate,
-		item_code, price_list from `tabItem Price` """, as_dict=1)
+	for item_code in get_price_list_item_prices(price_list):
+		item_price = get_item_price_for_listing(price_list, item_code)
+		if item_price:
+			prices[item_code] = flt(item_price.price_list_rate)
 
-	for item in price_lists:
-		if item.price_list and customer_price_list_mapping.get(item.price_list):
+	return prices
 
-			customer_wise_price.setdefault(customer_price_list_mapping.get(item.price_list),{}).setdefault(
-				item.item_code, item.price_list_rate
-			)
+def get_customer_wise_price_list():
+	customer_wise_price = {}
+	for price_list, customer in iteritems(get_customer_price_list_mapping()):
+		customer_wise_price[customer] = get_listing_prices(price_list)
 
 	return customer_wise_price
 
-def get_bin_data(pos_profile):
+def get_customer_price_list_mapping():
+	customer_price_list_mapping = frappe._dict(frappe.get_all('Customer',fields = ['default_price_list', 'name'], as_list=1))
+	return {price_list: customer for price_list, customer in iteritems(customer_price_list_mapping)
+		if price_list and customer}
+
+def get_bin_data(pos_profile, item_codes=None):
 	itemwise_bin_data = {}
 	cond = "1=1"
 	if pos_profile.get('warehouse'):
 		cond = "warehouse = %(warehouse)s"
 
+	if item_codes:
+		cond += " and item_code in %(item_codes)s"
+
 	bin_data = frappe.db.sql(""" select item_code, warehouse, actual_qty from `tabBin`
 		where actual_qty > 0 and {cond}""".format(cond=cond), {
-			'warehouse': frappe.db.escape(pos_profile.get('warehouse'))
+			'warehouse': pos_profile.get('warehouse'),
+			'item_codes': tuple(item_codes or [])
 		}, as_dict=1)
 
 	for bins in bin_data:
@@ -5,7 +5,7 @@ from __future__ import unicode_literals
 import frappe
 
 import unittest, copy, time
-from frappe.utils import nowdate, flt, getdate, cint
+from frappe.utils import nowdate, flt, getdate, cint, now
 from frappe.model.dynamic_links import get_dynamic_link_map
 from erpnext.stock.doctype.stock_entry.test_stock_entry import make_stock_entry, get_qty_after_transaction
 from erpnext.accounts.doctype.purchase_invoice.test_purchase_invoice import unlink_payment_on_cancel_of_invoice
@@ -782,6 +782,52 @@ class TestSalesInvoice(unittest.TestCase):
 		if allow_negative_stock:
 			frappe.db.set_value('Stock Settings', None, 'allow_negative_stock', 1)
 
+	def test_pos_data_changes(self):
+		from erpnext.accounts.doctype.sales_invoice.pos import (get_pos_data_changes_since,
+			split_pos_data_changes, apply_pos_data_changes)
+		from erpnext.stock.doctype.item.test_item import make_item
+		from frappe.utils import add_to_date, now_datetime
+
+		pos_profile = make_pos_profile()
+		doc = frappe._dict(company="_Test Company", selling_price_list="_Test Price List")
+		item = make_item("_Test POS Sync Item")
+		frappe.db.sql("delete from `tabItem Price` where item_code = %s", item.name)
+
+		sync_token = now()
+		item.description = "_Test POS Sync Item " + sync_token
+		item.save()
+		item_price = frappe.get_doc({
+			"doctype": "Item Price",
+			"price_list": "_Test Price List",
+			"item_code": item.name,
+			"price_list_rate": 123
+		}).insert()
+
+		changes = get_pos_data_changes_since(pos_profile, doc, sync_token)
+		self.assertEqual(changes['items'][item.name].description, item.description)
+		self.assertEqual(changes.price_list_data.get(item.name), 123)
+
+		chunks = split_pos_data_changes(changes, 1)
+		self.assertEqual(len(chunks), sum(len(d) for d in changes.values() if isinstance(d, (dict, list))))
+
+		# merging the chunks one by one gives the same data as merging all the changes
+		snapshot, chunked_snapshot = [frappe._dict({fieldname: {} for fieldname in ('items', 'barcode_data',
+			'price_list_data', 'customer_wise_price_list', 'bin_data', 'customers', 'address', 'contacts')})
+			for i in range(2)]
+		apply_pos_data_changes(snapshot, changes)
+		for chunk in chunks:
+			apply_pos_data_changes(chunked_snapshot, frappe._dict(chunk, sync_token=changes.sync_token))
+		self.assertEqual(chunked_snapshot, snapshot)
+
+		# written by a transaction still open at the last sync
+		frappe.db.sql("""update `tabItem` set modified = %s where name = %s""",
+			(add_to_date(now_datetime(), seconds=-60), item.name))
+
+		item_price.delete()
+		changes = get_pos_data_changes_since(pos_profile, doc, changes.sync_token)
+		self.assertTrue(item.name in changes['items'])
+		self.assertTrue(item.name in changes.removed_prices)
+
 	def pos_gl_entry(self, si, pos, cash_amount):
 		# check stock ledger entries
 		sle = frappe.db.sql("""select * from `tabStock Ledger Entry`
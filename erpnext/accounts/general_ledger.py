@@ -6,20 +6,29 @@ import frappe, erpnext
 from frappe.utils import flt, cstr, cint
 from frappe import _
 from frappe.model.meta import get_field_precision
+from six import iteritems
 from erpnext.accounts.doctype.budget.budget import validate_expense_against_budget
 from erpnext.accounts.doctype.accounting_dimension.accounting_dimension import get_accounting_dimensions
+from erpnext.accounts.doctype.account_period_balance.account_period_balance import (update_account_period_balances,
+	remove_account_period_balances)
+from erpnext.accounts.doctype.payment_ledger_entry.payment_ledger_entry import (update_payment_ledger,
+	remove_payment_ledger_entries)
 
 
 class ClosedAccountingPeriod(frappe.ValidationError): pass
 class StockAccountInvalidTransaction(frappe.ValidationError): pass
 
-def make_gl_entries(gl_map, cancel=False, adv_adj=False, merge_entries=True, update_outstanding='Yes', from_repost=False):
+# vouchers with at least so many GL entries are posted in bulk
+BULK_INSERT_THRESHOLD = 20
+
+def make_gl_entries(gl_map, cancel=False, adv_adj=False, merge_entries=True, update_outstanding='Yes',
+	from_repost=False, bulk_insert=None):
 	if gl_map:
 		if not cancel:
 			validate_accounting_period(gl_map)
 			gl_map = process_gl_map(gl_map, merge_entries)
 			if gl_map and len(gl_map) > 1:
-				save_entries(gl_map, adv_adj, update_outstanding, from_repost)
+				save_entries(gl_map, adv_adj, update_outstanding, from_repost, bulk_insert)
 			else:
 				frappe.throw(_("Incorrect number of General Ledger Entries found. You might have selected a wrong Account in the transaction."))
 		else:
@@ -73,11 +82,13 @@ def process_gl_map(gl_map, merge_entries=True):
 
 def merge_similar_entries(gl_map):
 	merged_gl_map = []
-	accounting_dimensions = get_accounting_dimensions()
+	merge_properties = get_merge_properties(get_accounting_dimensions())
+	merge_map = {}
 	for entry in gl_map:
 		# if there is already an entry in this account then just add it
 		# to that entry
-		same_head = check_if_in_list(entry, merged_gl_map, accounting_dimensions)
+		merge_key = get_merge_key(entry, merge_properties)
+		same_head = merge_map.get(merge_key)
 		if same_head:
 			same_head.debit	= flt(same_head.debit) + flt(entry.debit)
 			same_head.debit_in_account_currency	= \
@@ -86,6 +97,7 @@ def merge_similar_entries(gl_map):
 			same_head.credit_in_account_currency = \
 				flt(same_head.credit_in_account_currency) + flt(entry.credit_in_account_currency)
 		else:
+			merge_map[merge_key] = entry
 			merged_gl_map.append(entry)
 
 	# filter zero debit and credit entries
@@ -94,38 +106,56 @@ def merge_similar_entries(gl_map):
 
 	return merged_gl_map
 
-def check_if_in_list(gle, gl_map, dimensions=None):
-	account_head_fieldnames = ['party_type', 'party', 'against_voucher', 'against_voucher_type',
+@erpnext.allow_regional
+def get_merge_properties(dimensions=None):
+	"""Returns the fields, other than account, which must match for GL entries to be merged"""
+	merge_properties = ['party_type', 'party', 'against_voucher', 'against_voucher_type',
 		'cost_center', 'project']
 
 	if dimensions:
-		account_head_fieldnames = account_head_fieldnames + dimensions
+		merge_properties = merge_properties + dimensions
 
-	for e in gl_map:
-		same_head = True
-		if e.account != gle.account:
-			same_head = False
+	return merge_properties
 
-		for fieldname in account_head_fieldnames:
-			if cstr(e.get(fieldname)) != cstr(gle.get(fieldname)):
-				same_head = False
+def get_merge_key(entry, merge_properties):
+	return (entry.account,) + tuple(cstr(entry.get(fieldname)) for fieldname in merge_properties)
 
-		if same_head:
+def check_if_in_list(gle, gl_map, dimensions=None):
+	merge_properties = get_merge_properties(dimensions)
+	merge_key = get_merge_key(gle, merge_properties)
+
+	for e in gl_map:
+		if get_merge_key(e, merge_properties) == merge_key:
 			return e
 
-def save_entries(gl_map, adv_adj, update_outstanding, from_repost=False):
+def save_entries(gl_map, adv_adj, update_outstanding, from_repost=False, bulk_insert=None):
 	if not from_repost:
 		validate_account_for_perpetual_inventory(gl_map)
 		validate_cwip_accounts(gl_map)
 
 	round_off_debit_credit(gl_map)
 
-	for entry in gl_map:
-		make_entry(entry, adv_adj, update_outstanding, from_repost)
+	if bulk_insert is None:
+		bulk_insert = len(gl_map) >= BULK_INSERT_THRESHOLD and not has_gl_entry_hooks()
+
+	if bulk_insert:
+		gl_entries = make_entries_in_bulk(gl_map, adv_adj, update_outstanding, from_repost)
 
 		# check against budget
 		if not from_repost:
-			validate_expense_against_budget(entry)
+			for entry in gl_map:
+				validate_expense_against_budget(entry)
+	else:
+		gl_entries = []
+		for entry in gl_map:
+			gl_entries.append(make_entry(entry, adv_adj, update_outstanding, from_repost))
+
+			# check against budget
+			if not from_repost:
+				validate_expense_against_budget(entry)
+
+	update_account_period_balances(gl_entries)
+	update_payment_ledger(gl_entries)
 
 def make_entry(args, adv_adj, update_outstanding, from_repost=False):
 	args.update({"doctype": "GL Entry"})
@@ -135,6 +165,91 @@ def make_entry(args, adv_adj, update_outstanding, from_repost=False):
 	gle.insert()
 	gle.run_method("on_update_with_args", adv_adj, update_outstanding, from_repost)
 	gle.submit()
+	return gle
+
+def make_entries_in_bulk(gl_map, adv_adj, update_outstanding, from_repost=False):
+	"""Validate all entries of the voucher with shared master lookups, insert them
+		with multi-row inserts and update outstanding once per against voucher"""
+	from erpnext.accounts.doctype.gl_entry.gl_entry import (get_account_details, bulk_insert_gl_entries,
+		check_freezing_date, validate_frozen_account, validate_balance_type, update_outstanding_amt)
+	from erpnext.accounts.doctype.accounting_dimension.accounting_dimension import get_checks_for_pl_and_bs_accounts
+
+	account_details = get_account_details(list(set(d.account for d in gl_map if d.account)))
+	cost_center_company = {}
+	pl_and_bs_dimensions = get_checks_for_pl_and_bs_accounts()
+
+	gl_entries = []
+	for args in gl_map:
+		args.update({"doctype": "GL Entry"})
+		gle = frappe.get_doc(args)
+		gle.flags.ignore_permissions = 1
+		gle.flags.from_repost = from_repost
+		gle.account_details = account_details
+		gle.cost_center_company = cost_center_company
+		gle.pl_and_bs_dimensions = pl_and_bs_dimensions
+
+		gle.validate()
+		if not from_repost:
+			gle.validate_account_details(adv_adj)
+
+		gl_entries.append(gle)
+
+	accounts = sorted(set(gle.account for gle in gl_entries))
+	if not from_repost:
+		for posting_date in set(gle.posting_date for gle in gl_entries):
+			check_freezing_date(posting_date, adv_adj)
+
+	for account in accounts:
+		validate_frozen_account(account, adv_adj)
+
+	bulk_insert_gl_entries(gl_entries)
+
+	for account in accounts:
+		validate_balance_type(account, adv_adj)
+
+	# Update outstanding amt on against vouchers
+	if update_outstanding == 'Yes' and not from_repost:
+		against_vouchers = get_entries_by_against_voucher([gle for gle in gl_entries
+			if gle.against_voucher_type in ['Journal Entry', 'Sales Invoice', 'Purchase Invoice', 'Fees']
+				and gle.against_voucher])
+
+		for args, entries in against_vouchers:
+			update_outstanding_amt(*args, gl_entries=entries)
+
+	return gl_entries
+
+def get_entries_by_against_voucher(gl_entries):
+	"""Returns [((account, party_type, party, against_voucher_type, against_voucher), entries)]"""
+	against_vouchers = {}
+	for gle in gl_entries:
+		key = (gle.get("account"), gle.get("party_type"), gle.get("party"),
+			gle.get("against_voucher_type"), gle.get("against_voucher"))
+		against_vouchers.setdefault(key, []).append(gle)
+
+	return sorted(against_vouchers.items(), key=lambda d: [cstr(v) for v in d[0]])
+
+# events run when a GL Entry is inserted as a document
+GL_ENTRY_EVENTS = ("before_insert", "before_validate", "validate", "before_save", "after_insert", "on_update",
+	"on_update_with_args", "before_submit", "on_submit", "on_change")
+
+def has_gl_entry_hooks():
+	"""GL Entries are inserted as documents if apps hook into their events, for GL Entry or "*".
+		The generic "*" handlers of frappe (notifications, feed etc.) are not run for bulk inserted entries"""
+	for app in frappe.get_installed_apps():
+		if app != "frappe" and hooks_into_gl_entry(frappe.get_hooks("doc_events", {}, app_name=app)):
+			return True
+
+	return False
+
+def hooks_into_gl_entry(doc_events):
+	for doctypes, events in iteritems(doc_events):
+		if "GL Entry" in (doctypes if isinstance(doctypes, (list, tuple)) else [doctypes]):
+			return True
+
+		if doctypes == "*" and any(event in GL_ENTRY_EVENTS for event in events):
+			return True
+
+	return False
 
 def validate_account_for_perpetual_inventory(gl_map):
 	if cint(erpnext.is_perpetual_inventory_enabled(gl_map[0].company)) \
@@ -237,17 +352,21 @@ def delete_gl_entries(gl_entries=None, voucher_type=None, voucher_no=None,
 		check_freezing_date, update_outstanding_amt, validate_frozen_account
 
 	if not gl_entries:
-		gl_entries = frappe.db.sql("""
-			select account, posting_date, party_type, party, cost_center, fiscal_year,voucher_type,
-			voucher_no, against_voucher_type, against_voucher, cost_center, company
-			from `tabGL Entry`
-			where voucher_type=%s and voucher_no=%s""", (voucher_type, voucher_no), as_dict=True)
+		gl_entries = get_voucher_gl_entries(voucher_type, voucher_no)
 
 	if gl_entries:
 		check_freezing_date(gl_entries[0]["posting_date"], adv_adj)
 
+	voucher_type = voucher_type or gl_entries[0]["voucher_type"]
+	voucher_no = voucher_no or gl_entries[0]["voucher_no"]
+
+	# amounts of the entries being deleted, to reverse them in the outstanding of against vouchers
+	posted_gl_entries = get_voucher_gl_entries(voucher_type, voucher_no)
+
+	remove_account_period_balances(voucher_type, voucher_no)
+	remove_payment_ledger_entries(voucher_type, voucher_no)
 	frappe.db.sql("""delete from `tabGL Entry` where voucher_type=%s and voucher_no=%s""",
-		(voucher_type or gl_entries[0]["voucher_type"], voucher_no or gl_entries[0]["voucher_no"]))
+		(voucher_type, voucher_no))
 
 	for entry in gl_entries:
 		validate_frozen_account(entry["account"], adv_adj)
@@ -255,6 +374,14 @@ def delete_gl_entries(gl_entries=None, voucher_type=None, voucher_no=None,
 		if not adv_adj:
 			validate_expense_against_budget(entry)
 
-		if entry.get("against_voucher") and update_outstanding == 'Yes' and not adv_adj:
-			update_outstanding_amt(entry["account"], entry.get("party_type"), entry.get("party"), entry.get("against_voucher_type"),
-				entry.get("against_voucher"), on_cancel=True)
+	if update_outstanding == 'Yes' and not adv_adj:
+		for args, entries in get_entries_by_against_voucher([d for d in posted_gl_entries if d.against_voucher]):
+			update_outstanding_amt(*args, on_cancel=True, gl_entries=entries)
+
+def get_voucher_gl_entries(voucher_type, voucher_no):
+	return frappe.db.sql("""
+		select account, posting_date, party_type, party, cost_center, fiscal_year,voucher_type,
+		voucher_no, against_voucher_type, against_voucher, cost_center, company,
+		debit_in_account_currency, credit_in_account_currency
+		from `tabGL Entry`
+		where voucher_type=%s and voucher_no=%s""", (voucher_type, voucher_no), as_dict=True)
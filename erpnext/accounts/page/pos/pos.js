@@ -319,6 +319,7 @@ erpnext.pos.PointOfSale = erpnext.taxes_and_totals.extend({
 		this.print_template = r.message.print_template;
 		this.pos_profile_data = r.message.pos_profile;
 		this.default_customer = r.message.default_customer || null;
+		this.sync_token = r.message.sync_token;
 		this.print_settings = locals[":Print Settings"]["Print Settings"];
 		this.letter_head = (this.pos_profile_data.length > 0) ? frappe.boot.letter_heads[this.pos_profile_data[letter_head]] : {};
 	},
@@ -1755,9 +1756,130 @@ erpnext.pos.PointOfSale = erpnext.taxes_and_totals.extend({
 		setInterval(function () {
 			me.freeze_screen = false;
 			me.sync_sales_invoice()
+			me.sync_master_data()
 		}, 180000)
 	},
 
+	sync_master_data: function () {
+		// fetch the items, prices, stock and customers changed since the last sync, chunk by chunk
+		var me = this;
+		if (!this.sync_token || !this.connection_status) {
+			return;
+		}
+
+		var get_changes = function (args) {
+			frappe.call({
+				method: "erpnext.accounts.doctype.sales_invoice.pos.get_pos_data_changes",
+				args: args,
+				callback: function (r) {
+					if (!r.message) {
+						return;
+					}
+
+					if (r.message.reload) {
+						// the POS Profile was changed, fetch all the master data again
+						me.reload_master_data();
+						return;
+					}
+
+					me.apply_master_data_changes(r.message.changes);
+					if (r.message.sync_token) {
+						me.next_sync_token = r.message.sync_token;
+					}
+
+					var chunk = cint(args.chunk) + 1;
+					if (chunk < r.message.chunks) {
+						get_changes({
+							sync_token: me.sync_token,
+							changes_id: r.message.changes_id,
+							chunk: chunk
+						});
+					} else {
+						me.sync_token = me.next_sync_token;
+						me.prepare_customer_mapper();
+						me.autocomplete_customers();
+					}
+				}
+			});
+		};
+
+		get_changes({sync_token: this.sync_token, chunk: 0});
+	},
+
+	reload_master_data: function () {
+		var me = this;
+		frappe.call({
+			method: "erpnext.accounts.doctype.sales_invoice.pos.get_pos_data",
+			callback: function (r) {
+				if (r.message) {
+					localStorage.setItem('doc', JSON.stringify(r.message.doc));
+					me.init_master_data(r);
+					me.items = me.item_data;
+					me.prepare_customer_mapper();
+					me.autocomplete_customers();
+				}
+			}
+		});
+	},
+
+	apply_master_data_changes: function (changes) {
+		// each section is merged on its own, the records of an item or customer may be in other chunks.
+		// Records are merged by name, as the changes overlap with the ones of the previous sync
+		var me = this;
+		var item_data = {};
+		$.each(this.item_data || [], function (i, item) {
+			item_data[item.name] = item;
+		});
+
+		var customers = {};
+		$.each(this.customers || [], function (i, customer) {
+			customers[customer.name] = customer;
+		});
+
+		$.each(changes.removed_items, function (i, item_code) {
+			delete item_data[item_code];
+			delete me.barcode_data[item_code];
+		});
+		$.each(changes.items, function (item_code, item) {
+			item_data[item_code] = item;
+		});
+		$.extend(this.barcode_data, changes.barcode_data);
+
+		$.each(changes.removed_prices, function (i, item_code) {
+			delete me.price_list_data[item_code];
+		});
+		$.extend(this.price_list_data, changes.price_list_data);
+		$.extend(this.customer_wise_price_list, changes.customer_wise_price_list);
+
+		$.each(changes.bin_data, function (item_code, bins) {
+			if ($.isEmptyObject(bins)) {
+				delete me.bin_data[item_code];
+			} else {
+				me.bin_data[item_code] = bins;
+			}
+		});
+
+		$.each(changes.removed_customers, function (i, customer) {
+			delete customers[customer];
+			delete me.address[customer];
+			delete me.contacts[customer];
+		});
+		$.each(changes.customers, function (name, customer) {
+			customers[name] = customer;
+		});
+		$.extend(this.address, changes.address);
+		$.each(changes.contacts, function (name, contact) {
+			if (contact) {
+				me.contacts[name] = contact;
+			} else {
+				delete me.contacts[name];
+			}
+		});
+
+		this.item_data = Object.values(item_data);
+		this.customers = Object.values(customers);
+	},
+
 	sync_sales_invoice: function () {
 		var me = this;
 		this.si_docs = this.get_submitted_invoice() || [];
@@ -6,6 +6,7 @@ import frappe, erpnext
 from frappe import _, scrub
 from frappe.utils import getdate, nowdate, flt, cint, formatdate, cstr, now, time_diff_in_seconds
 from collections import OrderedDict
+from bisect import bisect_left
 from erpnext.accounts.utils import get_currency_precision
 from erpnext.accounts.doctype.accounting_dimension.accounting_dimension import get_accounting_dimensions
 
@@ -63,21 +64,30 @@ class ReceivablePayableReport(object):
 		self.voucher_balance = OrderedDict()
 		self.init_voucher_balance() # invoiced, paid, credit_note, outstanding
 
+		# Get return entries
+		self.get_return_entries()
+
+		self.data = []
+		for gle in self.gl_entries:
+			self.update_voucher_balance(gle)
+
+		# details are only fetched for vouchers with outstanding, in bulk
+		self.set_outstanding()
+
 		# Build delivery note map against all sales invoices
 		self.build_delivery_note_map()
 
 		# Get invoice details like bill_no, due_date etc for all invoices
 		self.get_invoice_details()
 
-		# fetch future payments against invoices
-		self.get_future_payments()
+		# Get payment schedules of all invoices
+		self.get_payment_schedules()
 
-		# Get return entries
-		self.get_return_entries()
+		# Get customer / supplier details of all parties
+		self.get_all_party_details()
 
-		self.data = []
-		for gle in self.gl_entries:
-			self.update_voucher_balance(gle)
+		# fetch future payments against invoices
+		self.get_future_payments()
 
 		self.build_data()
 
@@ -99,34 +109,29 @@ class ReceivablePayableReport(object):
 					credit_note = 0.0,
 					outstanding = 0.0
 				)
-			self.get_invoices(gle)
-
-	def get_invoices(self, gle):
-		if gle.voucher_type in ('Sales Invoice', 'Purchase Invoice'):
-			self.invoices.add(gle.voucher_no)
 
 	def update_voucher_balance(self, gle):
 		# get the row where this balance needs to be updated
 		# if its a payment, it will return the linked invoice or will be considered as advance
 		row = self.get_voucher_balance(gle)
-		# gle_balance will be the total "debit - credit" for receivable type reports and
-		# and vice-versa for payable type reports
-		gle_balance = self.get_gle_balance(gle)
-		if gle_balance > 0:
+		# positive_balance and negative_balance are the totals of "debit - credit" of the
+		# entries for receivable type reports (and vice-versa for payable type reports)
+		if gle.positive_balance > 0:
 			if gle.voucher_type in ('Journal Entry', 'Payment Entry') and gle.against_voucher:
 				# debit against sales / purchase invoice
-				row.paid -= gle_balance
+				row.paid -= gle.positive_balance
 			else:
 				# invoice
-				row.invoiced += gle_balance
-		else:
+				row.invoiced += gle.positive_balance
+
+		if gle.negative_balance < 0:
 			# payment or credit note for receivables
 			if self.is_invoice(gle):
 				# stand alone debit / credit note
-				row.credit_note -= gle_balance
+				row.credit_note -= gle.negative_balance
 			else:
 				# advance / unlinked payment or other adjustment
-				row.paid -= gle_balance
+				row.paid -= gle.negative_balance
 
 	def get_voucher_balance(self, gle):
 		voucher_balance = None
@@ -152,14 +157,23 @@ class ReceivablePayableReport(object):
 
 		return voucher_balance
 
-	def build_data(self):
+	def set_outstanding(self):
 		# set outstanding for all the accumulated balances
 		# as we can use this to filter out invoices without outstanding
+		self.outstanding_keys, self.outstanding_vouchers = set(), set()
 		for key, row in self.voucher_balance.items():
 			row.outstanding = flt(row.invoiced - row.paid - row.credit_note, self.currency_precision)
 			row.invoice_grand_total = row.invoiced
 
 			if abs(row.outstanding) > 0.1/10 ** self.currency_precision:
+				self.outstanding_keys.add(key)
+				self.outstanding_vouchers.add((row.voucher_type, row.voucher_no))
+				if self.is_invoice(row):
+					self.invoices.add(row.voucher_no)
+
+	def build_data(self):
+		for key, row in self.voucher_balance.items():
+			if key in self.outstanding_keys:
 				# non-zero oustanding, we must consider this row
 
 				if self.is_invoice(row) and self.filters.based_on_payment_terms:
@@ -206,66 +220,71 @@ class ReceivablePayableReport(object):
 		if self.invoices and self.filters.show_delivery_notes:
 			self.delivery_notes = frappe._dict()
 
-			# delivery note link inside sales invoice
-			si_against_dn = frappe.db.sql("""
-				select parent, delivery_note
-				from `tabSales Invoice Item`
-				where docstatus=1 and parent in (%s)
-			""" % (','.join(['%s'] * len(self.invoices))), tuple(self.invoices), as_dict=1)
+			for invoices in get_batches(self.invoices):
+				# delivery note link inside sales invoice
+				si_against_dn = frappe.db.sql("""
+					select parent, delivery_note
+					from `tabSales Invoice Item`
+					where docstatus=1 and parent in (%s)
+				""" % (','.join(['%s'] * len(invoices))), tuple(invoices), as_dict=1)
 
-			for d in si_against_dn:
-				if d.delivery_note:
-					self.delivery_notes.setdefault(d.parent, set()).add(d.delivery_note)
+				for d in si_against_dn:
+					if d.delivery_note:
+						self.delivery_notes.setdefault(d.parent, set()).add(d.delivery_note)
 
-			dn_against_si = frappe.db.sql("""
-				select distinct parent, against_sales_invoice
-				from `tabDelivery Note Item`
-				where against_sales_invoice in (%s)
-			""" % (','.join(['%s'] * len(self.invoices))), tuple(self.invoices) , as_dict=1)
+				dn_against_si = frappe.db.sql("""
+					select distinct parent, against_sales_invoice
+					from `tabDelivery Note Item`
+					where against_sales_invoice in (%s)
+				""" % (','.join(['%s'] * len(invoices))), tuple(invoices) , as_dict=1)
 
-			for d in dn_against_si:
-				self.delivery_notes.setdefault(d.against_sales_invoice, set()).add(d.parent)
+				for d in dn_against_si:
+					self.delivery_notes.setdefault(d.against_sales_invoice, set()).add(d.parent)
 
 	def get_invoice_details(self):
 		self.invoice_details = frappe._dict()
 		if self.party_type == "Customer":
-			si_list = frappe.db.sql("""
-				select name, due_date, po_no
-				from `tabSales Invoice`
-				where posting_date <= %s
-			""",self.filters.report_date, as_dict=1)
-			for d in si_list:
-				self.invoice_details.setdefault(d.name, d)
-
-			# Get Sales Team
-			if self.filters.show_sales_person:
-				sales_team = frappe.db.sql("""
-					select parent, sales_person
-					from `tabSales Team`
-					where parenttype = 'Sales Invoice'
-				""", as_dict=1)
-				for d in sales_team:
-					self.invoice_details.setdefault(d.parent, {})\
-						.setdefault('sales_team', []).append(d.sales_person)
+			for invoices in get_batches(self.get_outstanding_vouchers("Sales Invoice")):
+				si_list = frappe.db.sql("""
+					select name, due_date, po_no
+					from `tabSales Invoice`
+					where name in ({0})
+				""".format(", ".join(["%s"] * len(invoices))), tuple(invoices), as_dict=1)
+				for d in si_list:
+					self.invoice_details.setdefault(d.name, d)
+
+				# Get Sales Team
+				if self.filters.show_sales_person:
+					sales_team = frappe.db.sql("""
+						select parent, sales_person
+						from `tabSales Team`
+						where parenttype = 'Sales Invoice' and parent in ({0})
+					""".format(", ".join(["%s"] * len(invoices))), tuple(invoices), as_dict=1)
+					for d in sales_team:
+						self.invoice_details.setdefault(d.parent, {})\
+							.setdefault('sales_team', []).append(d.sales_person)
 
 		if self.party_type == "Supplier":
-			for pi in frappe.db.sql("""
-				select name, due_date, bill_no, bill_date
-				from `tabPurchase Invoice`
-				where posting_date <= %s
-			""", self.filters.report_date, as_dict=1):
-				self.invoice_details.setdefault(pi.name, pi)
+			for invoices in get_batches(self.get_outstanding_vouchers("Purchase Invoice")):
+				for pi in frappe.db.sql("""
+					select name, due_date, bill_no, bill_date
+					from `tabPurchase Invoice`
+					where name in ({0})
+				""".format(", ".join(["%s"] * len(invoices))), tuple(invoices), as_dict=1):
+					self.invoice_details.setdefault(pi.name, pi)
 
 		# Invoices booked via Journal Entries
-		journal_entries = frappe.db.sql("""
-			select name, due_date, bill_no, bill_date
-			from `tabJournal Entry`
-			where posting_date <= %s
-		""", self.filters.report_date, as_dict=1)
+		for journal_entries in get_batches(self.get_outstanding_vouchers("Journal Entry")):
+			for je in frappe.db.sql("""
+				select name, due_date, bill_no, bill_date
+				from `tabJournal Entry`
+				where name in ({0})
+			""".format(", ".join(["%s"] * len(journal_entries))), tuple(journal_entries), as_dict=1):
+				if je.bill_no:
+					self.invoice_details.setdefault(je.name, je)
 
-		for je in journal_entries:
-			if je.bill_no:
-				self.invoice_details.setdefault(je.name, je)
+	def get_outstanding_vouchers(self, voucher_type):
+		return [voucher_no for d, voucher_no in self.outstanding_vouchers if d == voucher_type]
 
 	def set_party_details(self, row):
 		# customer / supplier name
@@ -288,18 +307,29 @@ class ReceivablePayableReport(object):
 			if term.outstanding:
 				self.allocate_closing_to_term(row, term, 'credit_note')
 
+	def get_payment_schedules(self):
+		# payment terms of all invoices with outstanding, by (voucher_type, voucher_no)
+		self.payment_schedules = {}
+		if not self.filters.based_on_payment_terms:
+			return
+
+		for voucher_type in ('Sales Invoice', 'Purchase Invoice'):
+			for invoices in get_batches(self.get_outstanding_vouchers(voucher_type)):
+				for d in frappe.db.sql("""
+					select
+						si.name, si.party_account_currency, si.currency, si.conversion_rate,
+						ps.due_date, ps.payment_amount, ps.description
+					from `tab{0}` si, `tabPayment Schedule` ps
+					where
+						si.name = ps.parent and
+						si.name in ({1})
+					order by si.name, ps.due_date
+				""".format(voucher_type, ", ".join(["%s"] * len(invoices))), tuple(invoices), as_dict = 1):
+					self.payment_schedules.setdefault((voucher_type, d.name), []).append(d)
+
 	def get_payment_terms(self, row):
 		# build payment_terms for row
-		payment_terms_details = frappe.db.sql("""
-			select
-				si.name, si.party_account_currency, si.currency, si.conversion_rate,
-				ps.due_date, ps.payment_amount, ps.description
-			from `tab{0}` si, `tabPayment Schedule` ps
-			where
-				si.name = ps.parent and
-				si.name = %s
-			order by ps.due_date
-		""".format(row.voucher_type), row.voucher_no, as_dict = 1)
+		payment_terms_details = self.payment_schedules.get((row.voucher_type, row.voucher_no), [])
 
 
 		original_row = frappe._dict(row)
@@ -464,39 +494,48 @@ class ReceivablePayableReport(object):
 
 	def get_ageing_data(self, entry_date, row):
 		# [0-30, 30-60, 60-90, 90-120, 120-above]
-		row.range1 = row.range2 = row.range3 = row.range4 = range5 = 0.0
+		row.range1 = row.range2 = row.range3 = row.range4 = row.range5 = 0.0
 
 		if not (self.age_as_on and entry_date):
 			return
 
 		row.age = (getdate(self.age_as_on) - getdate(entry_date)).days or 0
-		index = None
 
-		if not (self.filters.range1 and self.filters.range2 and self.filters.range3 and self.filters.range4):
-			self.filters.range1, self.filters.range2, self.filters.range3, self.filters.range4 = 30, 60, 90, 120
+		# first range with upper limit >= age, or 4 (above) if the age exceeds all
+		index = bisect_left(self.get_ageing_ranges(), row.age)
+		row['range' + str(index+1)] = row.outstanding
+
+	def get_ageing_ranges(self):
+		if not getattr(self, 'ageing_ranges', None):
+			if not (self.filters.range1 and self.filters.range2 and self.filters.range3 and self.filters.range4):
+				self.filters.range1, self.filters.range2, self.filters.range3, self.filters.range4 = 30, 60, 90, 120
 
-		for i, days in enumerate([self.filters.range1, self.filters.range2, self.filters.range3, self.filters.range4]):
-			if row.age <= days:
-				index = i
-				break
+			self.ageing_ranges = [cint(self.filters.range1), cint(self.filters.range2),
+				cint(self.filters.range3), cint(self.filters.range4)]
 
-		if index is None: index = 4
-		row['range' + str(index+1)] = row.outstanding
+		return self.ageing_ranges
 
 	def get_gl_entries(self):
-		# get all the GL entries filtered by the given filters
+		# get the GL entries filtered by the given filters, summed up by voucher, party and
+		# against voucher, separately for entries with positive and negative balance
 
 		conditions, values = self.prepare_conditions()
 
 		if self.filters.get(scrub(self.party_type)):
-			select_fields = "debit_in_account_currency as debit, credit_in_account_currency as credit"
+			debit, credit = "debit_in_account_currency", "credit_in_account_currency"
 		else:
-			select_fields = "debit, credit"
+			debit, credit = "debit", "credit"
+
+		# "debit - credit" for receivable type reports and vice-versa for payable type reports
+		balance = "{0} - {1}".format(*((debit, credit) if self.dr_or_cr == "debit" else (credit, debit)))
 
 		self.gl_entries = frappe.db.sql("""
 			select
-				name, posting_date, account, party_type, party, voucher_type, voucher_no,
-				against_voucher_type, against_voucher, account_currency, remarks, {0}
+				min(posting_date) as posting_date, party, voucher_type, voucher_no,
+				against_voucher_type, against_voucher, max(account_currency) as account_currency,
+				max(remarks) as remarks,
+				sum(case when {0} > 0 then {0} else 0 end) as positive_balance,
+				sum(case when {0} < 0 then {0} else 0 end) as negative_balance
 			from
 				`tabGL Entry`
 			where
@@ -505,8 +544,9 @@ class ReceivablePayableReport(object):
 				and (party is not null and party != '')
 				and posting_date <= %s
 				{1}
+			group by voucher_type, voucher_no, party, against_voucher_type, against_voucher
 			order by posting_date, party"""
-			.format(select_fields, conditions), values, as_dict=True)
+			.format(balance, conditions), values, as_dict=True)
 
 	def prepare_conditions(self):
 		conditions = [""]
@@ -597,18 +637,23 @@ class ReceivablePayableReport(object):
 					conditions.append("{0} = %s".format(dimension))
 					values.append(self.filters.get(dimension))
 
-	def get_gle_balance(self, gle):
-		# get the balance of the GL (debit - credit) or reverse balance based on report type
-		return gle.get(self.dr_or_cr) - self.get_reverse_balance(gle)
-
-	def get_reverse_balance(self, gle):
-		# get "credit" balance if report type is "debit" and vice versa
-		return gle.get('debit' if self.dr_or_cr=='credit' else 'credit')
-
 	def is_invoice(self, gle):
 		if gle.voucher_type in ('Sales Invoice', 'Purchase Invoice'):
 			return True
 
+	def get_all_party_details(self):
+		parties = set(key[2] for key in self.outstanding_keys) - set(self.party_details)
+
+		if self.party_type == 'Customer':
+			fields = ['name', 'customer_name', 'territory', 'customer_group', 'customer_primary_contact']
+		else:
+			fields = ['name', 'supplier_name', 'supplier_group']
+
+		for batch in get_batches(parties):
+			for d in frappe.db.sql("""select {0} from `tab{1}` where name in ({2})""".format(
+					", ".join(fields), self.party_type, ", ".join(["%s"] * len(batch))), tuple(batch), as_dict=True):
+				self.party_details[d.pop('name')] = d
+
 	def get_party_details(self, party):
 		if not party in self.party_details:
 			if self.party_type == 'Customer':
@@ -727,3 +772,8 @@ class ReceivablePayableReport(object):
 			},
 			"type": 'percentage'
 		}
+
+def get_batches(values, batch_size=10000):
+	values = list(values)
+	for i in range(0, len(values), batch_size):
+		yield values[i:i + batch_size]
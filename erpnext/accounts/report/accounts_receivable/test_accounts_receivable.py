@@ -2,8 +2,9 @@ from __future__ import unicode_literals
 import frappe
 import frappe.defaults
 import unittest
-from frappe.utils import today, getdate, add_days
-from erpnext.accounts.report.accounts_receivable.accounts_receivable import execute
+from collections import OrderedDict
+from frappe.utils import today, getdate, add_days, flt
+from erpnext.accounts.report.accounts_receivable.accounts_receivable import execute, ReceivablePayableReport
 from erpnext.accounts.doctype.sales_invoice.test_sales_invoice import create_sales_invoice
 from erpnext.accounts.doctype.payment_entry.payment_entry import get_payment_entry
 
@@ -53,6 +54,35 @@ class TestAccountsReceivable(unittest.TestCase):
 		self.assertEqual(expected_data_after_credit_note,
 			[row.invoice_grand_total, row.invoiced, row.paid, row.credit_note, row.outstanding])
 
+	def test_summed_balances_match_row_wise_balances(self):
+		frappe.db.sql("delete from `tabSales Invoice` where company='_Test Company 2'")
+		frappe.db.sql("delete from `tabGL Entry` where company='_Test Company 2'")
+
+		# partial payments and a credit note against the same invoice
+		name = make_sales_invoice()
+		make_payment(name)
+		make_payment(name, 20)
+		make_credit_note(name)
+
+		report = ReceivablePayableReport({'company': '_Test Company 2', 'report_date': today(),
+			'range1': 30, 'range2': 60, 'range3': 90, 'range4': 120})
+		report.run({"party_type": "Customer", "naming_by": ["Selling Settings", "cust_master_name"]})
+
+		self.assertEqual(get_balances(report.voucher_balance), get_row_wise_balances(report))
+
+	def test_ageing_ranges(self):
+		report = ReceivablePayableReport({"report_date": "2020-03-31",
+			"range1": 30, "range2": 60, "range3": 90, "range4": 120})
+
+		for entry_date, age, expected_range in (("2020-03-31", 0, "range1"), ("2020-03-01", 30, "range1"),
+				("2020-02-29", 31, "range2"), ("2020-01-01", 90, "range3"), ("2019-12-01", 121, "range5")):
+			row = frappe._dict(outstanding=100.0)
+			report.get_ageing_data(entry_date, row)
+
+			self.assertEqual(row.age, age)
+			self.assertEqual([k for k in ("range1", "range2", "range3", "range4", "range5") if row[k]],
+				[expected_range])
+
 def make_sales_invoice():
 	frappe.set_user("Administrator")
 
@@ -74,8 +104,41 @@ def make_sales_invoice():
 
 	return si.name
 
-def make_payment(docname):
-	pe = get_payment_entry("Sales Invoice", docname, bank_account="Cash - _TC2", party_amount=40)
+def get_balances(voucher_balance):
+	return {key: [flt(row[f], 2) for f in ("invoiced", "paid", "credit_note", "outstanding")]
+		for key, row in voucher_balance.items()}
+
+def get_row_wise_balances(report):
+	"""Balances computed from the GL Entries one by one, as before they were summed up in SQL"""
+	report.gl_entries = frappe.db.sql("""select posting_date, party, voucher_type, voucher_no,
+			against_voucher_type, against_voucher, account_currency, remarks, debit, credit
+		from `tabGL Entry`
+		where docstatus < 2 and party_type = 'Customer' and company = '_Test Company 2' and posting_date <= %s
+		order by posting_date, party""", report.filters.report_date, as_dict=1)
+	report.voucher_balance = OrderedDict()
+	report.init_voucher_balance()
+
+	for gle in report.gl_entries:
+		row = report.get_voucher_balance(gle)
+		gle_balance = gle.debit - gle.credit
+		if gle_balance > 0:
+			if gle.voucher_type in ('Journal Entry', 'Payment Entry') and gle.against_voucher:
+				row.paid -= gle_balance
+			else:
+				row.invoiced += gle_balance
+		else:
+			if report.is_invoice(gle):
+				row.credit_note -= gle_balance
+			else:
+				row.paid -= gle_balance
+
+	for row in report.voucher_balance.values():
+		row.outstanding = row.invoiced - row.paid - row.credit_note
+
+	return get_balances(report.voucher_balance)
+
+def make_payment(docname, party_amount=40):
+	pe = get_payment_entry("Sales Invoice", docname, bank_account="Cash - _TC2", party_amount=party_amount)
 	pe.paid_from = "Debtors - _TC2"
 	pe.insert()
 	pe.submit()
@@ -146,7 +146,8 @@ def get_data(
 			period_list[0]["year_start_date"] if only_current_fiscal_year else None,
 			period_list[-1]["to_date"],
 			root.lft, root.rgt, filters,
-			gl_entries_by_account, ignore_closing_entries=ignore_closing_entries
+			gl_entries_by_account, ignore_closing_entries=ignore_closing_entries,
+			period_list=period_list
 		)
 
 	calculate_values(
@@ -342,8 +343,14 @@ def sort_accounts(accounts, is_root=False, key="name"):
 	accounts.sort(key = functools.cmp_to_key(compare_accounts))
 
 def set_gl_entries_by_account(
-		company, from_date, to_date, root_lft, root_rgt, filters, gl_entries_by_account, ignore_closing_entries=False):
-	"""Returns a dict like { "account": [gl entries], ... }"""
+		company, from_date, to_date, root_lft, root_rgt, filters, gl_entries_by_account, ignore_closing_entries=False,
+		period_list=None):
+	"""Returns a dict like { "account": [gl entries], ... }
+
+		The entries are summed up by account, month, is_opening and fiscal year, with the first posting date
+		of the month as posting_date. Months in which a period of `period_list` starts or ends on another
+		day are split at that day. With a presentation currency, the entries are returned one by one,
+		as they are converted at the exchange rate of their posting date."""
 
 	additional_conditions = get_additional_conditions(from_date, ignore_closing_entries, filters)
 
@@ -369,20 +376,52 @@ def set_gl_entries_by_account(
 				key: value
 			})
 
-	gl_entries = frappe.db.sql("""select posting_date, account, debit, credit, is_opening, fiscal_year, debit_in_account_currency, credit_in_account_currency, account_currency from `tabGL Entry`
-		where company=%(company)s
-		{additional_conditions}
-		and posting_date <= %(to_date)s
-		order by account, posting_date""".format(additional_conditions=additional_conditions), gl_filters, as_dict=True) #nosec
-
 	if filters and filters.get('presentation_currency'):
+		gl_entries = frappe.db.sql("""select posting_date, account, debit, credit, is_opening, fiscal_year, debit_in_account_currency, credit_in_account_currency, account_currency from `tabGL Entry`
+			where company=%(company)s
+			{additional_conditions}
+			and posting_date <= %(to_date)s
+			order by account, posting_date""".format(additional_conditions=additional_conditions), gl_filters, as_dict=True) #nosec
+
 		convert_to_presentation_currency(gl_entries, get_currency(filters))
+	else:
+		gl_entries = frappe.db.sql("""select min(posting_date) as posting_date, account,
+				sum(debit) as debit, sum(credit) as credit, is_opening, fiscal_year,
+				sum(debit_in_account_currency) as debit_in_account_currency,
+				sum(credit_in_account_currency) as credit_in_account_currency, account_currency
+			from `tabGL Entry`
+			where company=%(company)s
+			{additional_conditions}
+			and posting_date <= %(to_date)s
+			group by account, extract(year from posting_date), extract(month from posting_date),
+				{split_expression}is_opening, fiscal_year, account_currency
+			order by account, posting_date""".format(additional_conditions=additional_conditions,
+				split_expression=get_period_split_expression(period_list)), gl_filters, as_dict=True) #nosec
 
 	for entry in gl_entries:
 		gl_entries_by_account.setdefault(entry.account, []).append(entry)
 
 	return gl_entries_by_account
 
+def get_period_split_expression(period_list):
+	"""Returns a GROUP BY expression which separates the posting dates before and after
+		the period boundaries which are not the first day of a month"""
+	split_dates = set()
+	for period in period_list or []:
+		dates = [period.get("year_start_date"), period.get("from_date")]
+		if period.get("to_date"):
+			dates.append(add_days(period.get("to_date"), 1))
+
+		for date in dates:
+			if date and getdate(date) != getdate(get_first_day(date)):
+				split_dates.add(getdate(date))
+
+	if not split_dates:
+		return ""
+
+	return " + ".join("(case when posting_date >= {0} then 1 else 0 end)".format(
+		frappe.db.escape(str(d))) for d in sorted(split_dates)) + ", "
+
 
 def get_additional_conditions(from_date, ignore_closing_entries, filters):
 	additional_conditions = []
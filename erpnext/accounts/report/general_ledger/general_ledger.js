@@ -156,7 +156,27 @@ frappe.query_reports["General Ledger"] = {
 			"label": __("Include Default Book Entries"),
 			"fieldtype": "Check"
 		}
-	]
+	],
+	onload: function(report) {
+		report.page.add_menu_item(__("Export Full Ledger"), function() {
+			frappe.prompt({
+				fieldname: "file_format",
+				label: __("File Format"),
+				fieldtype: "Select",
+				options: ["CSV", "XLSX"],
+				default: "CSV",
+				reqd: 1
+			}, function(values) {
+				frappe.call({
+					method: "erpnext.accounts.report.general_ledger.general_ledger.export_general_ledger",
+					args: {
+						filters: report.get_values(),
+						file_format: values.file_format
+					}
+				});
+			}, __("Export Full Ledger"), __("Export"));
+		});
+	}
 }
 
 erpnext.dimension_filters.forEach((dimension) => {
@@ -9,7 +9,7 @@ from frappe.utils import getdate, cstr, flt, fmt_money
 from frappe import _, _dict
 from erpnext.accounts.utils import get_account_currency
 from erpnext.accounts.report.financial_statements import get_cost_centers_with_children
-from six import iteritems
+from six import iteritems, PY2
 from erpnext.accounts.doctype.accounting_dimension.accounting_dimension import get_accounting_dimensions
 from collections import OrderedDict
 
@@ -17,6 +17,15 @@ def execute(filters=None):
 	if not filters:
 		return [], []
 
+	filters, account_details = validate_and_set_filters(filters)
+
+	columns = get_columns(filters)
+
+	res = get_result(filters, account_details)
+
+	return columns, res
+
+def validate_and_set_filters(filters):
 	account_details = {}
 
 	if filters and filters.get('print_in_account_currency') and \
@@ -35,11 +44,7 @@ def execute(filters=None):
 
 	filters = set_account_currency(filters)
 
-	columns = get_columns(filters)
-
-	res = get_result(filters, account_details)
-
-	return columns, res
+	return filters, account_details
 
 
 def validate_filters(filters, account_details):
@@ -124,9 +129,7 @@ def get_gl_entries(filters):
 	if filters.get("group_by") == _("Group by Voucher"):
 		order_by_statement = "order by posting_date, voucher_type, voucher_no"
 
-	if filters.get("include_default_book_entries"):
-		filters['company_fb'] = frappe.db.get_value("Company",
-			filters.get("company"), 'default_finance_book')
+	set_company_finance_book(filters)
 
 	gl_entries = frappe.db.sql(
 		"""
@@ -150,6 +153,11 @@ def get_gl_entries(filters):
 		return gl_entries
 
 
+def set_company_finance_book(filters):
+	if filters.get("include_default_book_entries"):
+		filters['company_fb'] = frappe.db.get_value("Company",
+			filters.get("company"), 'default_finance_book')
+
 def get_conditions(filters):
 	conditions = []
 	if filters.get("account"):
@@ -348,6 +356,273 @@ def get_balance(row, balance, debit_field, credit_field):
 
 	return balance
 
+def iterate_result(filters):
+	"""Yields the rows of the report like `get_result`, reading GL Entries with an unbuffered cursor.
+
+		Each group is emitted as soon as its last entry is read, so the memory used does not grow
+		with the number of entries. Groups are ordered by the grouped field (by posting date
+		for vouchers) instead of the posting date of their first entry."""
+	from erpnext.utilities.db import iterate_sql
+
+	group_by = group_by_field(filters.get("group_by"))
+	consolidated = filters.get("group_by") == _("Group by Voucher (Consolidated)")
+	voucherwise = filters.get("group_by") not in (_("Group by Account"), _("Group by Party"))
+
+	set_company_finance_book(filters)
+	conditions = get_conditions(filters)
+	currency_map = get_currency(filters) if filters.get("presentation_currency") else None
+
+	# entries which are added to the opening, sorted before the other entries of their group
+	opening_condition = "posting_date < %(from_date)s"
+	if not filters.get("show_opening_entries"):
+		opening_condition += " or is_opening = 'Yes'"
+
+	if currency_map:
+		set_exchange_rates(filters, conditions, currency_map)
+
+	totals = get_opening_totals(filters, conditions, opening_condition, currency_map)
+
+	if voucherwise:
+		order_by = "posting_date, voucher_type, voucher_no, account, cost_center"
+	else:
+		order_by = "{0}, is_opening_entry desc, posting_date, voucher_type, voucher_no".format(group_by)
+
+	gl_entries = iterate_sql("""
+		select
+			posting_date, account, party_type, party,
+			voucher_type, voucher_no, cost_center, project,
+			against_voucher_type, against_voucher, account_currency,
+			remarks, against, is_opening, debit, credit, debit_in_account_currency,
+			credit_in_account_currency,
+			(case when {opening_condition} then 1 else 0 end) as is_opening_entry,
+			(select bill_no from `tabPurchase Invoice` pi
+				where pi.name = `tabGL Entry`.against_voucher and pi.docstatus = 1) as bill_no
+		from `tabGL Entry`
+		where company=%(company)s {conditions}
+		order by {order_by}
+		""".format(opening_condition=opening_condition, conditions=conditions, order_by=order_by),
+		filters, as_dict=1)
+
+	balance, balance_in_account_currency = 0, 0
+	for row in iterate_sections(filters, gl_entries, totals, group_by, consolidated, voucherwise, currency_map):
+		if not row.get('posting_date'):
+			balance, balance_in_account_currency = 0, 0
+
+		balance = get_balance(row, balance, 'debit', 'credit')
+		row['balance'] = balance
+
+		row['account_currency'] = filters.account_currency
+		row['bill_no'] = row.get('bill_no') or ''
+
+		yield row
+
+def iterate_sections(filters, gl_entries, totals, group_by, consolidated, voucherwise, currency_map=None):
+	"""Yields the opening, the grouped entries with their totals, and the totals of the report"""
+	to_date = getdate(filters.to_date)
+
+	yield totals.opening
+
+	group, group_totals, group_started, consolidated_gle = None, None, False, None
+	for gle in gl_entries:
+		if currency_map:
+			convert_to_presentation_currency([gle], currency_map)
+
+		if not consolidated and (group_totals is None or gle.get(group_by) != group):
+			if group_started:
+				for row in get_group_totals(group_totals, voucherwise):
+					yield row
+
+			group, group_totals, group_started = gle.get(group_by), get_totals_dict(), False
+
+		if gle.is_opening_entry:
+			if not consolidated:
+				update_totals(group_totals, 'opening', gle)
+				update_totals(group_totals, 'closing', gle)
+			continue
+
+		if gle.posting_date > to_date:
+			continue
+
+		update_totals(totals, 'total', gle)
+		update_totals(totals, 'closing', gle)
+
+		if consolidated:
+			key = (gle.voucher_type, gle.voucher_no, gle.account, gle.cost_center)
+			if consolidated_gle and key == consolidated_gle.key:
+				update_totals(consolidated_gle, 'gle', gle)
+			else:
+				if consolidated_gle:
+					yield consolidated_gle.gle
+				consolidated_gle = _dict(key=key, gle=gle)
+			continue
+
+		if not group_started:
+			yield {}
+			if not voucherwise:
+				yield group_totals.opening
+			group_started = True
+
+		update_totals(group_totals, 'total', gle)
+		update_totals(group_totals, 'closing', gle)
+		yield gle
+
+	if consolidated:
+		if consolidated_gle:
+			yield consolidated_gle.gle
+	else:
+		if group_started:
+			for row in get_group_totals(group_totals, voucherwise):
+				yield row
+		yield {}
+
+	yield totals.total
+	yield totals.closing
+
+def get_group_totals(group_totals, voucherwise):
+	rows = [group_totals.total]
+	if not voucherwise:
+		rows.append(group_totals.closing)
+
+	return rows
+
+def update_totals(totals, key, gle):
+	totals[key].debit += flt(gle.debit)
+	totals[key].credit += flt(gle.credit)
+
+	totals[key].debit_in_account_currency += flt(gle.debit_in_account_currency)
+	totals[key].credit_in_account_currency += flt(gle.credit_in_account_currency)
+
+def get_opening_totals(filters, conditions, opening_condition, currency_map=None):
+	"""Returns the totals of the report with the opening (and closing) set from the opening entries"""
+	from erpnext.utilities.db import iterate_sql
+
+	totals = get_totals_dict()
+
+	if currency_map:
+		# converted entry by entry, as in the report
+		for gle in iterate_sql("""select account, account_currency, posting_date, debit, credit,
+				debit_in_account_currency, credit_in_account_currency
+			from `tabGL Entry`
+			where company=%(company)s {conditions} and ({opening_condition})""".format(
+				conditions=conditions, opening_condition=opening_condition), filters, as_dict=1):
+			convert_to_presentation_currency([gle], currency_map)
+			update_totals(totals, 'opening', gle)
+			update_totals(totals, 'closing', gle)
+	else:
+		opening = frappe.db.sql("""select sum(debit) as debit, sum(credit) as credit,
+				sum(debit_in_account_currency) as debit_in_account_currency,
+				sum(credit_in_account_currency) as credit_in_account_currency
+			from `tabGL Entry`
+			where company=%(company)s {conditions} and ({opening_condition})""".format(
+				conditions=conditions, opening_condition=opening_condition), filters, as_dict=1)[0]
+		update_totals(totals, 'opening', opening)
+		update_totals(totals, 'closing', opening)
+
+	return totals
+
+def set_exchange_rates(filters, conditions, currency_map):
+	"""Load the exchange rates of all posting dates, so that converting the entries
+		needs no query while the cursor is open"""
+	from erpnext.accounts.report.utils import get_rate_as_at
+
+	presentation_currency, company_currency = currency_map["presentation_currency"], currency_map["company_currency"]
+	if presentation_currency == company_currency:
+		return
+
+	get_rate_as_at(currency_map["report_date"], presentation_currency, company_currency)
+	for posting_date in frappe.db.sql_list("""select distinct posting_date from `tabGL Entry`
+		where company=%(company)s {conditions}""".format(conditions=conditions), filters):
+		get_rate_as_at(posting_date, presentation_currency, company_currency)
+
+def export_result(filters, file_format="CSV", chunk_size=1000):
+	"""Write the report to a private file, chunk by chunk, and return the File document"""
+	import hashlib, io
+
+	filters = validate_and_set_filters(frappe._dict(filters))[0]
+	columns = get_columns(filters)
+
+	file_name = "general_ledger_{0}.{1}".format(frappe.generate_hash(length=8), file_format.lower())
+	path = frappe.get_site_path("private", "files", file_name)
+
+	rows = ([row.get(c["fieldname"]) for c in columns] for row in iterate_result(filters))
+	if file_format == "XLSX":
+		write_xlsx(path, columns, rows)
+	else:
+		write_csv(path, columns, rows, chunk_size)
+
+	content_hash = hashlib.md5()
+	with io.open(path, "rb") as f:
+		for chunk in iter(lambda: f.read(1024 * 1024), b""):
+			content_hash.update(chunk)
+
+	_file = frappe.get_doc({
+		"doctype": "File",
+		"file_name": file_name,
+		"file_url": "/private/files/" + file_name,
+		"is_private": 1,
+		"content_hash": content_hash.hexdigest()
+	})
+	_file.insert(ignore_permissions=True)
+
+	return _file
+
+def write_csv(path, columns, rows, chunk_size=1000):
+	import csv, io
+
+	if PY2:
+		# the python 2 csv module only writes byte strings
+		f = open(path, "wb")
+		encode = lambda row: [cstr(v).encode("utf-8") for v in row]
+	else:
+		f = io.open(path, "w", encoding="utf-8", newline="")
+		encode = lambda row: row
+
+	with f:
+		writer = csv.writer(f)
+		writer.writerow(encode([c["label"] for c in columns]))
+
+		chunk = []
+		for row in rows:
+			chunk.append(encode(row))
+			if len(chunk) >= chunk_size:
+				writer.writerows(chunk)
+				chunk = []
+
+		writer.writerows(chunk)
+
+def write_xlsx(path, columns, rows):
+	from openpyxl import Workbook
+
+	# write-only workbooks keep only the current row in memory
+	wb = Workbook(write_only=True)
+	ws = wb.create_sheet("General Ledger")
+	ws.append([c["label"] for c in columns])
+
+	for row in rows:
+		ws.append(row)
+
+	wb.save(path)
+
+@frappe.whitelist()
+def export_general_ledger(filters, file_format="CSV"):
+	frappe.has_permission("GL Entry", throw=True)
+
+	if file_format not in ("CSV", "XLSX"):
+		frappe.throw(_("Invalid file format {0}").format(file_format))
+
+	frappe.enqueue("erpnext.accounts.report.general_ledger.general_ledger.make_export",
+		queue="long", timeout=3600, filters=frappe.parse_json(filters), file_format=file_format,
+		user=frappe.session.user)
+
+	frappe.msgprint(_("The General Ledger is being exported in the background. You will be notified when it is ready."))
+
+def make_export(filters, file_format, user):
+	_file = export_result(filters, file_format)
+	frappe.db.commit()
+
+	frappe.publish_realtime("msgprint", _("General Ledger export is ready: {0}").format(
+		'<a href="{0}">{1}</a>'.format(_file.file_url, _file.file_name)), user=user)
+
 def get_columns(filters):
 	if filters.get("presentation_currency"):
 		currency = filters["presentation_currency"]
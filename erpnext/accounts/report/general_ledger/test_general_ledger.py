@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import csv, io, os
+import frappe
+import unittest
+from six import PY2
+from frappe.utils import add_days, cstr, flt, nowdate
+from erpnext.accounts.report.general_ledger.general_ledger import (execute, iterate_result,
+	validate_and_set_filters, export_result, write_csv, write_xlsx)
+from erpnext.accounts.doctype.sales_invoice.test_sales_invoice import create_sales_invoice
+
+class TestGeneralLedger(unittest.TestCase):
+	def test_streamed_result_matches_report(self):
+		create_sales_invoice(posting_date=add_days(nowdate(), -10), rate=300)
+		create_sales_invoice(posting_date=add_days(nowdate(), -2), rate=200)
+		create_sales_invoice(rate=100)
+
+		filters = {
+			"company": "_Test Company",
+			"from_date": add_days(nowdate(), -5),
+			"to_date": nowdate(),
+			"party_type": "Customer",
+			"party": ["_Test Customer"],
+			"group_by": "Group by Party"
+		}
+
+		columns, data = execute(frappe._dict(filters))
+		streamed_data = list(iterate_result(validate_and_set_filters(frappe._dict(filters))[0]))
+
+		self.assertEqual(get_values(streamed_data, columns), get_values(data, columns))
+
+	def test_write_csv(self):
+		columns = [{"label": "Account"}, {"label": "Débit"}]
+		rows = [["Caisse - _TC", 100.0], ["Débiteurs - _TC", None], ["Sales - _TC", 0]]
+
+		path = frappe.get_site_path("private", "files", "_test_general_ledger.csv")
+		try:
+			write_csv(path, columns, iter(rows), chunk_size=2)
+			self.assertEqual(read_csv(path), [["Account", "Débit"], ["Caisse - _TC", "100.0"],
+				["Débiteurs - _TC", ""], ["Sales - _TC", "0"]])
+		finally:
+			os.remove(path)
+
+	def test_write_xlsx(self):
+		from openpyxl import load_workbook
+
+		columns = [{"label": "Account"}, {"label": "Débit"}]
+		rows = [["Caisse - _TC", 100.0], ["Débiteurs - _TC", None]]
+
+		path = frappe.get_site_path("private", "files", "_test_general_ledger.xlsx")
+		try:
+			write_xlsx(path, columns, iter(rows))
+			ws = load_workbook(path)["General Ledger"]
+			self.assertEqual([[cell.value for cell in row] for row in ws.iter_rows()],
+				[["Account", "Débit"], ["Caisse - _TC", 100.0], ["Débiteurs - _TC", None]])
+		finally:
+			os.remove(path)
+
+	def test_export_result(self):
+		create_sales_invoice(rate=100)
+
+		filters = {
+			"company": "_Test Company",
+			"from_date": add_days(nowdate(), -5),
+			"to_date": nowdate(),
+			"party_type": "Customer",
+			"party": ["_Test Customer"],
+			"group_by": "Group by Party"
+		}
+
+		columns, data = execute(frappe._dict(filters))
+
+		for file_format in ("CSV", "XLSX"):
+			_file = export_result(filters, file_format, chunk_size=2)
+			path = frappe.get_site_path("private", "files", _file.file_name)
+			try:
+				self.assertTrue(_file.file_name.endswith("." + file_format.lower()))
+				self.assertEqual(_file.is_private, 1)
+
+				if file_format == "CSV":
+					exported = read_csv(path)
+					self.assertEqual(exported[0], [c["label"] for c in columns])
+					self.assertEqual(len(exported) - 1, len(data))
+					self.assertEqual([row[1] for row in exported[1:]], [cstr(row.get("account")) for row in data])
+				else:
+					from openpyxl import load_workbook
+					ws = load_workbook(path)["General Ledger"]
+					self.assertEqual(ws.max_row - 1, len(data))
+			finally:
+				_file.delete()
+				if os.path.exists(path):
+					os.remove(path)
+
+def read_csv(path):
+	if PY2:
+		with open(path, "rb") as f:
+			return [[cstr(v) for v in row] for row in csv.reader(f)]
+
+	with io.open(path, "r", encoding="utf-8", newline="") as f:
+		return list(csv.reader(f))
+
+def get_values(data, columns):
+	return [[flt(row.get(c["fieldname"]), 2) if c.get("fieldtype") == "Float" else row.get(c["fieldname"])
+		for c in columns] for row in data]
@@ -0,0 +1,45 @@
+from __future__ import unicode_literals
+
+import frappe
+import unittest
+from frappe.utils import add_days, flt, getdate, nowdate
+from erpnext.accounts.report.trial_balance.trial_balance import execute, get_trial_balances
+from erpnext.accounts.doctype.journal_entry.test_journal_entry import make_journal_entry
+from erpnext.accounts.utils import get_balance_on, get_fiscal_year
+
+class TestTrialBalance(unittest.TestCase):
+	def test_opening_and_period_balances(self):
+		fiscal_year = get_fiscal_year(nowdate(), company="_Test Company")[0]
+		from_date = getdate(nowdate())
+
+		make_journal_entry("_Test Bank - _TC", "Sales - _TC", 100, posting_date=add_days(from_date, -1), submit=True)
+		make_journal_entry("_Test Bank - _TC", "Sales - _TC", 50, posting_date=from_date, submit=True)
+
+		columns, data = execute(frappe._dict({
+			"company": "_Test Company",
+			"fiscal_year": fiscal_year,
+			"from_date": from_date,
+			"to_date": from_date
+		}))
+
+		row = [d for d in data if d.get("account") == "_Test Bank - _TC"][0]
+		self.assertEqual(flt(row["opening_debit"] - row["opening_credit"], 2),
+			flt(get_balance_on("_Test Bank - _TC", add_days(from_date, -1)), 2))
+		self.assertEqual(flt(row["closing_debit"] - row["closing_credit"], 2),
+			flt(get_balance_on("_Test Bank - _TC", from_date), 2))
+		self.assertEqual(flt(row["debit"] - row["credit"], 2), 50)
+
+	def test_trial_balances_of_companies(self):
+		fiscal_year = get_fiscal_year(nowdate(), company="_Test Company")[0]
+		make_journal_entry("_Test Bank - _TC", "Sales - _TC", 100, submit=True)
+
+		# the threads read with their own connections
+		frappe.db.commit()
+
+		companies = ["_Test Company", "_Test Company 1"]
+		trial_balances = get_trial_balances(companies, {"fiscal_year": fiscal_year}, workers=2)
+
+		self.assertEqual(sorted(trial_balances), companies)
+		for company in companies:
+			self.assertEqual(trial_balances[company],
+				execute(frappe._dict({"company": company, "fiscal_year": fiscal_year}))[1])
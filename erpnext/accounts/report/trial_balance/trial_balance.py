@@ -4,10 +4,9 @@
 from __future__ import unicode_literals
 import frappe, erpnext
 from frappe import _
-from frappe.utils import flt, getdate, formatdate, cstr
+from frappe.utils import flt, getdate, formatdate
 from erpnext.accounts.report.financial_statements \
-	import filter_accounts, set_gl_entries_by_account, filter_out_zero_value_rows
-from erpnext.accounts.doctype.accounting_dimension.accounting_dimension import get_accounting_dimensions
+	import filter_accounts, filter_out_zero_value_rows, get_additional_conditions
 
 value_fields = ("opening_debit", "opening_credit", "debit", "credit", "closing_debit", "closing_credit")
 
@@ -63,16 +62,9 @@ def get_data(filters):
 
 	accounts, accounts_by_name, parent_children_map = filter_accounts(accounts)
 
-	min_lft, max_rgt = frappe.db.sql("""select min(lft), max(rgt) from `tabAccount`
-		where company=%s""", (filters.company,))[0]
+	balances = get_account_balances(filters)
 
-	gl_entries_by_account = {}
-
-	opening_balances = get_opening_balances(filters)
-	set_gl_entries_by_account(filters.company, filters.from_date,
-		filters.to_date, min_lft, max_rgt, filters, gl_entries_by_account, ignore_closing_entries=not flt(filters.with_period_closing_entry))
-
-	total_row = calculate_values(accounts, gl_entries_by_account, opening_balances, filters, company_currency)
+	total_row = calculate_values(accounts, balances, filters, company_currency)
 	accumulate_values_into_parents(accounts, accounts_by_name)
 
 	data = prepare_data(accounts, filters, total_row, parent_children_map, company_currency)
@@ -81,73 +73,68 @@ def get_data(filters):
 
 	return data
 
-def get_opening_balances(filters):
-	balance_sheet_opening = get_rootwise_opening_balances(filters, "Balance Sheet")
-	pl_opening = get_rootwise_opening_balances(filters, "Profit and Loss")
-
-	balance_sheet_opening.update(pl_opening)
-	return balance_sheet_opening
-
-
-def get_rootwise_opening_balances(filters, report_type):
-	additional_conditions = ""
-	if not filters.show_unclosed_fy_pl_balances:
-		additional_conditions = " and posting_date >= %(year_start_date)s" \
-			if report_type == "Profit and Loss" else ""
-
-	if not flt(filters.with_period_closing_entry):
-		additional_conditions += " and ifnull(voucher_type, '')!='Period Closing Voucher'"
-
-	if filters.cost_center:
-		lft, rgt = frappe.db.get_value('Cost Center', filters.cost_center, ['lft', 'rgt'])
-		additional_conditions += """ and cost_center in (select name from `tabCost Center`
-			where lft >= %s and rgt <= %s)""" % (lft, rgt)
-
-	if filters.finance_book:
-		fb_conditions = " and finance_book = %(finance_book)s"
-		if filters.include_default_book_entries:
-			fb_conditions = " and (finance_book in (%(finance_book)s, %(company_fb)s))"
+def get_account_balances(filters):
+	"""Returns opening and period debit / credit by account, from a single grouped scan of GL Entries"""
+	additional_conditions = get_additional_conditions(None,
+		not flt(filters.with_period_closing_entry), filters)
 
-		additional_conditions += fb_conditions
-
-	accounting_dimensions = get_accounting_dimensions()
-
-	query_filters = {
+	values = {
 		"company": filters.company,
 		"from_date": filters.from_date,
-		"report_type": report_type,
+		"to_date": filters.to_date,
 		"year_start_date": filters.year_start_date,
-		"finance_book": filters.finance_book,
 		"company_fb": frappe.db.get_value("Company", filters.company, 'default_finance_book')
 	}
+	values.update({key: value for key, value in filters.items() if value and key not in values})
 
-	if accounting_dimensions:
-		for dimension in accounting_dimensions:
-			if filters.get(dimension):
-				additional_conditions += """ and {0} in (%({0})s) """.format(dimension)
-
-				query_filters.update({
-					dimension: filters.get(dimension)
-				})
+	opening = "(posting_date < %(from_date)s or ifnull(is_opening, 'No') = 'Yes')"
 
 	gle = frappe.db.sql("""
 		select
-			account, sum(debit) as opening_debit, sum(credit) as opening_credit
+			account,
+			sum(case when {opening} then debit else 0 end) as opening_debit,
+			sum(case when {opening} then credit else 0 end) as opening_credit,
+			sum(case when {opening} and posting_date < %(year_start_date)s then debit else 0 end)
+				as previous_years_debit,
+			sum(case when {opening} and posting_date < %(year_start_date)s then credit else 0 end)
+				as previous_years_credit,
+			sum(case when not {opening} then debit else 0 end) as debit,
+			sum(case when not {opening} then credit else 0 end) as credit
 		from `tabGL Entry`
 		where
 			company=%(company)s
 			{additional_conditions}
-			and (posting_date < %(from_date)s or ifnull(is_opening, 'No') = 'Yes')
-			and account in (select name from `tabAccount` where report_type=%(report_type)s)
-		group by account""".format(additional_conditions=additional_conditions), query_filters , as_dict=True)
-
-	opening = frappe._dict()
-	for d in gle:
-		opening.setdefault(d.account, d)
-
-	return opening
-
-def calculate_values(accounts, gl_entries_by_account, opening_balances, filters, company_currency):
+			and (posting_date <= %(to_date)s or ifnull(is_opening, 'No') = 'Yes')
+		group by account""".format(opening=opening, additional_conditions=additional_conditions),
+		values, as_dict=True)
+
+	return frappe._dict((d.account, d) for d in gle)
+
+def get_trial_balances(companies, filters, workers=4):
+	"""Returns {company: report data} for the Trial Balance of each company, computed by
+		`workers` threads with a database connection each"""
+	from multiprocessing.pool import ThreadPool
+
+	site, sites_path, user = frappe.local.site, frappe.local.sites_path, frappe.session.user
+
+	def _get_trial_balance(company):
+		frappe.init(site=site, sites_path=sites_path)
+		frappe.connect()
+		try:
+			frappe.set_user(user)
+			company_filters = frappe._dict(filters, company=company)
+			validate_filters(company_filters)
+			return company, get_data(company_filters)
+		finally:
+			frappe.destroy()
+
+	pool = ThreadPool(min(workers, len(companies)) or 1)
+	try:
+		return dict(pool.map(_get_trial_balance, companies))
+	finally:
+		pool.close()
+
+def calculate_values(accounts, balances, filters, company_currency):
 	init = {
 		"opening_debit": 0.0,
 		"opening_credit": 0.0,
@@ -176,14 +163,19 @@ def calculate_values(accounts, gl_entries_by_account, opening_balances, filters,
 	for d in accounts:
 		d.update(init.copy())
 
+		balance = balances.get(d.name, {})
+
 		# add opening
-		d["opening_debit"] = opening_balances.get(d.name, {}).get("opening_debit", 0)
-		d["opening_credit"] = opening_balances.get(d.name, {}).get("opening_credit", 0)
+		d["opening_debit"] = flt(balance.get("opening_debit"))
+		d["opening_credit"] = flt(balance.get("opening_credit"))
+
+		# P&L balances of earlier fiscal years are closed
+		if d["report_type"] == "Profit and Loss" and not filters.show_unclosed_fy_pl_balances:
+			d["opening_debit"] -= flt(balance.get("previous_years_debit"))
+			d["opening_credit"] -= flt(balance.get("previous_years_credit"))
 
-		for entry in gl_entries_by_account.get(d.name, []):
-			if cstr(entry.is_opening) != "Yes":
-				d["debit"] += flt(entry.debit)
-				d["credit"] += flt(entry.credit)
+		d["debit"] += flt(balance.get("debit"))
+		d["credit"] += flt(balance.get("credit"))
 
 		d["closing_debit"] = d["opening_debit"] + d["debit"]
 		d["closing_credit"] = d["opening_credit"] + d["credit"]
@@ -0,0 +1,54 @@
+from __future__ import unicode_literals
+import copy
+import unittest
+import frappe
+from frappe.utils import add_days, flt, getdate
+from erpnext.accounts.doctype.journal_entry.test_journal_entry import make_journal_entry
+from erpnext.accounts.report.financial_statements import (get_period_list, get_accounts, filter_accounts,
+	set_gl_entries_by_account, calculate_values)
+from erpnext.accounts.utils import get_fiscal_year
+
+
+class TestFinancialStatements(unittest.TestCase):
+	def test_monthly_sums_match_entries(self):
+		fiscal_year, year_start_date = get_fiscal_year(getdate(), company="_Test Company")[:2]
+		for days in (0, 14, 45, 100, 200):
+			make_journal_entry("_Test Account Cost for Goods Sold - _TC", "_Test Bank - _TC", 100 + days,
+				posting_date=add_days(year_start_date, days), submit=True)
+
+		period_list = get_period_list(fiscal_year, fiscal_year, "Quarterly", company="_Test Company")
+		# a period boundary in the middle of a month
+		period_list[0].to_date = add_days(year_start_date, 20)
+		period_list[1].from_date = add_days(year_start_date, 21)
+
+		accounts = get_accounts("_Test Company", "Expense")
+		accounts, accounts_by_name, parent_children_map = filter_accounts(accounts)
+		root = frappe.db.sql("""select lft, rgt from tabAccount
+			where root_type='Expense' and company='_Test Company' and ifnull(parent_account, '') = ''""", as_dict=1)[0]
+
+		gl_entries_by_account = set_gl_entries_by_account("_Test Company", None, period_list[-1].to_date,
+			root.lft, root.rgt, frappe._dict(), {}, period_list=period_list)
+		entries_by_account = get_entries_by_account(root.lft, root.rgt, period_list[-1].to_date)
+
+		values = copy.deepcopy(accounts_by_name)
+		calculate_values(values, gl_entries_by_account, period_list, False, False)
+
+		expected_values = copy.deepcopy(accounts_by_name)
+		calculate_values(expected_values, entries_by_account, period_list, False, False)
+
+		for account, d in expected_values.items():
+			for period in period_list:
+				self.assertEqual(flt(values[account].get(period.key), 2), flt(d.get(period.key), 2))
+
+
+def get_entries_by_account(lft, rgt, to_date):
+	"""Reference: every GL Entry of the accounts"""
+	entries_by_account = {}
+	for entry in frappe.db.sql("""select posting_date, account, debit, credit, is_opening, fiscal_year
+		from `tabGL Entry`
+		where company='_Test Company' and posting_date <= %s
+		and account in (select name from tabAccount where lft >= %s and rgt <= %s)""",
+		(to_date, lft, rgt), as_dict=1):
+		entries_by_account.setdefault(entry.account, []).append(entry)
+
+	return entries_by_account
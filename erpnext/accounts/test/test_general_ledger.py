@@ -0,0 +1,44 @@
+from __future__ import unicode_literals
+import copy
+import random
+import unittest
+import frappe
+from frappe.utils import cstr, flt
+from erpnext.accounts.general_ledger import merge_similar_entries
+
+
+class TestGeneralLedger(unittest.TestCase):
+	def test_merge_similar_entries(self):
+		random.seed(1)
+		gl_map = []
+		for i in range(300):
+			gl_map.append(frappe._dict({
+				"account": random.choice(["_Test Bank - _TC", "_Test Cash - _TC", "Debtors - _TC"]),
+				"party_type": random.choice([None, "", "Customer"]),
+				"party": random.choice([None, "_Test Customer"]),
+				"cost_center": random.choice(["_Test Cost Center - _TC", "_Test Cost Center 2 - _TC"]),
+				"project": random.choice([None, "_Test Project"]),
+				"debit": random.choice([0, 10, 25.5]),
+				"credit": random.choice([0, 10]),
+				"debit_in_account_currency": random.choice([0, 10]),
+				"credit_in_account_currency": random.choice([0, 10])
+			}))
+
+		self.assertEqual(merge_similar_entries(copy.deepcopy(gl_map)),
+			merge_by_scan(copy.deepcopy(gl_map)))
+
+
+def merge_by_scan(gl_map):
+	"""Reference merge, comparing every entry with all merged entries"""
+	fieldnames = ["party_type", "party", "against_voucher", "against_voucher_type", "cost_center", "project"]
+	merged_gl_map = []
+	for entry in gl_map:
+		for e in merged_gl_map:
+			if e.account == entry.account and all(cstr(e.get(f)) == cstr(entry.get(f)) for f in fieldnames):
+				for f in ("debit", "credit", "debit_in_account_currency", "credit_in_account_currency"):
+					e[f] = flt(e[f]) + flt(entry[f])
+				break
+		else:
+			merged_gl_map.append(entry)
+
+	return [d for d in merged_gl_map if flt(d.debit, 9) != 0 or flt(d.credit, 9) != 0]
@@ -10,8 +10,12 @@ from frappe.utils import nowdate, cstr, flt, cint, now, getdate
 from frappe import throw, _
 from frappe.utils import formatdate, get_number_format_info
 from six import iteritems
+from bisect import bisect_right
 # imported to enable erpnext.accounts.utils.get_account_currency
 from erpnext.accounts.doctype.account.account import get_account_currency
+from erpnext.accounts.doctype.account_period_balance.account_period_balance import (get_balance as get_period_balance,
+	update_account_period_balances)
+from erpnext.accounts.doctype.payment_ledger_entry.payment_ledger_entry import get_open_items, update_payment_ledger
 
 class FiscalYearError(frappe.ValidationError): pass
 
@@ -20,61 +24,96 @@ def get_fiscal_year(date=None, fiscal_year=None, label="Date", verbose=1, compan
 	return get_fiscal_years(date, fiscal_year, label, verbose, company, as_dict=as_dict)[0]
 
 def get_fiscal_years(transaction_date=None, fiscal_year=None, label="Date", verbose=1, company=None, as_dict=False):
-	fiscal_years = frappe.cache().hget("fiscal_years", company) or []
-
-	if not fiscal_years:
-		# if year start date is 2012-04-01, year end date should be 2013-03-31 (hence subdate)
-		cond = ""
-		if fiscal_year:
-			cond += " and fy.name = {0}".format(frappe.db.escape(fiscal_year))
-		if company:
-			cond += """
-				and (not exists (select name
-					from `tabFiscal Year Company` fyc
-					where fyc.parent = fy.name)
-				or exists(select company
-					from `tabFiscal Year Company` fyc
-					where fyc.parent = fy.name
-					and fyc.company=%(company)s)
-				)
-			"""
-
-		fiscal_years = frappe.db.sql("""
-			select
-				fy.name, fy.year_start_date, fy.year_end_date
-			from
-				`tabFiscal Year` fy
-			where
-				disabled = 0 {0}
-			order by
-				fy.year_start_date desc""".format(cond), {
-				"company": company
-			}, as_dict=True)
-
-		frappe.cache().hset("fiscal_years", company, fiscal_years)
+	fiscal_years = get_fiscal_year_index(company)
 
 	if transaction_date:
 		transaction_date = getdate(transaction_date)
 
-	for fy in fiscal_years:
-		matched = False
-		if fiscal_year and fy.name == fiscal_year:
-			matched = True
-
-		if (transaction_date and getdate(fy.year_start_date) <= transaction_date
-			and getdate(fy.year_end_date) >= transaction_date):
-			matched = True
+	matched = [fy for fy in (fiscal_years.by_name.get(fiscal_year) if fiscal_year else None,
+		find_fiscal_year(fiscal_years, transaction_date) if transaction_date else None) if fy]
 
-		if matched:
-			if as_dict:
-				return (fy,)
-			else:
-				return ((fy.name, fy.year_start_date, fy.year_end_date),)
+	if matched:
+		# the latest of the years matching the name or the date
+		fy = max(matched, key=lambda d: d.year_start_date)
+		if as_dict:
+			return (frappe._dict(fy),)
+		else:
+			return ((fy.name, fy.year_start_date, fy.year_end_date),)
 
 	error_msg = _("""{0} {1} not in any active Fiscal Year.""").format(label, formatdate(transaction_date))
 	if verbose==1: frappe.msgprint(error_msg)
 	raise FiscalYearError(error_msg)
 
+def get_fiscal_year_index(company=None):
+	"""Returns the active fiscal years of the company sorted by start date, with the start dates
+		and the running maximum of end dates for bisecting, cached per request and in the site cache"""
+	if not hasattr(frappe.local, "fiscal_year_index"):
+		frappe.local.fiscal_year_index = {}
+
+	if company not in frappe.local.fiscal_year_index:
+		fiscal_years = frappe.cache().hget("fiscal_years", company)
+
+		if fiscal_years is None:
+			# if year start date is 2012-04-01, year end date should be 2013-03-31 (hence subdate)
+			cond = ""
+			if company:
+				cond += """
+					and (not exists (select name
+						from `tabFiscal Year Company` fyc
+						where fyc.parent = fy.name)
+					or exists(select company
+						from `tabFiscal Year Company` fyc
+						where fyc.parent = fy.name
+						and fyc.company=%(company)s)
+					)
+				"""
+
+			fiscal_years = frappe.db.sql("""
+				select
+					fy.name, fy.year_start_date, fy.year_end_date
+				from
+					`tabFiscal Year` fy
+				where
+					disabled = 0 {0}
+				order by
+					fy.year_start_date""".format(cond), {
+					"company": company
+				}, as_dict=True)
+
+			frappe.cache().hset("fiscal_years", company, fiscal_years)
+
+		index = frappe._dict(fiscal_years=[], start_dates=[], max_end_dates=[], by_name={})
+		max_end_date = None
+		for fy in fiscal_years:
+			fy = frappe._dict(fy, year_start_date=getdate(fy["year_start_date"]),
+				year_end_date=getdate(fy["year_end_date"]))
+			max_end_date = max(max_end_date, fy.year_end_date) if max_end_date else fy.year_end_date
+
+			index.fiscal_years.append(fy)
+			index.start_dates.append(fy.year_start_date)
+			index.max_end_dates.append(max_end_date)
+			index.by_name[fy.name] = fy
+
+		frappe.local.fiscal_year_index[company] = index
+
+	return frappe.local.fiscal_year_index[company]
+
+def find_fiscal_year(index, date):
+	"""Returns the fiscal year with the latest start date containing the date, or None"""
+	# last year starting on or before the date
+	i = bisect_right(index.start_dates, date) - 1
+
+	# years do not overlap within a company, walk back only while an earlier year may still be open
+	while i >= 0 and index.max_end_dates[i] >= date:
+		if index.fiscal_years[i].year_end_date >= date:
+			return index.fiscal_years[i]
+		i -= 1
+
+def clear_fiscal_year_cache():
+	frappe.cache().delete_value("fiscal_years")
+	if hasattr(frappe.local, "fiscal_year_index"):
+		frappe.local.fiscal_year_index = {}
+
 def validate_fiscal_year(date, fiscal_year, company, label="Date", doc=None):
 	years = [f[0] for f in get_fiscal_years(date, label=_(label), company=company)]
 	if fiscal_year not in years:
@@ -99,9 +138,8 @@ def get_balance_on(account=None, date=None, party_type=None, party=None, company
 
 
 	cond = []
-	if date:
-		cond.append("posting_date <= %s" % frappe.db.escape(cstr(date)))
-	else:
+	balance_on_date = date
+	if not date:
 		# get balance of all entries that exist
 		date = nowdate()
 
@@ -145,10 +183,6 @@ def get_balance_on(account=None, date=None, party_type=None, party=None, company
 			or ignore_account_permission):
 			acc.check_permission("read")
 
-		if report_type == 'Profit and Loss':
-			# for pl accounts, get balance within a fiscal year
-			cond.append("posting_date >= '%s' and voucher_type != 'Period Closing Voucher'" \
-				% year_start_date)
 		# different filter for group and ledger - improved performance
 		if acc.is_group:
 			cond.append("""exists (
@@ -172,13 +206,27 @@ def get_balance_on(account=None, date=None, party_type=None, party=None, company
 
 	if account or (party_type and party):
 		if in_account_currency:
-			select_field = "sum(debit_in_account_currency) - sum(credit_in_account_currency)"
+			debit_field, credit_field = "debit_in_account_currency", "credit_in_account_currency"
 		else:
-			select_field = "sum(debit) - sum(credit)"
-		bal = frappe.db.sql("""
-			SELECT {0}
-			FROM `tabGL Entry` gle
-			WHERE {1}""".format(select_field, " and ".join(cond)))[0][0]
+			debit_field, credit_field = "debit", "credit"
+
+		# for pl accounts, get balance within a fiscal year
+		from_date = year_start_date if report_type == 'Profit and Loss' else None
+
+		# monthly balances plus the entries of the current month
+		bal = get_period_balance(debit_field, credit_field, cond, balance_on_date, from_date)
+
+		if bal is None:
+			if balance_on_date:
+				cond.append("posting_date <= %s" % frappe.db.escape(cstr(balance_on_date)))
+			if from_date:
+				cond.append("posting_date >= '%s' and voucher_type != 'Period Closing Voucher'" \
+					% from_date)
+
+			bal = frappe.db.sql("""
+				SELECT sum({0}) - sum({1})
+				FROM `tabGL Entry` gle
+				WHERE {2}""".format(debit_field, credit_field, " and ".join(cond)))[0][0]
 
 		# if bal is None, return 0
 		return flt(bal)
@@ -485,6 +533,13 @@ def unlink_ref_doc_from_payment_entries(ref_doc):
 	remove_ref_doc_link_from_jv(ref_doc.doctype, ref_doc.name)
 	remove_ref_doc_link_from_pe(ref_doc.doctype, ref_doc.name)
 
+	gl_entries = frappe.db.sql("""select voucher_type, voucher_no, party_type, party, account,
+			against_voucher_type, against_voucher, debit_in_account_currency, credit_in_account_currency,
+			company, posting_date, due_date, account_currency, cost_center
+		from `tabGL Entry`
+		where against_voucher_type=%s and against_voucher=%s
+		and voucher_no != ifnull(against_voucher, '')""", (ref_doc.doctype, ref_doc.name), as_dict=1)
+
 	frappe.db.sql("""update `tabGL Entry`
 		set against_voucher_type=null, against_voucher=null,
 		modified=%s, modified_by=%s
@@ -492,6 +547,12 @@ def unlink_ref_doc_from_payment_entries(ref_doc):
 		and voucher_no != ifnull(against_voucher, '')""",
 		(now(), frappe.session.user, ref_doc.doctype, ref_doc.name))
 
+	# move the unlinked payments out of the invoice's payment ledger entry
+	update_payment_ledger(gl_entries, sign=-1)
+	for gle in gl_entries:
+		gle.against_voucher_type, gle.against_voucher = None, None
+	update_payment_ledger(gl_entries)
+
 	if ref_doc.doctype in ("Sales Invoice", "Purchase Invoice"):
 		ref_doc.set("advances", [])
 
@@ -555,10 +616,20 @@ def fix_total_debit_credit():
 		if abs(d.diff) > 0:
 			dr_or_cr = d.voucher_type == "Sales Invoice" and "credit" or "debit"
 
-			frappe.db.sql("""update `tabGL Entry` set %s = %s + %s
-				where voucher_type = %s and voucher_no = %s and %s > 0 limit 1""" %
-				(dr_or_cr, dr_or_cr, '%s', '%s', '%s', dr_or_cr),
-				(d.diff, d.voucher_type, d.voucher_no))
+			gle = frappe.db.sql("""select name, company, account, posting_date, cost_center, party_type,
+					party, voucher_type
+				from `tabGL Entry`
+				where voucher_type = %s and voucher_no = %s and {0} > 0 limit 1""".format(dr_or_cr),
+				(d.voucher_type, d.voucher_no), as_dict=1)
+			if not gle:
+				continue
+
+			frappe.db.sql("""update `tabGL Entry` set {0} = {0} + %s where name = %s""".format(dr_or_cr),
+				(d.diff, gle[0].name))
+
+			# apply the same change to the monthly balances
+			gle[0][dr_or_cr] = d.diff
+			update_account_period_balances(gle)
 
 def get_stock_and_account_difference(account_list=None, posting_date=None, company=None):
 	from erpnext.stock.utils import get_stock_value_on
@@ -635,61 +706,11 @@ def get_outstanding_invoices(party_type, party, account, condition=None, filters
 	outstanding_invoices = []
 	precision = frappe.get_precision("Sales Invoice", "outstanding_amount") or 2
 
-	if erpnext.get_party_account_type(party_type) == 'Receivable':
-		dr_or_cr = "debit_in_account_currency - credit_in_account_currency"
-		payment_dr_or_cr = "credit_in_account_currency - debit_in_account_currency"
-	else:
-		dr_or_cr = "credit_in_account_currency - debit_in_account_currency"
-		payment_dr_or_cr = "debit_in_account_currency - credit_in_account_currency"
-
-	invoice = 'Sales Invoice' if erpnext.get_party_account_type(party_type) == 'Receivable' else 'Purchase Invoice'
 	held_invoices = get_held_invoices(party_type, party)
 
-	invoice_list = frappe.db.sql("""
-		select
-			voucher_no, voucher_type, posting_date, due_date,
-			ifnull(sum({dr_or_cr}), 0) as invoice_amount
-		from
-			`tabGL Entry`
-		where
-			party_type = %(party_type)s and party = %(party)s
-			and account = %(account)s and {dr_or_cr} > 0
-			{condition}
-			and ((voucher_type = 'Journal Entry'
-					and (against_voucher = '' or against_voucher is null))
-				or (voucher_type not in ('Journal Entry', 'Payment Entry')))
-		group by voucher_type, voucher_no
-		order by posting_date, name""".format(
-			dr_or_cr=dr_or_cr,
-			invoice = invoice,
-			condition=condition or ""
-		), {
-			"party_type": party_type,
-			"party": party,
-			"account": account,
-		}, as_dict=True)
-
-	payment_entries = frappe.db.sql("""
-		select against_voucher_type, against_voucher,
-			ifnull(sum({payment_dr_or_cr}), 0) as payment_amount
-		from `tabGL Entry`
-		where party_type = %(party_type)s and party = %(party)s
-			and account = %(account)s
-			and {payment_dr_or_cr} > 0
-			and against_voucher is not null and against_voucher != ''
-		group by against_voucher_type, against_voucher
-	""".format(payment_dr_or_cr=payment_dr_or_cr), {
-		"party_type": party_type,
-		"party": party,
-		"account": account
-	}, as_dict=True)
-
-	pe_map = frappe._dict()
-	for d in payment_entries:
-		pe_map.setdefault((d.against_voucher_type, d.against_voucher), d.payment_amount)
-
-	for d in invoice_list:
-		payment_amount = pe_map.get((d.voucher_type, d.voucher_no), 0)
+	# open items are maintained in the payment ledger as GL Entries are posted
+	for d in get_open_items(party_type, party, account, condition=condition):
+		payment_amount = flt(d.payment_amount)
 		outstanding_amount = flt(d.invoice_amount - payment_amount, precision)
 		if outstanding_amount > 0.5 / (10**precision):
 			if (filters and filters.get("outstanding_amt_greater_than") and
@@ -883,3 +904,36 @@ def get_allow_cost_center_in_entry_of_bs_account():
 	def generator():
 		return cint(frappe.db.get_value('Accounts Settings', None, 'allow_cost_center_in_entry_of_bs_account'))
 	return frappe.local_cache("get_allow_cost_center_in_entry_of_bs_account", (), generator, regenerate_if_none=True)
+
+def upsert_rows(doctype, columns, rows, add_fields, replace_fields=(), replace_if=None, batch_size=500):
+	"""Insert the rows in batches, adding `add_fields` to the existing row of the same name.
+		`replace_fields` of an existing row are overwritten if the `replace_if` column
+		of the new row is positive.
+
+		Rows are written in the order of their names, so that concurrent upserts
+		lock the rows in the same order"""
+	timestamp, user = now(), frappe.session.user
+	columns = tuple(columns) + ("creation", "modified", "owner", "modified_by")
+
+	name_index = columns.index("name")
+	rows = sorted((tuple(row) + (timestamp, timestamp, user, user) for row in rows), key=lambda row: row[name_index])
+
+	table = "`tab{0}`".format(doctype)
+	if frappe.db.db_type == "postgres":
+		updates = ["{0} = case when excluded.{1} > 0 then excluded.{0} else {2}.{0} end".format(f, replace_if, table)
+			for f in replace_fields]
+		updates += ["{0} = {1}.{0} + excluded.{0}".format(f, table) for f in add_fields]
+		on_conflict = "on conflict (name) do update set {0}".format(", ".join(updates))
+	else:
+		updates = ["{0} = if(values({1}) > 0, values({0}), {0})".format(f, replace_if) for f in replace_fields]
+		updates += ["{0} = {0} + values({0})".format(f) for f in add_fields]
+		on_conflict = "on duplicate key update {0}".format(", ".join(updates))
+
+	for i in range(0, len(rows), batch_size):
+		batch = rows[i:i + batch_size]
+		frappe.db.sql("""insert into {table} ({columns}) values {values} {on_conflict}""".format(
+			table=table,
+			columns=", ".join(columns),
+			values=", ".join(["({0})".format(", ".join(["%s"] * len(columns)))] * len(batch)),
+			on_conflict=on_conflict
+		), tuple(v for row in batch for v in row))
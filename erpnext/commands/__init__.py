@@ -44,6 +44,82 @@ def make_demo(context, site, domain='Manufacturing', days=100,
 			from erpnext.demo import demo
 			demo.make(domain, days)
 
+@click.command('repost-stock')
+@click.option('--site', help='site name')
+@click.option('--workers', default=4, help='Number of worker processes. Default 4')
+@click.option('--resume', default=False, is_flag=True,
+	help='Skip item-warehouses already reposted by an interrupted run')
+@click.option('--only-actual', default=False, is_flag=True, help='Only repost actual qty and valuation')
+@click.option('--only-bin', default=False, is_flag=True, help='Only update Bin quantities')
+@click.option('--allow-negative-stock', default=False, is_flag=True)
+@click.option('--allow-zero-rate', default=False, is_flag=True)
+@click.option('--skip-gle', default=False, is_flag=True, help='Do not repost GL Entries of stock transactions')
+@pass_context
+def repost_stock(context, site, workers=4, resume=False, only_actual=False, only_bin=False,
+	allow_negative_stock=False, allow_zero_rate=False, skip_gle=False):
+	"Repost Stock Ledger, Bin and stock GL Entries of all item-warehouses in parallel"
+	from erpnext.stock.stock_balance import parallel_repost
+
+	site = get_site(context)
+	parallel_repost(site, workers=workers, only_actual=only_actual,
+		allow_negative_stock=allow_negative_stock, allow_zero_rate=allow_zero_rate,
+		only_bin=only_bin, resume=resume, repost_gle=not skip_gle)
+
+@click.command('verify-account-balances')
+@click.option('--site', help='site name')
+@click.option('--company', help='Only verify the balances of this company')
+@click.option('--rebuild', default=False, is_flag=True, help='Rebuild the balances from GL Entries if they differ')
+@pass_context
+def verify_account_balances(context, site, company=None, rebuild=False):
+	"Compare the monthly Account Period Balances with GL Entries"
+	from erpnext.accounts.doctype.account_period_balance.account_period_balance import (
+		verify_account_period_balances, rebuild_account_period_balances)
+
+	site = get_site(context)
+	with frappe.init_site(site):
+		frappe.connect()
+
+		differences = verify_account_period_balances(company)
+		for key, balance, gl_balance in differences:
+			print("{0}: balance {1}, GL {2}".format(", ".join(str(d) for d in key), balance, gl_balance))
+
+		if not differences:
+			print("Account Period Balances match GL Entries")
+		elif rebuild:
+			rebuild_account_period_balances(company)
+			frappe.db.commit()
+			print("Rebuilt Account Period Balances")
+
+@click.command('export-trial-balance')
+@click.option('--site', help='site name')
+@click.option('--fiscal-year', required=True)
+@click.option('--company', multiple=True, help='Company to export, can be repeated. Default all companies')
+@click.option('--workers', default=4, help='Number of companies computed at a time. Default 4')
+@click.option('--output-dir', default='.', help='Directory of the CSV files. Default current directory')
+@pass_context
+def export_trial_balance(context, site, fiscal_year, company=None, workers=4, output_dir='.'):
+	"Export the Trial Balance of several companies to CSV files, computing the companies in parallel"
+	import os
+	from erpnext.accounts.report.trial_balance.trial_balance import get_trial_balances, get_columns
+	from erpnext.accounts.report.general_ledger.general_ledger import write_csv
+
+	site = get_site(context)
+	with frappe.init_site(site):
+		frappe.connect()
+
+		companies = list(company) or [d.name for d in frappe.get_all("Company")]
+		trial_balances = get_trial_balances(companies, {"fiscal_year": fiscal_year}, workers=workers)
+
+		columns = get_columns()
+		for company_name in companies:
+			path = os.path.join(output_dir, "trial_balance_{0}.csv".format(frappe.scrub(company_name)))
+			write_csv(path, columns, ([row.get(c["fieldname"]) for c in columns]
+				for row in trial_balances[company_name] or []))
+			print("Exported {0}".format(path))
+
 commands = [
-	make_demo
+	make_demo,
+	repost_stock,
+	verify_account_balances,
+	export_trial_balance
 ]
\ No newline at end of file
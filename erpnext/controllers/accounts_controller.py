@@ -232,7 +232,7 @@ class AccountsController(TransactionBase):
 
 	def set_missing_item_details(self, for_validate=False):
 		"""set missing item values"""
-		from erpnext.stock.get_item_details import get_item_details
+		from erpnext.stock.get_item_details import get_items_details_bulk
 		from erpnext.stock.doctype.serial_no.serial_no import get_serial_nos
 
 		if hasattr(self, "items"):
@@ -249,6 +249,7 @@ class AccountsController(TransactionBase):
 			if self.doctype == "Quotation" and self.quotation_to == "Customer" and parent_dict.get("party_name"):
 				parent_dict.update({"customer": parent_dict.get("party_name")})
 
+			items, items_args = [], []
 			for item in self.get("items"):
 				if item.get("item_code"):
 					args = parent_dict.copy()
@@ -264,41 +265,44 @@ class AccountsController(TransactionBase):
 					if self.get("is_subcontracted"):
 						args["is_subcontracted"] = self.is_subcontracted
 
-					ret = get_item_details(args, self, overwrite_warehouse=False)
+					items.append(item)
+					items_args.append(args)
 
-					for fieldname, value in ret.items():
-						if item.meta.get_field(fieldname) and value is not None:
-							if (item.get(fieldname) is None or fieldname in force_item_fields):
-								item.set(fieldname, value)
+			# the details of all the rows are fetched together
+			for item, ret in zip(items, get_items_details_bulk(items_args, doc=self, overwrite_warehouse=False)):
+				for fieldname, value in ret.items():
+					if item.meta.get_field(fieldname) and value is not None:
+						if (item.get(fieldname) is None or fieldname in force_item_fields):
+							item.set(fieldname, value)
 
-							elif fieldname in ['cost_center', 'conversion_factor'] and not item.get(fieldname):
-								item.set(fieldname, value)
+						elif fieldname in ['cost_center', 'conversion_factor'] and not item.get(fieldname):
+							item.set(fieldname, value)
 
-							elif fieldname == "serial_no":
-								# Ensure that serial numbers are matched against Stock UOM
-								item_conversion_factor = item.get("conversion_factor") or 1.0
-								item_qty = abs(item.get("qty")) * item_conversion_factor
+						elif fieldname == "serial_no":
+							# Ensure that serial numbers are matched against Stock UOM
+							item_conversion_factor = item.get("conversion_factor") or 1.0
+							item_qty = abs(item.get("qty")) * item_conversion_factor
 
-								if item_qty != len(get_serial_nos(item.get('serial_no'))):
-									item.set(fieldname, value)
+							if item_qty != len(get_serial_nos(item.get('serial_no'))):
+								item.set(fieldname, value)
 
-					if self.doctype in ["Purchase Invoice", "Sales Invoice"] and item.meta.get_field('is_fixed_asset'):
-						item.set('is_fixed_asset', ret.get('is_fixed_asset', 0))
+				if self.doctype in ["Purchase Invoice", "Sales Invoice"] and item.meta.get_field('is_fixed_asset'):
+					item.set('is_fixed_asset', ret.get('is_fixed_asset', 0))
 
-					if ret.get("pricing_rules") and not ret.get("validate_applied_rule", 0):
-						# if user changed the discount percentage then set user's discount percentage ?
-						item.set("pricing_rules", ret.get("pricing_rules"))
-						item.set("discount_percentage", ret.get("discount_percentage"))
-						item.set("discount_amount", ret.get("discount_amount"))
-						if ret.get("pricing_rule_for") == "Rate":
-							item.set("price_list_rate", ret.get("price_list_rate"))
+				if ret.get("pricing_rules") and not ret.get("validate_applied_rule", 0):
+					# if user changed the discount percentage then set user's discount percentage ?
+					item.set("pricing_rules", ret.get("pricing_rules"))
+					item.set("discount_percentage", ret.get("discount_percentage"))
+					item.set("discount_amount", ret.get("discount_amount"))
+					if ret.get("pricing_rule_for") == "Rate":
+						item.set("price_list_rate", ret.get("price_list_rate"))
 
-						if item.get("price_list_rate"):
-							item.rate = flt(item.price_list_rate *
-								(1.0 - (flt(item.discount_percentage) / 100.0)), item.precision("rate"))
+					if item.get("price_list_rate"):
+						item.rate = flt(item.price_list_rate *
+							(1.0 - (flt(item.discount_percentage) / 100.0)), item.precision("rate"))
 
-							if item.get('discount_amount'):
-								item.rate = item.price_list_rate - item.discount_amount
+						if item.get('discount_amount'):
+							item.rate = item.price_list_rate - item.discount_amount
 
 			if self.doctype == "Purchase Invoice":
 				self.set_expense_account(for_validate)
@@ -11,6 +11,8 @@ from erpnext.accounts.general_ledger import make_gl_entries, delete_gl_entries,
 from erpnext.controllers.accounts_controller import AccountsController
 from erpnext.stock.stock_ledger import get_valuation_rate
 from erpnext.stock import get_warehouse_account_map
+from erpnext.stock.utils import get_combine_datetime
+from erpnext.stock.doctype.repost_item_valuation.repost_item_valuation import is_future_repost_deferred
 
 class QualityInspectionRequiredError(frappe.ValidationError): pass
 class QualityInspectionRejectedError(frappe.ValidationError): pass
@@ -33,7 +35,9 @@ class StockController(AccountsController):
 					gl_entries = self.get_gl_entries(warehouse_account)
 				make_gl_entries(gl_entries, from_repost=from_repost)
 
-			if repost_future_gle:
+			# when future stock is reposted in background, the repost queue
+			# also reposts the accounting entries of the future vouchers
+			if repost_future_gle and not is_future_repost_deferred(self.doctype):
 				items, warehouses = self.get_items_and_warehouses()
 				update_gl_entries_after(self.posting_date, self.posting_time, warehouses, items,
 					warehouse_account, company=self.company)
@@ -375,8 +379,13 @@ class StockController(AccountsController):
 			frappe.get_doc("Blanket Order", blanket_order).update_ordered_qty()
 
 def update_gl_entries_after(posting_date, posting_time, for_warehouses=None, for_items=None,
-		warehouse_account=None, company=None):
+		warehouse_account=None, company=None, progress_callback=None):
 	def _delete_gl_entries(voucher_type, voucher_no):
+		from erpnext.accounts.doctype.account_period_balance.account_period_balance import remove_account_period_balances
+		from erpnext.accounts.doctype.payment_ledger_entry.payment_ledger_entry import remove_payment_ledger_entries
+
+		remove_account_period_balances(voucher_type, voucher_no)
+		remove_payment_ledger_entries(voucher_type, voucher_no)
 		frappe.db.sql("""delete from `tabGL Entry`
 			where voucher_type=%s and voucher_no=%s""", (voucher_type, voucher_no))
 
@@ -397,6 +406,9 @@ def update_gl_entries_after(posting_date, posting_time, for_warehouses=None, for
 		else:
 			_delete_gl_entries(voucher_type, voucher_no)
 
+		if progress_callback:
+			progress_callback()
+
 def compare_existing_and_expected_gle(existing_gle, expected_gle):
 	matched = True
 	for entry in expected_gle:
@@ -429,9 +441,9 @@ def get_future_stock_vouchers(posting_date, posting_time, for_warehouses=None, f
 
 	for d in frappe.db.sql("""select distinct sle.voucher_type, sle.voucher_no
 		from `tabStock Ledger Entry` sle
-		where timestamp(sle.posting_date, sle.posting_time) >= timestamp(%s, %s) {condition}
-		order by timestamp(sle.posting_date, sle.posting_time) asc, creation asc""".format(condition=condition),
-		tuple([posting_date, posting_time] + values), as_dict=True):
+		where sle.posting_datetime >= %s {condition}
+		order by sle.posting_datetime asc, creation asc""".format(condition=condition),
+		tuple([get_combine_datetime(posting_date, posting_time)] + values), as_dict=True):
 			future_stock_vouchers.append([d.voucher_type, d.voucher_no])
 
 	return future_stock_vouchers
@@ -14,26 +14,7 @@ from frappe.utils.make_random import get_random
 class TestFees(unittest.TestCase):
 
 	def test_fees(self):
-		student = get_random("Student")
-		fee = frappe.new_doc("Fees")
-		fee.posting_date = nowdate()
-		fee.due_date = nowdate()
-		fee.student = student
-		fee.receivable_account = "_Test Receivable - _TC"
-		fee.income_account = "Sales - _TC"
-		fee.cost_center = "_Test Cost Center - _TC"
-		fee.company = "_Test Company"
-
-		fee.extend("components", [
-			{
-				"fees_category": "Tuition Fee",
-				"amount": 40000
-			},
-			{
-				"fees_category": "Transportation Fee",
-				"amount": 10000
-			}])
-		fee.save()
+		fee = make_fees()
 		fee.submit()
 
 		gl_entries = frappe.db.sql("""
@@ -51,3 +32,33 @@ class TestFees(unittest.TestCase):
 			self.assertEqual(gl_entries[0].debit, 0)
 			self.assertEqual(gl_entries[1].credit, 0)
 			self.assertEqual(gl_entries[1].debit, 50000)
+
+	def test_fees_outstanding_on_submit_and_cancel(self):
+		fee = make_fees()
+		fee.submit()
+		self.assertEqual(frappe.db.get_value("Fees", fee.name, "outstanding_amount"), 50000)
+
+		fee.cancel()
+		self.assertEqual(frappe.db.get_value("Fees", fee.name, "docstatus"), 2)
+
+def make_fees():
+	fee = frappe.new_doc("Fees")
+	fee.posting_date = nowdate()
+	fee.due_date = nowdate()
+	fee.student = get_random("Student")
+	fee.receivable_account = "_Test Receivable - _TC"
+	fee.income_account = "Sales - _TC"
+	fee.cost_center = "_Test Cost Center - _TC"
+	fee.company = "_Test Company"
+
+	fee.extend("components", [
+		{
+			"fees_category": "Tuition Fee",
+			"amount": 40000
+		},
+		{
+			"fees_category": "Transportation Fee",
+			"amount": 10000
+		}])
+	fee.save()
+	return fee
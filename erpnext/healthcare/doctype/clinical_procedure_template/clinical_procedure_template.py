@@ -7,6 +7,7 @@ import frappe, json
 from frappe import _
 from frappe.model.document import Document
 from frappe.utils import nowdate
+from erpnext.stock.doctype.item_price.item_price import clear_item_price_cache
 
 class ClinicalProcedureTemplate(Document):
 	def on_update(self):
@@ -61,6 +62,7 @@ def updating_item(self):
 def updating_rate(self):
 	frappe.db.sql("""update `tabItem Price` set item_name=%s, price_list_rate=%s, modified=NOW() where
 	 item_code=%s""",(self.template, self.rate, self.item))
+	clear_item_price_cache()
 
 def create_item_from_template(doc):
 	if(doc.is_billable == 1):
@@ -37,6 +37,9 @@ setup_wizard_test = "erpnext.setup.setup_wizard.test_setup_wizard.run_setup_wiza
 before_install = "erpnext.setup.install.check_setup_wizard_not_completed"
 after_install = "erpnext.setup.install.after_install"
 
+# patches and tree rebuilds write Pricing Rules and trees with SQL
+after_migrate = ["erpnext.accounts.doctype.pricing_rule.utils.clear_pricing_rule_index"]
+
 boot_session = "erpnext.startup.boot.boot_session"
 notification_config = "erpnext.startup.notifications.get_notification_config"
 get_help_messages = "erpnext.utilities.activation.get_help_messages"
@@ -211,10 +214,22 @@ doc_events = {
 		"on_update": ["erpnext.hr.doctype.employee.employee.update_user_permissions",
 			"erpnext.portal.utils.set_default_role"]
 	},
+	"*": {
+		"after_rename": ["erpnext.accounts.doctype.account_period_balance.account_period_balance.update_balance_names",
+			"erpnext.accounts.doctype.payment_ledger_entry.payment_ledger_entry.update_entry_names"]
+	},
+	("Customer", "Supplier", "UOM", "Price List"): {
+		"after_rename": "erpnext.stock.doctype.item_price.item_price.clear_item_price_cache_on_rename"
+	},
 	("Sales Taxes and Charges Template", 'Price List'): {
 		"on_update": "erpnext.shopping_cart.doctype.shopping_cart_settings.shopping_cart_settings.validate_cart_settings"
 	},
 
+	("Item Group", "Customer Group", "Territory", "Supplier Group", "Warehouse"): {
+		"on_update": "erpnext.accounts.doctype.pricing_rule.utils.clear_pricing_rule_index",
+		"on_trash": "erpnext.accounts.doctype.pricing_rule.utils.clear_pricing_rule_index",
+		"after_rename": "erpnext.accounts.doctype.pricing_rule.utils.clear_pricing_rule_index"
+	},
 	"Website Settings": {
 		"validate": "erpnext.portal.doctype.products_settings.products_settings.home_page_is_products"
 	},
@@ -286,7 +301,12 @@ scheduler_events = {
 		"erpnext.crm.doctype.email_campaign.email_campaign.send_email_to_leads_or_contacts",
 		"erpnext.crm.doctype.email_campaign.email_campaign.set_email_campaign_status"
 	],
+	"hourly_long": [
+		"erpnext.stock.doctype.repost_item_valuation.repost_item_valuation.repost_entries"
+	],
 	"daily_long": [
+		"erpnext.stock.doctype.stock_closing_balance.stock_closing_balance.create_stock_closing_balances",
+		"erpnext.accounts.doctype.gl_entry.gl_entry.verify_outstanding_amounts",
 		"erpnext.manufacturing.doctype.bom_update_tool.bom_update_tool.update_latest_price_in_all_boms",
 		"erpnext.hr.doctype.leave_ledger_entry.leave_ledger_entry.process_expired_allocation",
 		"erpnext.hr.utils.generate_leave_encashment"
@@ -0,0 +1,13 @@
+# Copyright (c) 2020, Frappe and Contributors
+# License: GNU General Public License v3. See license.txt
+
+from __future__ import unicode_literals
+import frappe
+from erpnext.accounts.doctype.payment_ledger_entry.payment_ledger_entry import rebuild_payment_ledger
+
+def execute():
+	frappe.reload_doc("accounts", "doctype", "payment_ledger_entry")
+
+	for company in frappe.db.sql_list("select name from tabCompany"):
+		rebuild_payment_ledger(company)
+		frappe.db.commit()
@@ -0,0 +1,29 @@
+# Copyright (c) 2020, Frappe and Contributors
+# License: GNU General Public License v3. See license.txt
+
+from __future__ import unicode_literals
+import frappe
+
+def execute():
+	frappe.reload_doc("stock", "doctype", "stock_ledger_entry")
+
+	# backfill in batches to keep the transactions (and locks) short on large ledgers
+	set_posting_datetime("Stock Ledger Entry", "timestamp(posting_date, posting_time)")
+
+	from erpnext.stock.doctype.stock_ledger_entry.stock_ledger_entry import on_doctype_update
+	on_doctype_update()
+
+def set_posting_datetime(doctype, expression, batch_size=10000):
+	# walk the table by primary key, so that each batch reads only its own rows
+	last_name = ""
+	while True:
+		names = frappe.db.sql_list("""select name from `tab{0}` where name > %s
+			order by name limit {1}""".format(doctype, batch_size), last_name)
+		if not names:
+			break
+
+		frappe.db.sql("""update `tab{0}` set posting_datetime = {1}
+			where name > %s and name <= %s""".format(doctype, expression), (last_name, names[-1]))
+		frappe.db.commit()
+
+		last_name = names[-1]
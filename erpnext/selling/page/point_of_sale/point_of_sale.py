@@ -6,6 +6,7 @@ import frappe, json
 from frappe.utils.nestedset import get_root_of
 from frappe.utils import cint
 from erpnext.accounts.doctype.pos_profile.pos_profile import get_item_groups
+from erpnext.stock.doctype.item_price.item_price import get_item_price_for_listing
 
 from six import string_types
 
@@ -56,14 +57,11 @@ def get_items(start, page_length, price_list, item_group, search_value="", pos_p
 
 	if items_data:
 		items = [d.item_code for d in items_data]
-		item_prices_data = frappe.get_all("Item Price",
-			fields = ["item_code", "price_list_rate", "currency"],
-			filters = {'price_list': price_list, 'item_code': ['in', items]})
-
 		item_prices, bin_data = {}, {}
-		for d in item_prices_data:
-			item_prices[d.item_code] = d
-
+		for item_code in items:
+			item_price = get_item_price_for_listing(price_list, item_code)
+			if item_price:
+				item_prices[item_code] = item_price
 
 		if display_items_in_stock:
 			filters = {'actual_qty': [">", 0], 'item_code': ['in', items]}
@@ -7,6 +7,7 @@ from frappe import _
 from frappe.utils import flt, add_days
 from frappe.utils import get_datetime_str, nowdate
 from erpnext import get_default_company
+from erpnext.stock.doctype.item_price.item_price import clear_item_price_cache
 
 def get_root_of(doctype):
 	"""Get root element of a DocType with a tree structure"""
@@ -49,6 +50,7 @@ def before_tests():
 	frappe.db.sql("delete from `tabLeave Application`")
 	frappe.db.sql("delete from `tabSalary Slip`")
 	frappe.db.sql("delete from `tabItem Price`")
+	clear_item_price_cache()
 
 	frappe.db.set_value("Stock Settings", None, "auto_insert_price_list_rate_if_missing", 0)
 	enable_all_roles_and_domains()
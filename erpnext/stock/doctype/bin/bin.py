@@ -3,7 +3,7 @@
 
 from __future__ import unicode_literals
 import frappe
-from frappe.utils import flt, nowdate
+from frappe.utils import cint, flt, nowdate, now
 import frappe.defaults
 from frappe.model.document import Document
 
@@ -13,43 +13,6 @@ class Bin(Document):
 			self.stock_uom = frappe.get_cached_value('Item', self.item_code, 'stock_uom')
 		self.set_projected_qty()
 
-	def update_stock(self, args, allow_negative_stock=False, via_landed_cost_voucher=False):
-		'''Called from erpnext.stock.utils.update_bin'''
-		self.update_qty(args)
-
-		if args.get("actual_qty") or args.get("voucher_type") == "Stock Reconciliation":
-			from erpnext.stock.stock_ledger import update_entries_after
-
-			if not args.get("posting_date"):
-				args["posting_date"] = nowdate()
-
-			# update valuation and qty after transaction for post dated entry
-			if args.get("is_cancelled") == "Yes" and via_landed_cost_voucher:
-				return
-			update_entries_after({
-				"item_code": self.item_code,
-				"warehouse": self.warehouse,
-				"posting_date": args.get("posting_date"),
-				"posting_time": args.get("posting_time"),
-				"voucher_no": args.get("voucher_no")
-			}, allow_negative_stock=allow_negative_stock, via_landed_cost_voucher=via_landed_cost_voucher)
-
-	def update_qty(self, args):
-		# update the stock values (for current quantities)
-		if args.get("voucher_type")=="Stock Reconciliation":
-			if args.get('is_cancelled') == 'No':
-				self.actual_qty = args.get("qty_after_transaction")
-		else:
-			self.actual_qty = flt(self.actual_qty) + flt(args.get("actual_qty"))
-
-		self.ordered_qty = flt(self.ordered_qty) + flt(args.get("ordered_qty"))
-		self.reserved_qty = flt(self.reserved_qty) + flt(args.get("reserved_qty"))
-		self.indented_qty = flt(self.indented_qty) + flt(args.get("indented_qty"))
-		self.planned_qty = flt(self.planned_qty) + flt(args.get("planned_qty"))
-
-		self.set_projected_qty()
-		self.db_update()
-
 	def set_projected_qty(self):
 		self.projected_qty = (flt(self.actual_qty) + flt(self.ordered_qty)
 			+ flt(self.indented_qty) + flt(self.planned_qty) - flt(self.reserved_qty)
@@ -60,7 +23,7 @@ class Bin(Document):
 			select * from `tabStock Ledger Entry`
 			where item_code = %s
 			and warehouse = %s
-			order by timestamp(posting_date, posting_time) asc, creation asc
+			order by posting_datetime asc, creation asc
 			limit 1
 		""", (self.item_code, self.warehouse), as_dict=1)
 		return sle and sle[0] or None
@@ -128,3 +91,105 @@ class Bin(Document):
 
 def on_doctype_update():
 	frappe.db.add_index("Bin", ["item_code", "warehouse"])
+
+# qty fields which are changed by transactions as a delta
+DELTA_QTY_FIELDS = ("ordered_qty", "reserved_qty", "indented_qty", "planned_qty")
+
+def get_projected_qty_expression(actual_qty="actual_qty", **qty):
+	"""SQL expression of projected qty, the qty columns can be replaced by other expressions"""
+	qty = {fieldname: qty.get(fieldname) or fieldname for fieldname in DELTA_QTY_FIELDS}
+	return """({actual_qty} + {ordered_qty} + {indented_qty} + {planned_qty} - {reserved_qty}
+		- reserved_qty_for_production - reserved_qty_for_sub_contract)""".format(actual_qty=actual_qty, **qty)
+
+def update_qty(bin_name, args):
+	"""Apply the qty changes of a transaction to the bin in a single atomic update,
+		without loading and saving the Bin document"""
+	values = {"name": bin_name, "modified": now()}
+	for fieldname in DELTA_QTY_FIELDS:
+		values[fieldname] = flt(args.get(fieldname))
+
+	# update the stock values (for current quantities)
+	if args.get("voucher_type") == "Stock Reconciliation":
+		if args.get("is_cancelled") == "No":
+			actual_qty = "%(qty_after_transaction)s"
+			values["qty_after_transaction"] = flt(args.get("qty_after_transaction"))
+		else:
+			actual_qty = "actual_qty"
+	else:
+		actual_qty = "actual_qty + %(actual_qty)s"
+		values["actual_qty"] = flt(args.get("actual_qty"))
+
+	# projected qty is set first and from the old values plus the deltas,
+	# so that it does not depend on the order in which the database applies assignments
+	projected_qty = get_projected_qty_expression("({0})".format(actual_qty),
+		**{f: "({0} + %({0})s)".format(f) for f in DELTA_QTY_FIELDS})
+
+	frappe.db.sql("""update `tabBin`
+		set projected_qty = {projected_qty},
+			actual_qty = {actual_qty},
+			{delta_qty},
+			modified = %(modified)s
+		where name = %(name)s""".format(
+			projected_qty=projected_qty,
+			actual_qty=actual_qty,
+			delta_qty=", ".join("{0} = {0} + %({0})s".format(f) for f in DELTA_QTY_FIELDS)
+		), values)
+
+def update_stock(bin_name, args, allow_negative_stock=False, via_landed_cost_voucher=False):
+	'''Called from erpnext.stock.utils.update_bin'''
+	update_qty(bin_name, args)
+
+	if args.get("actual_qty") or args.get("voucher_type") == "Stock Reconciliation":
+		from erpnext.stock.stock_ledger import (update_entries_after, has_future_sle,
+			validate_future_negative_qty)
+		from erpnext.stock.doctype.repost_item_valuation.repost_item_valuation import (
+			is_future_repost_deferred, create_repost_item_valuation_entry, has_pending_repost)
+
+		if not args.get("posting_date"):
+			args["posting_date"] = nowdate()
+
+		# update valuation and qty after transaction for post dated entry
+		if args.get("is_cancelled") == "Yes" and via_landed_cost_voucher:
+			return
+
+		repost_args = {
+			"item_code": args.get("item_code"),
+			"warehouse": args.get("warehouse"),
+			"posting_date": args.get("posting_date"),
+			"posting_time": args.get("posting_time"),
+			"voucher_type": args.get("voucher_type"),
+			"voucher_no": args.get("voucher_no")
+		}
+
+		# for backdated entries, only the current time-bucket is reposted here,
+		# future entries are queued for reposting in background
+		defer_future_repost = is_future_repost_deferred(args.get("voucher_type")) \
+			and has_future_sle(repost_args)
+
+		# while a repost of the item-warehouse is pending, the future balances are outdated
+		# and negative stock is validated when it is reposted
+		if defer_future_repost and not via_landed_cost_voucher and not (allow_negative_stock
+				or cint(frappe.db.get_single_value("Stock Settings", "allow_negative_stock"))) \
+				and not has_pending_repost(args.get("item_code"), args.get("warehouse")):
+			validate_future_negative_qty(dict(repost_args, actual_qty=args.get("actual_qty")))
+
+		update_entries_after(repost_args, allow_negative_stock=allow_negative_stock,
+			via_landed_cost_voucher=via_landed_cost_voucher,
+			repost_future_entries=not defer_future_repost)
+
+		if defer_future_repost:
+			create_repost_item_valuation_entry(repost_args)
+
+def set_stock_balance(bin_name, actual_qty, valuation_rate, stock_value):
+	"""Set the balance after reposting, called from update_entries_after"""
+	frappe.db.sql("""update `tabBin`
+		set projected_qty = {0}, actual_qty = %(actual_qty)s,
+			valuation_rate = %(valuation_rate)s, stock_value = %(stock_value)s,
+			modified = %(modified)s
+		where name = %(name)s""".format(get_projected_qty_expression("%(actual_qty)s")), {
+			"name": bin_name,
+			"actual_qty": flt(actual_qty),
+			"valuation_rate": flt(valuation_rate),
+			"stock_value": flt(stock_value),
+			"modified": now()
+		})
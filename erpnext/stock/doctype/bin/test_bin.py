@@ -5,8 +5,42 @@ from __future__ import unicode_literals
 
 import frappe
 import unittest
+from frappe.utils import flt
+from erpnext.stock.doctype.bin.bin import update_qty
+from erpnext.stock.doctype.stock_entry.stock_entry_utils import make_stock_entry
+from erpnext.stock.stock_balance import get_stale_bins, reconcile_stale_bins
+from erpnext.stock.utils import get_or_make_bin
 
 # test_records = frappe.get_test_records('Bin')
 
 class TestBin(unittest.TestCase):
-	pass
+	def setUp(self):
+		self.item_code = "_Test Item"
+		self.warehouse = "_Test Warehouse - _TC"
+		self.bin_name = get_or_make_bin(self.item_code, self.warehouse)
+
+	def test_update_qty(self):
+		before = frappe.get_doc("Bin", self.bin_name)
+
+		update_qty(self.bin_name, {"actual_qty": 5, "ordered_qty": 3, "reserved_qty": 2})
+
+		after = frappe.get_doc("Bin", self.bin_name)
+		self.assertEqual(flt(after.actual_qty), flt(before.actual_qty) + 5)
+		self.assertEqual(flt(after.ordered_qty), flt(before.ordered_qty) + 3)
+		self.assertEqual(flt(after.reserved_qty), flt(before.reserved_qty) + 2)
+		self.assertEqual(flt(after.projected_qty), flt(before.projected_qty) + 6)
+
+		after.set_projected_qty()
+		self.assertEqual(flt(after.projected_qty), flt(before.projected_qty) + 6)
+
+		update_qty(self.bin_name, {"actual_qty": -5, "ordered_qty": -3, "reserved_qty": -2})
+
+	def test_reconcile_stale_bins(self):
+		make_stock_entry(item_code=self.item_code, target=self.warehouse, qty=1, basic_rate=100)
+		self.assertFalse(get_stale_bins(self.item_code, self.warehouse))
+
+		frappe.db.sql("update `tabBin` set actual_qty = actual_qty + 10 where name=%s", self.bin_name)
+		self.assertEqual(len(get_stale_bins(self.item_code, self.warehouse)), 1)
+
+		reconcile_stale_bins(self.item_code, self.warehouse)
+		self.assertFalse(get_stale_bins(self.item_code, self.warehouse))
@@ -11,6 +11,7 @@ import copy
 from erpnext.controllers.item_variant import (ItemVariantExistsError,
 		copy_attributes_to_variant, get_variant, make_variant_item_code, validate_item_variant_attributes)
 from erpnext.setup.doctype.item_group.item_group import (get_parent_item_groups, invalidate_cache_for)
+from erpnext.stock.doctype.item_price.item_price import clear_item_price_cache
 from frappe import _, msgprint
 from frappe.utils import (cint, cstr, flt, formatdate, get_timestamp, getdate,
 						  now_datetime, random_string, strip)
@@ -134,7 +135,10 @@ class Item(WebsiteGenerator):
 					where parentfield='website_item_groups' and parenttype='Item' and parent=%s""", self.name)
 
 	def on_update(self):
+		from erpnext.stock.stock_ledger import clear_valuation_rate_cache
+
 		invalidate_cache_for_item(self)
+		clear_valuation_rate_cache(self.name)
 		self.validate_name_with_item_group()
 		self.update_variants()
 		self.update_item_price()
@@ -603,6 +607,7 @@ class Item(WebsiteGenerator):
 		super(Item, self).on_trash()
 		frappe.db.sql("""delete from tabBin where item_code=%s""", self.name)
 		frappe.db.sql("delete from `tabItem Price` where item_code=%s", self.name)
+		clear_item_price_cache()
 		for variant_of in frappe.get_all("Item", filters={"variant_of": self.name}):
 			frappe.delete_doc("Item", variant_of.name)
 
@@ -628,6 +633,9 @@ class Item(WebsiteGenerator):
 
 		frappe.db.set_value("Item", new_name, "item_code", new_name)
 
+		# Item Prices of the item are renamed with SQL
+		clear_item_price_cache()
+
 		if merge:
 			self.set_last_purchase_rate(new_name)
 			self.recalculate_bin_qty(new_name)
@@ -13,7 +13,8 @@ from erpnext.stock.doctype.item.item import StockExistsForTemplate, InvalidBarco
 from erpnext.stock.doctype.item.item import get_uom_conv_factor
 from frappe.model.rename_doc import rename_doc
 from erpnext.stock.doctype.stock_entry.stock_entry_utils import make_stock_entry
-from erpnext.stock.get_item_details import get_item_details
+from erpnext.stock.get_item_details import get_item_details, get_items_details_bulk
+from erpnext.stock.doctype.item_price.item_price import clear_item_price_cache
 
 from six import iteritems
 
@@ -59,6 +60,7 @@ class TestItem(unittest.TestCase):
 	def test_get_item_details(self):
 		# delete modified item price record and make as per test_records
 		frappe.db.sql("""delete from `tabItem Price`""")
+		clear_item_price_cache()
 
 		to_check = {
 			"item_code": "_Test Item",
@@ -102,6 +104,53 @@ class TestItem(unittest.TestCase):
 		for key, value in iteritems(to_check):
 			self.assertEqual(value, details.get(key))
 
+	def test_get_items_details_bulk(self):
+		args = {
+			"company": "_Test Company",
+			"price_list": "_Test Price List",
+			"currency": "_Test Currency",
+			"doctype": "Sales Order",
+			"conversion_rate": 1,
+			"price_list_currency": "_Test Currency",
+			"plc_conversion_rate": 1,
+			"order_type": "Sales",
+			"customer": "_Test Customer",
+			"transaction_date": "2017-04-20"
+		}
+		items = [{"item_code": item_code, "qty": qty} for item_code in ("_Test Item", "_Test Item 2",
+			"_Test Item With Item Tax Template", "_Test Non Stock Item") for qty in (1, 5)]
+
+		for row, details in zip(items, get_items_details_bulk(items, args)):
+			row_args = dict(args)
+			row_args.update(row)
+			self.assertEqual(details, get_item_details(row_args))
+
+	def test_get_items_details_bulk_inserts_item_price_once(self):
+		item = make_item("_Test Bulk Item Price Item")
+		frappe.db.sql("delete from `tabItem Price` where item_code=%s", item.name)
+		clear_item_price_cache()
+
+		auto_insert = frappe.db.get_single_value("Stock Settings", "auto_insert_price_list_rate_if_missing")
+		frappe.db.set_value("Stock Settings", None, "auto_insert_price_list_rate_if_missing", 1)
+		try:
+			get_items_details_bulk([{"item_code": item.name, "qty": 1, "rate": rate} for rate in (100, 200)], {
+				"company": "_Test Company",
+				"price_list": "_Test Price List",
+				"currency": "INR",
+				"doctype": "Sales Order",
+				"conversion_rate": 1,
+				"price_list_currency": "INR",
+				"plc_conversion_rate": 1,
+				"order_type": "Sales",
+				"customer": "_Test Customer"
+			})
+		finally:
+			frappe.db.set_value("Stock Settings", None, "auto_insert_price_list_rate_if_missing", auto_insert)
+
+		# the second row finds the price inserted by the first row
+		self.assertEqual(frappe.get_all("Item Price", filters={"item_code": item.name,
+			"price_list": "_Test Price List"}, fields=["price_list_rate"]), [{"price_list_rate": 100}])
+
 	def test_item_tax_template(self):
 		expected_item_tax_template = [
 			{"item_code": "_Test Item With Item Tax Template", "tax_category": "",
@@ -3,7 +3,9 @@
 
 from __future__ import unicode_literals
 import frappe
+from collections import OrderedDict
 from frappe import _
+from frappe.utils import cstr, flt, getdate, nowdate
 
 
 class ItemPriceDuplicateItem(frappe.ValidationError): pass
@@ -21,6 +23,21 @@ class ItemPrice(Document):
 		self.update_item_details()
 		self.check_duplicates()
 
+	def on_update(self):
+		from erpnext.stock.stock_ledger import clear_valuation_rate_cache
+		clear_valuation_rate_cache(self.item_code)
+
+		clear_item_price_cache(self.price_list)
+		doc_before_save = self.get_doc_before_save()
+		if doc_before_save and doc_before_save.price_list != self.price_list:
+			clear_item_price_cache(doc_before_save.price_list)
+
+	def on_trash(self):
+		from erpnext.stock.stock_ledger import clear_valuation_rate_cache
+		clear_valuation_rate_cache(self.item_code)
+
+		clear_item_price_cache(self.price_list)
+
 	def validate_item(self):
 		if not frappe.db.exists("Item", self.item_code):
 			frappe.throw(_("Item {0} not found").format(self.item_code))
@@ -69,3 +86,86 @@ class ItemPrice(Document):
 			self.reference = self.customer
 		if self.buying:
 			self.reference = self.supplier
+
+# Item Prices of the most recently used price lists by site and price list,
+# see `get_price_list_item_prices`
+item_price_cache = OrderedDict()
+ITEM_PRICE_CACHE_SIZE = 32
+
+def get_price_list_item_prices(price_list):
+	"""Returns the Item Prices of the price list by item code, in the order of `get_item_price`.
+
+		The prices are kept in an LRU cache of the process. A version per price list in the site
+		cache, read once per request, is reset by `clear_item_price_cache` on writes of Item Prices"""
+	versions = getattr(frappe.local, "item_price_versions", None)
+	if versions is None:
+		versions = frappe.local.item_price_versions = {}
+
+	if price_list not in versions:
+		version = frappe.cache().hget("item_price_version", price_list)
+		if not version:
+			version = frappe.generate_hash(length=10)
+			frappe.cache().hset("item_price_version", price_list, version)
+		versions[price_list] = version
+
+	key = (frappe.local.site, price_list)
+	cached = item_price_cache.pop(key, None)
+	if not cached or cached[0] != versions[price_list]:
+		cached = (versions[price_list], load_price_list_item_prices(price_list))
+
+	item_price_cache[key] = cached
+	while len(item_price_cache) > ITEM_PRICE_CACHE_SIZE:
+		item_price_cache.popitem(last=False)
+
+	return cached[1]
+
+def load_price_list_item_prices(price_list):
+	item_prices = {}
+	for d in frappe.db.sql("""select name, item_code, price_list_rate, currency, uom, customer, supplier,
+			min_qty, packing_unit, valid_from, valid_upto
+		from `tabItem Price` where price_list=%s""", price_list, as_dict=1):
+		item_prices.setdefault(d.item_code, []).append(d)
+
+	# same as "order by uom desc, min_qty desc"
+	for prices in item_prices.values():
+		prices.sort(key=lambda d: (cstr(d.uom), flt(d.min_qty)), reverse=True)
+
+	return item_prices
+
+def clear_item_price_cache(price_list=None):
+	"""Reset the version of the cached Item Prices of the price list (or of all price lists),
+		to be called when Item Prices are changed without saving the documents"""
+	from erpnext.utilities.db import run_after_commit
+
+	reset_item_price_version(price_list)
+
+	# another worker may load the prices before the changes are committed,
+	# so the version is reset again after the commit
+	run_after_commit("erpnext.stock.doctype.item_price.item_price.reset_item_price_version",
+		price_list=price_list)
+
+def reset_item_price_version(price_list=None):
+	if price_list:
+		frappe.cache().hdel("item_price_version", price_list)
+	else:
+		frappe.cache().delete_key("item_price_version")
+
+	frappe.local.item_price_versions = None
+
+def clear_item_price_cache_on_rename(doc, method, *args, **kwargs):
+	# the cached Item Prices hold the names of items, customers, suppliers, UOMs and price lists
+	clear_item_price_cache()
+
+def get_item_price_for_listing(price_list, item_code, date=None):
+	"""Returns a copy of the Item Price of the item shown in product listings (POS and website):
+		the price for the smallest quantity, without customer or supplier, valid on the date (today)"""
+	date = getdate(date or nowdate())
+
+	for d in reversed(get_price_list_item_prices(price_list).get(item_code, [])):
+		if d.customer or d.supplier:
+			continue
+
+		if (d.valid_from and getdate(d.valid_from) > date) or (d.valid_upto and getdate(d.valid_upto) < date):
+			continue
+
+		return frappe._dict(d)
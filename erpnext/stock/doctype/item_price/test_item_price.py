@@ -6,12 +6,14 @@ import unittest
 import frappe
 from frappe.test_runner import make_test_records_for_doctype
 from erpnext.stock.get_item_details import get_price_list_rate_for, process_args
-from erpnext.stock.doctype.item_price.item_price import ItemPriceDuplicateItem
+from erpnext.stock.doctype.item_price.item_price import (ItemPriceDuplicateItem, clear_item_price_cache,
+	get_item_price_for_listing)
 
 
 class TestItemPrice(unittest.TestCase):
 	def setUp(self):
 		frappe.db.sql("delete from `tabItem Price`")
+		clear_item_price_cache()
 		make_test_records_for_doctype("Item Price", force=True)
 
 	def test_duplicate_item(self):
@@ -29,6 +31,44 @@ class TestItemPrice(unittest.TestCase):
 		for test_field in test_fields_existance:
 			self.assertTrue(test_field in doc_fields)
 
+	def test_cached_price_is_updated(self):
+		args = {
+			"price_list": "_Test Price List Rest of the World",
+			"uom": "_Test UOM",
+			"qty": 10
+		}
+		self.assertEqual(get_price_list_rate_for(args, "_Test Item"), 10)
+
+		doc = frappe.get_doc("Item Price", {"item_code": "_Test Item",
+			"price_list": "_Test Price List Rest of the World"})
+		doc.price_list_rate = 15
+		doc.save()
+		self.assertEqual(get_price_list_rate_for(args, "_Test Item"), 15)
+		self.assertEqual(get_item_price_for_listing("_Test Price List Rest of the World", "_Test Item").price_list_rate, 15)
+
+		doc.delete()
+		self.assertEqual(get_price_list_rate_for(args, "_Test Item"), None)
+		self.assertFalse(get_item_price_for_listing("_Test Price List Rest of the World", "_Test Item"))
+
+	def test_cached_price_after_item_rename(self):
+		from erpnext.stock.doctype.item.test_item import make_item
+		from frappe.model.rename_doc import rename_doc
+
+		for item_code in ("_Test Item Price Rename", "_Test Item Price Renamed"):
+			if frappe.db.exists("Item", item_code):
+				frappe.delete_doc("Item", item_code)
+
+		make_item("_Test Item Price Rename")
+		frappe.get_doc({"doctype": "Item Price", "item_code": "_Test Item Price Rename",
+			"price_list": "_Test Price List", "price_list_rate": 50}).insert()
+		self.assertEqual(get_item_price_for_listing("_Test Price List", "_Test Item Price Rename").price_list_rate, 50)
+
+		rename_doc("Item", "_Test Item Price Rename", "_Test Item Price Renamed")
+		self.assertEqual(get_item_price_for_listing("_Test Price List", "_Test Item Price Renamed").price_list_rate, 50)
+		self.assertFalse(get_item_price_for_listing("_Test Price List", "_Test Item Price Rename"))
+
+		frappe.delete_doc("Item", "_Test Item Price Renamed")
+
 	def test_dates_validation_error(self):
 		doc = frappe.copy_doc(test_records[1])
 		# Enter invalid dates valid_from  >= valid_upto
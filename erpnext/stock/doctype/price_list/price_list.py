@@ -7,6 +7,7 @@ from frappe import _, throw
 from frappe.utils import cint
 from frappe.model.document import Document
 import frappe.defaults
+from erpnext.stock.doctype.item_price.item_price import clear_item_price_cache
 
 class PriceList(Document):
 	def validate(self):
@@ -30,6 +31,7 @@ class PriceList(Document):
 		frappe.db.sql("""update `tabItem Price` set currency=%s,
 			buying=%s, selling=%s, modified=NOW() where price_list=%s""",
 			(self.currency, cint(self.buying), cint(self.selling), self.name))
+		clear_item_price_cache(self.name)
 
 	def on_trash(self):
 		def _update_default_price_list(module):
@@ -0,0 +1,21 @@
+// Copyright (c) 2020, Frappe Technologies Pvt. Ltd. and contributors
+// For license information, please see license.txt
+
+frappe.ui.form.on('Repost Item Valuation', {
+	refresh: function(frm) {
+		// failed entries, or entries left "In Progress" by a job that stopped
+		if (frm.doc.__onload && frm.doc.__onload.can_restart) {
+			frm.add_custom_button(__('Restart'), function() {
+				frappe.call({
+					method: "erpnext.stock.doctype.repost_item_valuation.repost_item_valuation.restart_reposting",
+					args: {
+						name: frm.doc.name
+					},
+					callback: function() {
+						frm.reload_doc();
+					}
+				});
+			});
+		}
+	}
+});
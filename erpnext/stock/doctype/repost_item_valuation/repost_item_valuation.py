@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+from __future__ import unicode_literals
+import frappe, erpnext
+from frappe import _
+from frappe.utils import add_to_date, cint, get_datetime, get_time, getdate, now_datetime
+from frappe.model.document import Document
+
+# a running repost records its progress every PROGRESS_INTERVAL seconds, an entry "In Progress"
+# without progress for STALE_REPOST_TIMEOUT seconds was left behind by a killed job and is queued again
+PROGRESS_INTERVAL = 60
+STALE_REPOST_TIMEOUT = 30 * 60
+
+class RepostItemValuation(Document):
+	def onload(self):
+		self.set_onload("can_restart", can_restart(self))
+
+	def validate(self):
+		if not self.company:
+			self.company = frappe.db.get_value("Warehouse", self.warehouse, "company")
+
+		if not self.posting_time:
+			self.posting_time = "00:00"
+
+	def set_status(self, status, error_log=None):
+		self.db_set("status", status)
+		if error_log is not None:
+			self.db_set("error_log", error_log)
+
+def is_future_repost_deferred(voucher_type=None):
+	"""Returns True if reposting of future entries for backdated transactions
+		is handed over to the background repost queue"""
+	# a backdated reconciliation resets the queue, so its future is always reposted inline
+	if voucher_type == "Stock Reconciliation":
+		return False
+
+	return cint(frappe.db.get_single_value("Stock Settings", "repost_backdated_entries_in_background"))
+
+def create_repost_item_valuation_entry(args):
+	"""Queue reposting of an item-warehouse from the given posting datetime.
+
+		An already queued entry for the same item-warehouse is reused and moved
+		back to the earlier datetime, so overlapping requests are coalesced"""
+	args = frappe._dict(args)
+	posting_time = args.posting_time or "00:00"
+
+	existing = frappe.db.get_value("Repost Item Valuation", {
+		"item_code": args.item_code,
+		"warehouse": args.warehouse,
+		"status": "Queued"
+	}, ["name", "posting_date", "posting_time"], as_dict=1, for_update=True)
+
+	if existing:
+		if (getdate(args.posting_date), get_time(posting_time)) < \
+				(getdate(existing.posting_date), get_time(existing.posting_time or "00:00")):
+			frappe.db.set_value("Repost Item Valuation", existing.name, {
+				"posting_date": args.posting_date,
+				"posting_time": posting_time
+			}, update_modified=False)
+		return existing.name
+
+	repost_entry = frappe.get_doc({
+		"doctype": "Repost Item Valuation",
+		"item_code": args.item_code,
+		"warehouse": args.warehouse,
+		"posting_date": args.posting_date,
+		"posting_time": posting_time,
+		"voucher_type": args.voucher_type,
+		"voucher_no": args.voucher_no,
+		"status": "Queued"
+	})
+	repost_entry.flags.ignore_permissions = True
+	repost_entry.insert()
+
+	return repost_entry.name
+
+def repost_entries():
+	"""Drain the repost queue, oldest backdated entry first (scheduled)"""
+	requeue_stale_entries()
+
+	entries = frappe.get_all("Repost Item Valuation", filters={"status": "Queued"},
+		order_by="posting_date asc, posting_time asc, creation asc")
+
+	for d in entries:
+		repost(frappe.get_doc("Repost Item Valuation", d.name))
+
+def requeue_stale_entries():
+	for name in frappe.db.sql_list("""select name from `tabRepost Item Valuation`
+		where status = 'In Progress' and ifnull(progress_updated_on, modified) < %s""", get_stale_repost_datetime()):
+		requeue(frappe.get_doc("Repost Item Valuation", name))
+
+	frappe.db.commit()
+
+def get_stale_repost_datetime():
+	return add_to_date(now_datetime(), seconds=-STALE_REPOST_TIMEOUT)
+
+def is_stale(doc):
+	return doc.status == "In Progress" \
+		and get_datetime(doc.progress_updated_on or doc.modified) < get_stale_repost_datetime()
+
+def can_restart(doc):
+	return doc.status == "Failed" or is_stale(doc)
+
+def requeue(doc):
+	"""Queue the entry again. An entry queued for the same item-warehouse in the meantime
+		is merged into it, so that the item-warehouse is not reposted twice"""
+	queued = frappe.db.get_value("Repost Item Valuation", {
+		"item_code": doc.item_code,
+		"warehouse": doc.warehouse,
+		"status": "Queued",
+		"name": ("!=", doc.name)
+	}, ["name", "posting_date", "posting_time"], as_dict=1, for_update=True)
+
+	if queued:
+		if (getdate(queued.posting_date), get_time(queued.posting_time or "00:00")) < \
+				(getdate(doc.posting_date), get_time(doc.posting_time or "00:00")):
+			doc.db_set({"posting_date": queued.posting_date, "posting_time": queued.posting_time})
+		frappe.delete_doc("Repost Item Valuation", queued.name, ignore_permissions=True)
+
+	doc.set_status("Queued", error_log="")
+
+def repost(doc):
+	doc.set_status("In Progress", error_log="")
+	doc.db_set({"progress_updated_on": now_datetime(), "entries_reposted": 0})
+	frappe.db.commit()
+
+	progress = RepostProgress(doc.name)
+	try:
+		repost_sl_entries(doc, progress)
+		repost_gl_entries(doc, progress)
+		progress.close()
+
+		doc.set_status("Completed")
+		frappe.db.commit()
+	except Exception:
+		progress.close()
+
+		frappe.db.rollback()
+		doc.set_status("Failed", error_log=frappe.get_traceback())
+		frappe.db.commit()
+
+class RepostProgress(object):
+	"""Records the progress of a repost on a separate connection, so that it is seen
+		by other workers while the transaction of the repost is still open"""
+	def __init__(self, name):
+		self.name = name
+		self.db = None
+		self.last_update = now_datetime()
+
+	def update(self, force=True, **values):
+		if not force and (now_datetime() - self.last_update).total_seconds() < PROGRESS_INTERVAL:
+			return
+
+		from erpnext.utilities.db import get_connection
+
+		if not self.db:
+			self.db = get_connection()
+
+		self.last_update = now_datetime()
+		values["progress_updated_on"] = self.last_update
+
+		self.db.sql("""update `tabRepost Item Valuation` set {0} where name = %(name)s""".format(
+			", ".join("{0} = %({0})s".format(f) for f in values)), dict(values, name=self.name))
+		self.db.commit()
+
+	def close(self):
+		if self.db:
+			self.db.close()
+			self.db = None
+
+def repost_sl_entries(doc, progress):
+	from erpnext.stock.stock_ledger import update_entries_after
+	from erpnext.stock.utils import get_combine_datetime
+
+	entries_to_repost = frappe.db.sql("""select count(*) from `tabStock Ledger Entry`
+		where item_code=%s and warehouse=%s and ifnull(is_cancelled, 'No')='No'
+		and posting_datetime >= %s""",
+		(doc.item_code, doc.warehouse, get_combine_datetime(doc.posting_date, doc.posting_time)))[0][0]
+	progress.update(entries_to_repost=entries_to_repost)
+
+	# negative stock is validated here, as postings made while the entry was pending
+	# were not validated against the outdated future balances
+	update_entries_after({
+		"item_code": doc.item_code,
+		"warehouse": doc.warehouse,
+		"posting_date": doc.posting_date,
+		"posting_time": doc.posting_time
+	}, verbose=0, progress_callback=lambda entries_reposted: progress.update(force=False,
+		entries_reposted=entries_reposted))
+
+	progress.update(entries_reposted=entries_to_repost)
+
+def repost_gl_entries(doc, progress):
+	from erpnext.controllers.stock_controller import update_gl_entries_after
+
+	if cint(erpnext.is_perpetual_inventory_enabled(doc.company)):
+		update_gl_entries_after(doc.posting_date, doc.posting_time, [doc.warehouse], [doc.item_code],
+			company=doc.company, progress_callback=lambda: progress.update(force=False))
+
+	doc.db_set("gl_reposted", 1)
+
+def has_pending_repost(item_code, warehouse):
+	"""Returns True if the future entries of the item-warehouse are still to be reposted"""
+	return bool(frappe.db.sql("""select name from `tabRepost Item Valuation`
+		where item_code = %s and warehouse = %s and status in ('Queued', 'In Progress')
+		limit 1""", (item_code, warehouse)))
+
+@frappe.whitelist()
+def restart_reposting(name):
+	frappe.only_for(["Stock Manager", "System Manager"])
+
+	doc = frappe.get_doc("Repost Item Valuation", name)
+	if not can_restart(doc):
+		frappe.throw(_("Only failed or stuck repost entries can be restarted"))
+
+	requeue(doc)
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+from __future__ import unicode_literals
+
+import frappe
+import unittest
+from frappe.utils import add_days, add_to_date, nowdate, now_datetime, getdate
+from erpnext.stock.doctype.item.test_item import create_item
+from erpnext.stock.doctype.stock_entry.stock_entry_utils import make_stock_entry
+from erpnext.stock.doctype.repost_item_valuation.repost_item_valuation import (repost_entries,
+	create_repost_item_valuation_entry, restart_reposting, STALE_REPOST_TIMEOUT)
+
+class TestRepostItemValuation(unittest.TestCase):
+	def setUp(self):
+		self.item_code = "_Test Deferred Repost Item"
+		self.warehouse = "_Test Warehouse - _TC"
+		create_item(self.item_code)
+		frappe.db.set_value("Stock Settings", None, "repost_backdated_entries_in_background", 1)
+
+	def tearDown(self):
+		frappe.db.set_value("Stock Settings", None, "repost_backdated_entries_in_background", 0)
+
+	def test_backdated_entry_is_queued_and_reposted(self):
+		make_stock_entry(item_code=self.item_code, target=self.warehouse, qty=10, basic_rate=100,
+			posting_date=add_days(nowdate(), -2))
+		make_stock_entry(item_code=self.item_code, source=self.warehouse, qty=5,
+			posting_date=add_days(nowdate(), -1))
+
+		# backdated receipt at a different rate
+		make_stock_entry(item_code=self.item_code, target=self.warehouse, qty=10, basic_rate=200,
+			posting_date=add_days(nowdate(), -3))
+
+		repost_name = frappe.db.get_value("Repost Item Valuation",
+			{"item_code": self.item_code, "warehouse": self.warehouse, "status": "Queued"})
+		self.assertTrue(repost_name)
+
+		# bin qty is updated immediately
+		self.assertEqual(frappe.db.get_value("Bin",
+			{"item_code": self.item_code, "warehouse": self.warehouse}, "actual_qty"), 15)
+
+		repost_entries()
+
+		self.assertEqual(frappe.db.get_value("Repost Item Valuation", repost_name, "status"), "Completed")
+
+		last_sle = frappe.db.sql("""select qty_after_transaction, stock_value from `tabStock Ledger Entry`
+			where item_code=%s and warehouse=%s
+			order by posting_date desc, posting_time desc, creation desc limit 1""",
+			(self.item_code, self.warehouse), as_dict=1)[0]
+
+		self.assertEqual(last_sle.qty_after_transaction, 15)
+		self.assertEqual(last_sle.stock_value, 5 * 200 + 10 * 100)
+
+	def test_overlapping_requests_are_coalesced(self):
+		args = {"item_code": self.item_code, "warehouse": self.warehouse, "posting_time": "10:00"}
+
+		first = create_repost_item_valuation_entry(dict(args, posting_date=add_days(nowdate(), -1)))
+		second = create_repost_item_valuation_entry(dict(args, posting_date=add_days(nowdate(), -5)))
+
+		self.assertEqual(first, second)
+		self.assertEqual(getdate(frappe.db.get_value("Repost Item Valuation", first, "posting_date")),
+			getdate(add_days(nowdate(), -5)))
+
+		frappe.delete_doc("Repost Item Valuation", first)
+
+	def test_stale_in_progress_entry_is_requeued(self):
+		name = create_repost_item_valuation_entry({"item_code": self.item_code, "warehouse": self.warehouse,
+			"posting_date": nowdate()})
+
+		# left "In Progress" by a job killed before it finished
+		set_in_progress(name, add_to_date(now_datetime(), seconds=-STALE_REPOST_TIMEOUT - 60))
+
+		repost_entries()
+
+		doc = frappe.get_doc("Repost Item Valuation", name)
+		self.assertEqual(doc.status, "Completed")
+		self.assertEqual(doc.entries_reposted, doc.entries_to_repost)
+		frappe.delete_doc("Repost Item Valuation", name)
+
+	def test_running_entry_is_not_requeued(self):
+		name = create_repost_item_valuation_entry({"item_code": self.item_code, "warehouse": self.warehouse,
+			"posting_date": nowdate()})
+
+		# a long running repost, which recorded its progress recently
+		set_in_progress(name, now_datetime())
+		frappe.db.sql("""update `tabRepost Item Valuation` set modified = %s where name = %s""",
+			(add_to_date(now_datetime(), seconds=-STALE_REPOST_TIMEOUT - 60), name))
+
+		repost_entries()
+
+		self.assertEqual(frappe.db.get_value("Repost Item Valuation", name, "status"), "In Progress")
+		self.assertRaises(frappe.ValidationError, restart_reposting, name)
+		frappe.delete_doc("Repost Item Valuation", name)
+
+	def test_requeued_entry_is_merged_with_queued_entry(self):
+		args = {"item_code": self.item_code, "warehouse": self.warehouse, "posting_time": "10:00"}
+
+		stale = create_repost_item_valuation_entry(dict(args, posting_date=add_days(nowdate(), -1)))
+		set_in_progress(stale, add_to_date(now_datetime(), seconds=-STALE_REPOST_TIMEOUT - 60))
+
+		# queued while the stale entry was "In Progress"
+		queued = create_repost_item_valuation_entry(dict(args, posting_date=add_days(nowdate(), -5)))
+		self.assertNotEqual(stale, queued)
+
+		restart_reposting(stale)
+
+		self.assertFalse(frappe.db.exists("Repost Item Valuation", queued))
+		self.assertEqual(frappe.db.get_value("Repost Item Valuation", stale, "status"), "Queued")
+		self.assertEqual(getdate(frappe.db.get_value("Repost Item Valuation", stale, "posting_date")),
+			getdate(add_days(nowdate(), -5)))
+
+		frappe.delete_doc("Repost Item Valuation", stale)
+
+	def test_negative_stock_is_not_validated_against_outdated_balances(self):
+		item_code = create_item("_Test Pending Repost Item {0}".format(frappe.generate_hash(length=6))).name
+
+		make_stock_entry(item_code=item_code, target=self.warehouse, qty=10, basic_rate=100,
+			posting_date=add_days(nowdate(), -3))
+		make_stock_entry(item_code=item_code, source=self.warehouse, qty=10,
+			posting_date=add_days(nowdate(), -1))
+
+		# queues a repost, the balances after the receipt are outdated until it runs
+		make_stock_entry(item_code=item_code, target=self.warehouse, qty=5, basic_rate=100,
+			posting_date=add_days(nowdate(), -4))
+
+		# valid with the receipt above, but makes the outdated balance of the issue negative
+		make_stock_entry(item_code=item_code, source=self.warehouse, qty=5,
+			posting_date=add_days(nowdate(), -2))
+
+		repost_entries()
+
+		self.assertEqual(frappe.db.sql("""select qty_after_transaction from `tabStock Ledger Entry`
+			where item_code=%s and warehouse=%s
+			order by posting_date desc, posting_time desc, creation desc limit 1""",
+			(item_code, self.warehouse))[0][0], 0)
+
+def set_in_progress(name, progress_updated_on):
+	frappe.db.sql("""update `tabRepost Item Valuation`
+		set status = 'In Progress', progress_updated_on = %s where name = %s""", (progress_updated_on, name))
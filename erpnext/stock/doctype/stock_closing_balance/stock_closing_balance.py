@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+from __future__ import unicode_literals
+import frappe
+from frappe.utils import add_months, getdate, get_last_day, nowdate
+from frappe.model.document import Document
+
+class StockClosingBalance(Document):
+	pass
+
+def create_stock_closing_balances(closing_date=None):
+	"""Snapshot the balance of every item-warehouse at the end of the last closed month (scheduled)"""
+	if not closing_date:
+		closing_date = get_last_day(add_months(nowdate(), -1))
+
+	closing_date = getdate(closing_date)
+	if closing_date in get_stock_closing_dates():
+		return
+
+	for item_code, warehouse in frappe.db.sql("select item_code, warehouse from `tabBin`"):
+		update_stock_closing_balance(item_code, warehouse, closing_date)
+
+	frappe.cache().delete_value("stock_closing_dates")
+
+def update_stock_closing_balance(item_code, warehouse, closing_date):
+	"""Set the closing balance of the item-warehouse from its last Stock Ledger Entry
+		on or before the closing date"""
+	from erpnext.stock.stock_ledger import get_previous_sle
+
+	last_sle = get_previous_sle({
+		"item_code": item_code,
+		"warehouse": warehouse,
+		"posting_date": closing_date,
+		"posting_time": "23:59:59.999999"
+	})
+
+	name = frappe.db.get_value("Stock Closing Balance", {
+		"item_code": item_code,
+		"warehouse": warehouse,
+		"closing_date": closing_date
+	})
+
+	if not last_sle:
+		if name:
+			frappe.db.sql("delete from `tabStock Closing Balance` where name=%s", name)
+		return
+
+	values = {
+		"qty_after_transaction": last_sle.qty_after_transaction,
+		"valuation_rate": last_sle.valuation_rate,
+		"stock_value": last_sle.stock_value,
+		"stock_queue": last_sle.stock_queue
+	}
+
+	if name:
+		frappe.db.set_value("Stock Closing Balance", name, values, update_modified=False)
+	else:
+		doc = frappe.get_doc(dict(values, **{
+			"doctype": "Stock Closing Balance",
+			"item_code": item_code,
+			"warehouse": warehouse,
+			"company": last_sle.company,
+			"closing_date": closing_date
+		}))
+		doc.flags.ignore_permissions = True
+		doc.db_insert()
+
+def update_stock_closing_balances_after(item_code, warehouse, posting_date=None):
+	"""Refresh the snapshots of the item-warehouse which are affected by (re)posting
+		entries from the given date, called after reposting"""
+	posting_date = getdate(posting_date) if posting_date else None
+
+	for closing_date in get_stock_closing_dates():
+		if not posting_date or closing_date >= posting_date:
+			update_stock_closing_balance(item_code, warehouse, closing_date)
+
+def get_stock_closing_dates():
+	"""Returns sorted closing dates for which snapshots exist, cached"""
+	def _get_closing_dates():
+		return [str(d) for d in frappe.db.sql_list("""select distinct closing_date
+			from `tabStock Closing Balance` order by closing_date""")]
+
+	return [getdate(d) for d in frappe.cache().get_value("stock_closing_dates", _get_closing_dates)]
+
+def get_last_closing_date(posting_date):
+	"""Returns the latest snapshot date on or before the given date"""
+	posting_date = getdate(posting_date)
+
+	last_closing_date = None
+	for closing_date in get_stock_closing_dates():
+		if closing_date > posting_date:
+			break
+		last_closing_date = closing_date
+
+	return last_closing_date
+
+def on_doctype_update():
+	frappe.db.add_index("Stock Closing Balance", ["item_code", "warehouse", "closing_date"])
+	frappe.db.add_index("Stock Closing Balance", ["closing_date"])
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+from __future__ import unicode_literals
+
+import frappe
+import unittest
+from frappe.utils import add_days, add_months, get_last_day, nowdate
+from erpnext.stock.doctype.item.test_item import create_item
+from erpnext.stock.doctype.stock_entry.stock_entry_utils import make_stock_entry
+from erpnext.stock.doctype.stock_closing_balance.stock_closing_balance import create_stock_closing_balances
+from erpnext.stock.utils import get_stock_value_on
+
+class TestStockClosingBalance(unittest.TestCase):
+	def setUp(self):
+		self.item_code = "_Test Stock Closing Balance Item"
+		self.warehouse = "_Test Warehouse - _TC"
+		create_item(self.item_code)
+		self.closing_date = get_last_day(add_months(nowdate(), -3))
+
+	def tearDown(self):
+		frappe.db.sql("delete from `tabStock Closing Balance`")
+		frappe.cache().delete_value("stock_closing_dates")
+
+	def test_snapshot_is_refreshed_by_backdated_entry(self):
+		make_stock_entry(item_code=self.item_code, target=self.warehouse, qty=10, basic_rate=100,
+			posting_date=add_days(self.closing_date, -10))
+
+		create_stock_closing_balances(self.closing_date)
+		self.assertEqual(self.get_closing_balance(), (10, 1000))
+
+		# backdated entry before the closing date
+		make_stock_entry(item_code=self.item_code, target=self.warehouse, qty=5, basic_rate=100,
+			posting_date=add_days(self.closing_date, -5))
+		self.assertEqual(self.get_closing_balance(), (15, 1500))
+
+		# entry after the closing date does not change the snapshot
+		make_stock_entry(item_code=self.item_code, target=self.warehouse, qty=5, basic_rate=100,
+			posting_date=add_days(self.closing_date, 5))
+		self.assertEqual(self.get_closing_balance(), (15, 1500))
+
+		self.assertEqual(get_stock_value_on(self.warehouse, add_days(self.closing_date, 10), self.item_code), 2000)
+
+	def get_closing_balance(self):
+		return frappe.db.get_value("Stock Closing Balance", {"item_code": self.item_code,
+			"warehouse": self.warehouse, "closing_date": self.closing_date},
+			["qty_after_transaction", "stock_value"])
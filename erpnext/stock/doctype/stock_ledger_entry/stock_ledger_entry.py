@@ -31,12 +31,16 @@ class StockLedgerEntry(Document):
 		self.validate_batch()
 		validate_warehouse_company(self.warehouse, self.company)
 		self.scrub_posting_time()
+		self.set_posting_datetime()
 		self.validate_and_set_fiscal_year()
 		self.block_transactions_against_group_warehouse()
 
 	def on_submit(self):
+		from erpnext.stock.stock_ledger import clear_valuation_rate_cache
+
 		self.check_stock_frozen_date()
 		self.actual_amt_check()
+		clear_valuation_rate_cache(self.item_code)
 
 		if not self.get("via_landed_cost_voucher"):
 			from erpnext.stock.doctype.serial_no.serial_no import process_serial_no
@@ -111,6 +115,10 @@ class StockLedgerEntry(Document):
 		if not self.posting_time or self.posting_time == '00:0':
 			self.posting_time = '00:00'
 
+	def set_posting_datetime(self):
+		from erpnext.stock.utils import get_combine_datetime
+		self.posting_datetime = get_combine_datetime(self.posting_date, self.posting_time)
+
 	def validate_batch(self):
 		if self.batch_no and self.voucher_type != "Stock Entry":
 			expiry_date = frappe.db.get_value("Batch", self.batch_no, "expiry_date")
@@ -137,6 +145,18 @@ def on_doctype_update():
 			fields=["posting_date", "posting_time", "name"],
 			index_name="posting_sort_index")
 
+	if not frappe.db.has_index('tabStock Ledger Entry', 'item_warehouse_posting_datetime_index'):
+		frappe.db.commit()
+		frappe.db.add_index("Stock Ledger Entry",
+			fields=["item_code", "warehouse", "posting_datetime", "creation"],
+			index_name="item_warehouse_posting_datetime_index")
+
+	if not frappe.db.has_index('tabStock Ledger Entry', 'item_posting_datetime_index'):
+		frappe.db.commit()
+		frappe.db.add_index("Stock Ledger Entry",
+			fields=["item_code", "posting_datetime", "creation"],
+			index_name="item_posting_datetime_index")
+
 	frappe.db.add_index("Stock Ledger Entry", ["voucher_no", "voucher_type"])
 	frappe.db.add_index("Stock Ledger Entry", ["batch_no", "item_code", "warehouse"])
 
@@ -5,8 +5,145 @@ from __future__ import unicode_literals
 
 import frappe
 import unittest
+from frappe.utils import add_days, nowdate, flt
+from erpnext.stock.doctype.item.test_item import create_item
+from erpnext.stock.doctype.stock_entry.stock_entry_utils import make_stock_entry
+from erpnext.stock import stock_ledger
+from erpnext.stock.stock_ledger import update_entries_after, get_valuation_rate, REPOST_FIELDS
+from erpnext.stock.utils import get_combine_datetime
 
 # test_records = frappe.get_test_records('Stock Ledger Entry')
 
 class TestStockLedgerEntry(unittest.TestCase):
-	pass
+	def setUp(self):
+		self.item_code = "_Test Repost Item"
+		self.warehouse = "_Test Warehouse - _TC"
+		create_item(self.item_code)
+
+	def test_bulk_repost_matches_row_wise_values(self):
+		make_stock_entry(item_code=self.item_code, target=self.warehouse, qty=10, basic_rate=100,
+			posting_date=add_days(nowdate(), -5))
+		make_stock_entry(item_code=self.item_code, source=self.warehouse, qty=4,
+			posting_date=add_days(nowdate(), -3))
+		make_stock_entry(item_code=self.item_code, target=self.warehouse, qty=6, basic_rate=120,
+			posting_date=add_days(nowdate(), -2))
+
+		# backdated receipt reposts the entries above
+		make_stock_entry(item_code=self.item_code, target=self.warehouse, qty=5, basic_rate=90,
+			posting_date=add_days(nowdate(), -4))
+
+		# values written one entry at a time with db_update, as before the bulk update
+		reset_sle_values(self.item_code, self.warehouse)
+		bulk_update_sle_values = stock_ledger.bulk_update_sle_values
+		stock_ledger.bulk_update_sle_values = update_sle_values_row_wise
+		try:
+			update_entries_after({"item_code": self.item_code, "warehouse": self.warehouse})
+		finally:
+			stock_ledger.bulk_update_sle_values = bulk_update_sle_values
+
+		expected = get_sle_values(self.item_code, self.warehouse)
+
+		reset_sle_values(self.item_code, self.warehouse)
+		update_entries_after({"item_code": self.item_code, "warehouse": self.warehouse})
+
+		self.assertEqual(get_sle_values(self.item_code, self.warehouse), expected)
+
+	def test_posting_datetime(self):
+		se = make_stock_entry(item_code=self.item_code, target=self.warehouse, qty=1, basic_rate=100,
+			posting_date="2019-12-10", posting_time="10:15:30")
+
+		posting_datetime = frappe.db.get_value("Stock Ledger Entry",
+			{"voucher_type": "Stock Entry", "voucher_no": se.name}, "posting_datetime")
+		self.assertEqual(str(posting_datetime), "2019-12-10 10:15:30")
+
+	def test_query_plan_uses_posting_datetime_index(self):
+		for i in range(3):
+			make_stock_entry(item_code=self.item_code, target=self.warehouse, qty=1, basic_rate=100,
+				posting_date=add_days(nowdate(), -i))
+
+		values = {"item_code": self.item_code, "warehouse": self.warehouse,
+			"posting_date": nowdate(), "posting_time": "00:00",
+			"posting_datetime": get_combine_datetime(nowdate(), "00:00")}
+
+		# before: timestamp() on the columns can not be resolved from an index
+		plan = frappe.db.sql("""explain select name from `tabStock Ledger Entry`
+			where item_code = %(item_code)s and warehouse = %(warehouse)s
+			and timestamp(posting_date, posting_time) <= timestamp(%(posting_date)s, %(posting_time)s)
+			order by timestamp(posting_date, posting_time) desc, creation desc limit 1""", values, as_dict=1)[0]
+		self.assertNotEqual(plan.type, "range")
+		self.assertIn("filesort", plan.Extra or "")
+
+		# after: range scan on (item_code, warehouse, posting_datetime, creation)
+		plan = frappe.db.sql("""explain select name from `tabStock Ledger Entry`
+			where item_code = %(item_code)s and warehouse = %(warehouse)s
+			and posting_datetime <= %(posting_datetime)s
+			order by posting_datetime desc, creation desc limit 1""", values, as_dict=1)[0]
+		self.assertEqual(plan.key, "item_warehouse_posting_datetime_index")
+		self.assertEqual(plan.type, "range")
+		self.assertNotIn("filesort", plan.Extra or "")
+
+	def test_cached_valuation_rate(self):
+		se = make_stock_entry(item_code=self.item_code, target=self.warehouse, qty=1, basic_rate=100)
+		self.assertEqual(get_valuation_rate(self.item_code, self.warehouse, "Stock Entry", "_Test Voucher"),
+			get_voucher_valuation_rate(se.name))
+
+		# cache is cleared when a new entry is made
+		se2 = make_stock_entry(item_code=self.item_code, target=self.warehouse, qty=1, basic_rate=200)
+		self.assertEqual(get_valuation_rate(self.item_code, self.warehouse, "Stock Entry", "_Test Voucher"),
+			get_voucher_valuation_rate(se2.name))
+
+		# the voucher's own entry is excluded
+		self.assertEqual(get_valuation_rate(self.item_code, self.warehouse, "Stock Entry", se2.name),
+			get_voucher_valuation_rate(se.name))
+
+	def test_repost_updates_entries_in_batches(self):
+		for i in range(5):
+			make_stock_entry(item_code=self.item_code, target=self.warehouse, qty=1, basic_rate=100 + i,
+				posting_date=add_days(nowdate(), -5 + i))
+
+		sle_count = frappe.db.count("Stock Ledger Entry", {"item_code": self.item_code,
+			"warehouse": self.warehouse, "is_cancelled": "No"})
+
+		queries = []
+		sql = frappe.db.sql
+		def count_sle_updates(query, *args, **kwargs):
+			if query.strip().lower().startswith("update `tabstock ledger entry`"):
+				queries.append(query)
+			return sql(query, *args, **kwargs)
+
+		bulk_update_sle_values = stock_ledger.bulk_update_sle_values
+		frappe.db.sql = count_sle_updates
+		try:
+			# all reposted entries are written back in one update
+			update_entries_after({"item_code": self.item_code, "warehouse": self.warehouse})
+			self.assertEqual(len(queries), 1)
+
+			# and in one update per batch when there are more entries than the batch size
+			del queries[:]
+			stock_ledger.bulk_update_sle_values = lambda entries: bulk_update_sle_values(entries, batch_size=2)
+			update_entries_after({"item_code": self.item_code, "warehouse": self.warehouse})
+			self.assertEqual(len(queries), (sle_count + 1) // 2)
+		finally:
+			frappe.db.sql = sql
+			stock_ledger.bulk_update_sle_values = bulk_update_sle_values
+
+def get_sle_values(item_code, warehouse):
+	return frappe.db.sql("""select name, {0} from `tabStock Ledger Entry`
+		where item_code=%s and warehouse=%s
+		order by posting_date, posting_time, creation""".format(", ".join(REPOST_FIELDS)),
+		(item_code, warehouse), as_dict=1)
+
+def reset_sle_values(item_code, warehouse):
+	frappe.db.sql("""update `tabStock Ledger Entry`
+		set qty_after_transaction=0, valuation_rate=0, stock_value=0,
+			stock_queue='[]', stock_value_difference=0
+		where item_code=%s and warehouse=%s""", (item_code, warehouse))
+
+def update_sle_values_row_wise(entries):
+	for sle in entries:
+		sle.doctype = "Stock Ledger Entry"
+		frappe.get_doc(sle).db_update()
+
+def get_voucher_valuation_rate(voucher_no):
+	return flt(frappe.db.get_value("Stock Ledger Entry",
+		{"voucher_type": "Stock Entry", "voucher_no": voucher_no}, "valuation_rate"))
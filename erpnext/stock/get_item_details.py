@@ -4,7 +4,7 @@
 from __future__ import unicode_literals
 import frappe
 from frappe import _, throw
-from frappe.utils import flt, cint, add_days, cstr, add_months
+from frappe.utils import flt, cint, add_days, cstr, add_months, getdate
 import json, copy
 from erpnext.accounts.doctype.pricing_rule.pricing_rule import get_pricing_rule_for_item, set_transaction_type
 from erpnext.setup.utils import get_exchange_rate
@@ -15,6 +15,7 @@ from erpnext.stock.doctype.item.item import get_item_defaults, get_uom_conv_fact
 from erpnext.setup.doctype.item_group.item_group import get_item_group_defaults
 from erpnext.setup.doctype.brand.brand import get_brand_defaults
 from erpnext.stock.doctype.item_manufacturer.item_manufacturer import get_item_manufacturer_part_no
+from erpnext.stock.doctype.item_price.item_price import get_price_list_item_prices, clear_item_price_cache
 
 from six import string_types, iteritems
 
@@ -52,8 +53,10 @@ def get_item_details(args, doc=None, overwrite_warehouse=True):
 	out = get_basic_details(args, item, overwrite_warehouse)
 
 	get_item_tax_template(args, item, out)
-	out["item_tax_rate"] = get_item_tax_map(args.company, args.get("item_tax_template") if out.get("item_tax_template") is None \
-		else out.get("item_tax_template"), as_json=True)
+	item_tax_template = args.get("item_tax_template") if out.get("item_tax_template") is None \
+		else out.get("item_tax_template")
+	out["item_tax_rate"] = get_from_item_details_batch(("item_tax_map", args.company, item_tax_template),
+		get_item_tax_map, args.company, item_tax_template, as_json=True)
 
 	get_party_item_code(args, item, out)
 
@@ -93,6 +96,83 @@ def get_item_details(args, doc=None, overwrite_warehouse=True):
 
 	return out
 
+@frappe.whitelist()
+def get_items_details_bulk(items, args=None, doc=None, overwrite_warehouse=True):
+	"""Returns the output of `get_item_details` for each row. The Items, Item Prices, Bins,
+		UOM Conversion Details and Blanket Orders of all the rows are loaded in set-based queries.
+
+		:param items: list of the args of the rows
+		:param args: args common to all the rows (values of the parent document)"""
+	if isinstance(items, string_types):
+		items = json.loads(items)
+
+	if isinstance(args, string_types):
+		args = json.loads(args)
+
+	if isinstance(doc, string_types):
+		doc = json.loads(doc)
+
+	if doc:
+		doc = frappe.get_doc(doc)
+
+	rows = []
+	for item in items:
+		row_args = dict(args or {})
+		row_args.update(item)
+		rows.append(process_args(row_args))
+
+	frappe.flags.item_details_batch = get_item_details_batch(rows)
+	try:
+		return [get_item_details(row_args, doc, overwrite_warehouse) for row_args in rows]
+	finally:
+		frappe.flags.item_details_batch = None
+
+def get_item_details_batch(rows):
+	"""Returns the Items (with their templates), Bins and UOM Conversion Details of the rows,
+		used by the functions called by `get_item_details` while `frappe.flags.item_details_batch` is set"""
+	batch = frappe._dict(items={}, bins={}, conversion_factors={}, cache={})
+
+	item_codes = list(set(d.item_code for d in rows if d.item_code))
+	if not item_codes:
+		return batch
+
+	for i in range(0, len(item_codes), 1000):
+		for d in frappe.get_all("Item", filters={"name": ("in", item_codes[i:i + 1000])},
+			fields=["name", "variant_of", "stock_uom", "is_stock_item"]):
+			batch.items[d.name] = d
+
+	templates = list(set(d.variant_of for d in batch.items.values() if d.variant_of) - set(batch.items))
+	all_item_codes = list(batch.items) + templates
+
+	for i in range(0, len(all_item_codes), 1000):
+		values = all_item_codes[i:i + 1000]
+		for d in frappe.db.sql("""select parent, uom, conversion_factor from `tabUOM Conversion Detail`
+			where parenttype='Item' and parent in ({0})""".format(", ".join(["%s"] * len(values))),
+			tuple(values), as_dict=1):
+			batch.conversion_factors.setdefault((d.parent, d.uom), d.conversion_factor)
+
+	item_codes = list(batch.items)
+	for i in range(0, len(item_codes), 1000):
+		values = item_codes[i:i + 1000]
+		for d in frappe.db.sql("""select item_code, warehouse, projected_qty, actual_qty, reserved_qty,
+				valuation_rate
+			from `tabBin` where item_code in ({0})""".format(", ".join(["%s"] * len(values))),
+			tuple(values), as_dict=1):
+			batch.bins[(d.item_code, d.warehouse)] = d
+
+	return batch
+
+def get_from_item_details_batch(key, method, *args, **kwargs):
+	"""Returns `method(*args, **kwargs)`, cached by key for the rows of `get_items_details_bulk`"""
+	batch = frappe.flags.item_details_batch
+	if batch is None:
+		return method(*args, **kwargs)
+
+	if key not in batch.cache:
+		batch.cache[key] = method(*args, **kwargs)
+
+	return batch.cache[key]
+
 def update_stock(args, out):
 	if (args.get("doctype") == "Delivery Note" or
 		(args.get("doctype") == "Sales Invoice" and args.get('update_stock'))) \
@@ -483,11 +563,15 @@ def get_price_list_rate(args, item_doc, out):
 		if meta.get_field("currency"):
 			validate_conversion_rate(args, meta)
 
-		price_list_rate = get_price_list_rate_for(args, item_doc.name) or 0
+		item_prices = get_item_prices_for_batch(args.price_list)
+
+		price_list_rate = get_price_list_rate_for(args, item_doc.name,
+			item_prices.get(item_doc.name) if item_prices is not None else None) or 0
 
 		# variant
 		if not price_list_rate and item_doc.variant_of:
-			price_list_rate = get_price_list_rate_for(args, item_doc.variant_of)
+			price_list_rate = get_price_list_rate_for(args, item_doc.variant_of,
+				item_prices.get(item_doc.variant_of) if item_prices is not None else None)
 
 		# insert in database
 		if not price_list_rate:
@@ -503,6 +587,21 @@ def get_price_list_rate(args, item_doc, out):
 			out.update(get_last_purchase_details(item_doc.name,
 				args.name, args.conversion_rate))
 
+def get_item_prices_for_batch(price_list):
+	"""Returns the Item Prices of the items (and templates) of `get_items_details_bulk`,
+		None outside of it"""
+	batch = frappe.flags.item_details_batch
+	if batch is None or not price_list:
+		return None
+
+	item_codes = list(set(list(batch.items) + [d.variant_of for d in batch.items.values() if d.variant_of]))
+	return get_from_item_details_batch(("item_prices", price_list), get_item_prices, price_list, item_codes)
+
+def clear_item_prices_of_batch(price_list):
+	"""Reload the Item Prices of the price list for the next rows of `get_items_details_bulk`"""
+	if frappe.flags.item_details_batch is not None:
+		frappe.flags.item_details_batch.cache.pop(("item_prices", price_list), None)
+
 def insert_item_price(args):
 	"""Insert Item Price if Price List and Price List Rate are specified and currency is the same"""
 	if frappe.db.get_value("Price List", args.price_list, "currency", cache=True) == args.currency \
@@ -517,6 +616,8 @@ def insert_item_price(args):
 			if item_price and item_price.name:
 				if item_price.price_list_rate != price_list_rate:
 					frappe.db.set_value('Item Price', item_price.name, "price_list_rate", price_list_rate)
+					clear_item_price_cache(args.price_list)
+					clear_item_prices_of_batch(args.price_list)
 					frappe.msgprint(_("Item Price updated for {0} in Price List {1}").format(args.item_code,
 						args.price_list), alert=True)
 			else:
@@ -528,6 +629,7 @@ def insert_item_price(args):
 					"price_list_rate": price_list_rate
 				})
 				item_price.insert()
+				clear_item_prices_of_batch(args.price_list)
 				frappe.msgprint(_("Item Price added for {0} in Price List {1}").format(args.item_code,
 					args.price_list), alert=True)
 
@@ -565,7 +667,44 @@ def get_item_price(args, item_code, ignore_party=False):
 		from `tabItem Price` {conditions}
 		order by uom desc, min_qty desc """.format(conditions=conditions), args)
 
-def get_price_list_rate_for(args, item_code):
+def get_item_prices(price_list, item_codes):
+	"""Returns the Item Prices of the items in the price list by item code,
+		in the order of `get_item_price`, to find prices for many items with `get_price_list_rate_for`"""
+	if not price_list:
+		return dict((item_code, []) for item_code in item_codes)
+
+	item_prices = get_price_list_item_prices(price_list)
+	return dict((item_code, item_prices.get(item_code, [])) for item_code in item_codes)
+
+def find_item_price(item_prices, args, ignore_party=False):
+	"""Same as `get_item_price`, from the Item Prices of the item"""
+	transaction_date = getdate(args.get("transaction_date")) if args.get("transaction_date") else None
+
+	out = []
+	for d in item_prices:
+		if cstr(d.uom) not in ("", args.get("uom")):
+			continue
+
+		if not ignore_party:
+			if args.get("customer"):
+				if d.customer != args.get("customer"): continue
+			elif args.get("supplier"):
+				if d.supplier != args.get("supplier"): continue
+			elif d.customer or d.supplier:
+				continue
+
+		if args.get("min_qty") and flt(d.min_qty) > flt(args.get("min_qty")):
+			continue
+
+		if transaction_date and ((d.valid_from and getdate(d.valid_from) > transaction_date)
+			or (d.valid_upto and getdate(d.valid_upto) < transaction_date)):
+			continue
+
+		out.append((d.name, d.price_list_rate, d.uom))
+
+	return out
+
+def get_price_list_rate_for(args, item_code, item_prices=None):
 	"""
 		Return Price Rate based on min_qty of each Item Price Rate.\
 		For example, desired qty is 10 and Item Price Rates exists
@@ -578,7 +717,11 @@ def get_price_list_rate_for(args, item_code):
 		:param item_code: str, Item Doctype field item_code
 		:param qty: Desired Qty
 		:param transaction_date: Date of the price
+		:param item_prices: Item Prices of the item from `get_item_prices`, the cached prices of the price list if not set
 	"""
+	if item_prices is None and args.get('price_list'):
+		item_prices = get_price_list_item_prices(args.get('price_list')).get(item_code, [])
+
 	item_price_args = {
 			"item_code": item_code,
 			"price_list": args.get('price_list'),
@@ -589,20 +732,26 @@ def get_price_list_rate_for(args, item_code):
 			"transaction_date": args.get('transaction_date'),
 	}
 
+	def _get_item_price(ignore_party=False):
+		if item_prices is not None:
+			return find_item_price(item_prices, item_price_args, ignore_party)
+
+		return get_item_price(item_price_args, item_code, ignore_party=ignore_party)
+
 	item_price_data = 0
-	price_list_rate = get_item_price(item_price_args, item_code)
+	price_list_rate = _get_item_price()
 	if price_list_rate:
 		desired_qty = args.get("qty")
-		if desired_qty and check_packing_list(price_list_rate[0][0], desired_qty, item_code):
+		if desired_qty and check_packing_list(price_list_rate[0][0], desired_qty, item_code, item_prices):
 			item_price_data = price_list_rate
 	else:
 		for field in ["customer", "supplier", "min_qty"]:
 			del item_price_args[field]
 
-		general_price_list_rate = get_item_price(item_price_args, item_code, ignore_party=args.get("ignore_party"))
+		general_price_list_rate = _get_item_price(ignore_party=args.get("ignore_party"))
 		if not general_price_list_rate and args.get("uom") != args.get("stock_uom"):
 			item_price_args["uom"] = args.get("stock_uom")
-			general_price_list_rate = get_item_price(item_price_args, item_code, ignore_party=args.get("ignore_party"))
+			general_price_list_rate = _get_item_price(ignore_party=args.get("ignore_party"))
 
 		if general_price_list_rate:
 			item_price_data = general_price_list_rate
@@ -615,17 +764,22 @@ def get_price_list_rate_for(args, item_code):
 		else:
 			return item_price_data[0][1]
 
-def check_packing_list(price_list_rate_name, desired_qty, item_code):
+def check_packing_list(price_list_rate_name, desired_qty, item_code, item_prices=None):
 	"""
 		Check if the desired qty is within the increment of the packing list.
 		:param price_list_rate_name: Name of Item Price
 		:param desired_qty: Desired Qt
 		:param item_code: str, Item Doctype field item_code
 		:param qty: Desired Qt
+		:param item_prices: Item Prices of the item from `get_item_prices`
 	"""
 
 	flag = True
-	item_price = frappe.get_doc("Item Price", price_list_rate_name)
+	if item_prices is not None:
+		item_price = [d for d in item_prices if d.name == price_list_rate_name][0]
+	else:
+		item_price = frappe.get_doc("Item Price", price_list_rate_name)
+
 	if item_price.packing_unit:
 		packing_increment = desired_qty % item_price.packing_unit
 
@@ -779,6 +933,15 @@ def get_serial_no_batchwise(args, sales_order=None):
 
 @frappe.whitelist()
 def get_conversion_factor(item_code, uom):
+	batch = frappe.flags.item_details_batch
+	if batch and item_code in batch.items:
+		item = batch.items[item_code]
+		conversion_factor = (batch.conversion_factors.get((item_code, uom))
+			or batch.conversion_factors.get((item.variant_of, uom)))
+		if not conversion_factor:
+			conversion_factor = get_uom_conv_factor(uom, item.stock_uom)
+		return {"conversion_factor": conversion_factor or 1.0}
+
 	variant_of = frappe.db.get_value("Item", item_code, "variant_of", cache=True)
 	filters = {"parent": item_code, "uom": uom}
 	if variant_of:
@@ -797,6 +960,12 @@ def get_projected_qty(item_code, warehouse):
 
 @frappe.whitelist()
 def get_bin_details(item_code, warehouse):
+	batch = frappe.flags.item_details_batch
+	if batch and item_code in batch.items:
+		bin_details = batch.bins.get((item_code, warehouse))
+		return (frappe._dict({field: bin_details.get(field) for field in ("projected_qty", "actual_qty", "reserved_qty")})
+			if bin_details else {"projected_qty": 0, "actual_qty": 0, "reserved_qty": 0})
+
 	return frappe.db.get_value("Bin", {"item_code": item_code, "warehouse": warehouse},
 		["projected_qty", "actual_qty", "reserved_qty"], as_dict=True, cache=True) \
 			or {"projected_qty": 0, "actual_qty": 0, "reserved_qty": 0}
@@ -968,10 +1137,21 @@ def get_valuation_rate(item_code, company, warehouse=None):
 		if not warehouse:
 			warehouse = item.get("default_warehouse") or item_group.get("default_warehouse") or brand.get("default_warehouse")
 
+		batch = frappe.flags.item_details_batch
+		if batch and item_code in batch.items:
+			bin_details = batch.bins.get((item_code, warehouse))
+			return frappe._dict(valuation_rate=bin_details.valuation_rate) if bin_details else {"valuation_rate": 0}
+
 		return frappe.db.get_value("Bin", {"item_code": item_code, "warehouse": warehouse},
 			["valuation_rate"], as_dict=True) or {"valuation_rate": 0}
 
 	elif not item.get("is_stock_item"):
+		batch = frappe.flags.item_details_batch
+		if batch and item_code in batch.items:
+			purchase_rates = get_from_item_details_batch("purchase_rates", get_purchase_rates,
+				[d.name for d in batch.items.values() if not d.is_stock_item])
+			return {"valuation_rate": purchase_rates.get(item_code) or 0.0}
+
 		valuation_rate =frappe.db.sql("""select sum(base_net_amount) / sum(qty*conversion_factor)
 			from `tabPurchase Invoice Item`
 			where item_code = %s and docstatus=1""", item_code)
@@ -981,6 +1161,16 @@ def get_valuation_rate(item_code, company, warehouse=None):
 	else:
 		return {"valuation_rate": 0.0}
 
+def get_purchase_rates(item_codes):
+	"""Returns the average purchase rate of the (non stock) items by item code"""
+	if not item_codes:
+		return {}
+
+	return dict(frappe.db.sql("""select item_code, sum(base_net_amount) / sum(qty*conversion_factor)
+		from `tabPurchase Invoice Item`
+		where item_code in ({0}) and docstatus=1
+		group by item_code""".format(", ".join(["%s"] * len(item_codes))), tuple(item_codes)))
+
 def get_gross_profit(out):
 	if out.valuation_rate:
 		out.update({
@@ -1024,27 +1214,52 @@ def get_blanket_order_details(args):
 		args = frappe._dict(json.loads(args))
 
 	blanket_order_details = None
-	condition = ''
+	conditions = []
 	if args.item_code:
 		if args.customer and args.doctype == "Sales Order":
-			condition = ' and bo.customer=%(customer)s'
+			conditions.append('bo.customer=%(customer)s')
 		elif args.supplier and args.doctype == "Purchase Order":
-			condition = ' and bo.supplier=%(supplier)s'
-		if args.blanket_order:
-			condition += ' and bo.name =%(blanket_order)s'
+			conditions.append('bo.supplier=%(supplier)s')
 		if args.transaction_date:
-			condition += ' and bo.to_date>=%(transaction_date)s'
+			conditions.append('bo.to_date>=%(transaction_date)s')
+
+		batch = frappe.flags.item_details_batch
+		if batch and args.item_code in batch.items:
+			# blanket orders of all the items of the batch, by the conditions of the parent,
+			# the blanket order of the row is picked from them
+			condition = "".join(" and " + c for c in conditions)
+			key = ("blanket_orders", condition, args.company, args.customer, args.supplier, args.transaction_date)
+			blanket_orders = get_from_item_details_batch(key, get_blanket_orders, args, condition, list(batch.items))
+			blanket_order_details = [d for d in blanket_orders.get(args.item_code, [])
+				if not args.blanket_order or d.blanket_order == args.blanket_order]
+			return blanket_order_details[0] if blanket_order_details else ''
+
+		if args.blanket_order:
+			conditions.append('bo.name =%(blanket_order)s')
 
 		blanket_order_details = frappe.db.sql('''
 				select boi.rate as blanket_order_rate, bo.name as blanket_order
 				from `tabBlanket Order` bo, `tabBlanket Order Item` boi
 				where bo.company=%(company)s and boi.item_code=%(item_code)s
 					and bo.docstatus=1 and bo.name = boi.parent {0}
-			'''.format(condition), args, as_dict=True)
+			'''.format("".join(" and " + c for c in conditions)), args, as_dict=True)
 
 		blanket_order_details = blanket_order_details[0] if blanket_order_details else ''
 	return blanket_order_details
 
+def get_blanket_orders(args, condition, item_codes):
+	blanket_orders = {}
+	values = dict(args, item_codes=tuple(item_codes))
+	for d in frappe.db.sql('''
+			select boi.item_code, boi.rate as blanket_order_rate, bo.name as blanket_order
+			from `tabBlanket Order` bo, `tabBlanket Order Item` boi
+			where bo.company=%(company)s and boi.item_code in %(item_codes)s
+				and bo.docstatus=1 and bo.name = boi.parent {0}
+		'''.format(condition), values, as_dict=True):
+		blanket_orders.setdefault(d.pop("item_code"), []).append(d)
+
+	return blanket_orders
+
 def get_so_reservation_for_item(args):
 	reserved_so = None
 	if args.get('against_sales_order'):
@@ -7,14 +7,14 @@ from frappe import _
 from frappe.utils import date_diff, flt
 from six import iteritems
 from erpnext.stock.doctype.serial_no.serial_no import get_serial_nos
+from erpnext.utilities.db import iterate_sql
 
 def execute(filters=None):
 
 	columns = get_columns(filters)
-	item_details = get_fifo_queue(filters)
 	to_date = filters["to_date"]
 	data = []
-	for item, item_dict in iteritems(item_details):
+	for item, item_dict in iterate_fifo_queue(filters):
 		fifo_queue = sorted(item_dict["fifo_queue"], key=lambda x: x[1])
 		details = item_dict["details"]
 		if not fifo_queue or (not item_dict.get("total_qty")): continue
@@ -132,14 +132,37 @@ def get_columns(filters):
 	return columns
 
 def get_fifo_queue(filters, sle=None):
+	if sle is not None:
+		# entries are processed item by item, in their posting order
+		sle = sorted(sle, key=lambda d: d.name)
+
+	return dict(iterate_fifo_queue(filters, sle))
+
+def iterate_fifo_queue(filters, sle=None):
+	"""Yields `(key, item_details)` for every item (or item-warehouse) as soon as all
+		entries of the item are processed. Entries must be ordered by item, so only
+		the queues of one item are held in memory at a time.
+
+		Transfers move batches between warehouses of the same item, so an item is
+		finalized as a whole, also when ageing is shown warehouse-wise."""
 	item_details = {}
 	transferred_item_details = {}
 	serial_no_batch_purchase_details = {}
+	current_item = None
 
 	if sle == None:
 		sle = get_stock_ledger_entries(filters)
 
 	for d in sle:
+		if d.name != current_item:
+			for key, details in iteritems(item_details):
+				yield key, details
+
+			item_details = {}
+			transferred_item_details = {}
+			serial_no_batch_purchase_details = {}
+			current_item = d.name
+
 		key = (d.name, d.warehouse) if filters.get('show_warehouse_wise_stock') else d.name
 		item_details.setdefault(key, {"details": d, "fifo_queue": []})
 		fifo_queue = item_details[key]["fifo_queue"]
@@ -193,10 +216,12 @@ def get_fifo_queue(filters, sle=None):
 		else:
 			item_details[key]["total_qty"] += d.actual_qty
 
-	return item_details
+	for key, details in iteritems(item_details):
+		yield key, details
 
 def get_stock_ledger_entries(filters):
-	return frappe.db.sql("""select
+	"""Iterate over the entries with a server-side cursor, ordered by item"""
+	return iterate_sql("""select
 			item.name, item.item_name, item_group, brand, description, item.stock_uom,
 			actual_qty, posting_date, voucher_type, voucher_no, serial_no, batch_no, qty_after_transaction, warehouse
 		from `tabStock Ledger Entry` sle,
@@ -206,7 +231,7 @@ def get_stock_ledger_entries(filters):
 			company = %(company)s and
 			posting_date <= %(to_date)s
 			{sle_conditions}
-			order by posting_date, posting_time, sle.creation, actual_qty""" #nosec
+			order by item.name, posting_date, posting_time, sle.creation, actual_qty""" #nosec
 		.format(item_conditions=get_item_conditions(filters),
 			sle_conditions=get_sle_conditions(filters)), filters, as_dict=True)
 
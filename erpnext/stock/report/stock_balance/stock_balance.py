@@ -4,7 +4,7 @@
 from __future__ import unicode_literals
 import frappe
 from frappe import _
-from frappe.utils import flt, cint, getdate, now, date_diff
+from frappe.utils import flt, cint, getdate, now, date_diff, add_days
 from erpnext.stock.utils import add_additional_uom_columns
 from erpnext.stock.report.stock_ledger.stock_ledger import get_item_group_condition
 
@@ -23,18 +23,22 @@ def execute(filters=None):
 	include_uom = filters.get("include_uom")
 	columns = get_columns(filters)
 	items = get_items(filters)
-	sle = get_stock_ledger_entries(filters, items)
 
 	if filters.get('show_stock_ageing_data'):
+		sle = get_stock_ledger_entries(filters, items)
+
 		filters['show_warehouse_wise_stock'] = True
 		item_wise_fifo_queue = get_fifo_queue(filters, sle)
 
+		iwb_map = get_item_warehouse_map(filters, sle)
+	else:
+		iwb_map = get_grouped_item_warehouse_map(filters, items)
+
 	# if no stock ledger entry found return
-	if not sle:
+	if not iwb_map:
 		return columns, []
 
-	iwb_map = get_item_warehouse_map(filters, sle)
-	item_map = get_item_details(items, sle, filters)
+	item_map = get_item_details(items or list(set(key[1] for key in iwb_map)), [], filters)
 	item_reorder_detail_map = get_item_reorder_details(item_map.keys())
 
 	data = []
@@ -127,6 +131,10 @@ def get_conditions(filters):
 	else:
 		frappe.throw(_("'To Date' is required"))
 
+	return conditions + get_warehouse_conditions(filters)
+
+def get_warehouse_conditions(filters):
+	conditions = ""
 	if filters.get("warehouse"):
 		warehouse_details = frappe.db.get_value("Warehouse",
 			filters.get("warehouse"), ["lft", "rgt"], as_dict=1)
@@ -141,12 +149,16 @@ def get_conditions(filters):
 
 	return conditions
 
-def get_stock_ledger_entries(filters, items):
+def get_item_conditions(items):
 	item_conditions_sql = ''
 	if items:
 		item_conditions_sql = ' and sle.item_code in ({})'\
 			.format(', '.join([frappe.db.escape(i, percent=False) for i in items]))
 
+	return item_conditions_sql
+
+def get_stock_ledger_entries(filters, items):
+	item_conditions_sql = get_item_conditions(items)
 	conditions = get_conditions(filters)
 
 	return frappe.db.sql("""
@@ -168,13 +180,7 @@ def get_item_warehouse_map(filters, sle):
 	for d in sle:
 		key = (d.company, d.item_code, d.warehouse)
 		if key not in iwb_map:
-			iwb_map[key] = frappe._dict({
-				"opening_qty": 0.0, "opening_val": 0.0,
-				"in_qty": 0.0, "in_val": 0.0,
-				"out_qty": 0.0, "out_val": 0.0,
-				"bal_qty": 0.0, "bal_val": 0.0,
-				"val_rate": 0.0
-			})
+			iwb_map[key] = get_balance_qty_dict()
 
 		qty_dict = iwb_map[(d.company, d.item_code, d.warehouse)]
 
@@ -205,6 +211,91 @@ def get_item_warehouse_map(filters, sle):
 
 	return iwb_map
 
+def get_grouped_item_warehouse_map(filters, items):
+	"""Same balances as `get_item_warehouse_map`, but aggregated by the database in one
+		grouped query instead of looping over every entry in Python. Entries before the
+		last Stock Closing Balance are not read, the snapshot is the opening balance."""
+	from erpnext.stock.doctype.stock_closing_balance.stock_closing_balance import get_last_closing_date
+
+	iwb_map = {}
+	item_conditions_sql = get_item_conditions(items)
+	conditions = get_conditions(filters)
+	# values are escaped inline, as the item conditions may contain "%"
+	from_date = frappe.db.escape(str(getdate(filters.get("from_date"))))
+	closing_date = get_last_closing_date(add_days(filters.get("from_date"), -1))
+	closing_date = frappe.db.escape(str(closing_date)) if closing_date else "NULL"
+
+	if closing_date != "NULL":
+		conditions += " and sle.posting_date > {0}".format(closing_date)
+
+		for d in frappe.db.sql("""
+			select sle.company, sle.item_code, sle.warehouse,
+				sle.qty_after_transaction, sle.stock_value, sle.valuation_rate
+			from `tabStock Closing Balance` sle
+			where sle.closing_date = {0} {1} {2}""".format(closing_date, item_conditions_sql, #nosec
+				get_warehouse_conditions(filters)), as_dict=1):
+			qty_dict = iwb_map.setdefault((d.company, d.item_code, d.warehouse), get_balance_qty_dict())
+			qty_dict.opening_qty = qty_dict.bal_qty = flt(d.qty_after_transaction)
+			qty_dict.opening_val = qty_dict.bal_val = flt(d.stock_value)
+			qty_dict.val_rate = flt(d.valuation_rate)
+
+	# qty change of a reconciliation is derived from the balance of the previous entry
+	for d in frappe.db.sql("""
+		select
+			company, item_code, warehouse,
+			sum(case when posting_date < {from_date} then qty_diff else 0 end) as opening_qty,
+			sum(case when posting_date < {from_date} then stock_value_difference else 0 end) as opening_val,
+			sum(case when posting_date >= {from_date} and qty_diff > 0 then qty_diff else 0 end) as in_qty,
+			sum(case when posting_date >= {from_date} and qty_diff > 0
+				then stock_value_difference else 0 end) as in_val,
+			sum(case when posting_date >= {from_date} and qty_diff <= 0 then abs(qty_diff) else 0 end) as out_qty,
+			sum(case when posting_date >= {from_date} and qty_diff <= 0
+				then abs(stock_value_difference) else 0 end) as out_val,
+			sum(qty_diff) as bal_qty,
+			sum(stock_value_difference) as bal_val,
+			max(case when row_desc = 1 then valuation_rate end) as val_rate
+		from (
+			select
+				sle.company, sle.item_code, sle.warehouse, sle.posting_date,
+				ifnull(sle.stock_value_difference, 0) as stock_value_difference, sle.valuation_rate,
+				case when sle.voucher_type = 'Stock Reconciliation'
+					then ifnull(sle.qty_after_transaction, 0) - coalesce(lag(sle.qty_after_transaction)
+						over (partition by sle.item_code, sle.warehouse
+							order by sle.posting_date, sle.posting_time, sle.creation, sle.actual_qty),
+						scb.qty_after_transaction, 0)
+					else ifnull(sle.actual_qty, 0)
+				end as qty_diff,
+				row_number() over (partition by sle.item_code, sle.warehouse
+					order by sle.posting_date desc, sle.posting_time desc, sle.creation desc,
+						sle.actual_qty desc) as row_desc
+			from
+				`tabStock Ledger Entry` sle
+				left join `tabStock Closing Balance` scb
+					on scb.item_code = sle.item_code and scb.warehouse = sle.warehouse
+					and scb.closing_date = {closing_date}
+			where sle.docstatus < 2 {item_conditions} {conditions}
+		) sle
+		group by company, item_code, warehouse""".format(from_date=from_date, closing_date=closing_date, #nosec
+			item_conditions=item_conditions_sql, conditions=conditions), as_dict=1):
+			qty_dict = iwb_map.setdefault((d.company, d.item_code, d.warehouse), get_balance_qty_dict())
+			for key in ("opening_qty", "opening_val", "in_qty", "in_val", "out_qty", "out_val",
+				"bal_qty", "bal_val"):
+				qty_dict[key] += flt(d.get(key))
+			qty_dict.val_rate = d.val_rate
+
+	iwb_map = filter_items_with_no_transactions(iwb_map)
+
+	return iwb_map
+
+def get_balance_qty_dict():
+	return frappe._dict({
+		"opening_qty": 0.0, "opening_val": 0.0,
+		"in_qty": 0.0, "in_val": 0.0,
+		"out_qty": 0.0, "out_val": 0.0,
+		"bal_qty": 0.0, "bal_val": 0.0,
+		"val_rate": 0.0
+	})
+
 def filter_items_with_no_transactions(iwb_map):
 	for (company, item, warehouse) in sorted(iwb_map):
 		qty_dict = iwb_map[(company, item, warehouse)]
@@ -0,0 +1,39 @@
+# Copyright (c) 2020, Frappe Technologies Pvt. Ltd. and Contributors
+# License: GNU General Public License v3. See license.txt
+
+from __future__ import unicode_literals
+import frappe
+import unittest
+from frappe.utils import add_days, nowdate
+from erpnext.stock.doctype.item.test_item import create_item
+from erpnext.stock.doctype.stock_entry.stock_entry_utils import make_stock_entry
+from erpnext.stock.doctype.stock_reconciliation.test_stock_reconciliation import create_stock_reconciliation
+from erpnext.stock.report.stock_balance.stock_balance import (get_item_warehouse_map,
+	get_grouped_item_warehouse_map, get_stock_ledger_entries)
+
+class TestStockBalance(unittest.TestCase):
+	def test_grouped_engine_matches_row_wise_map(self):
+		item_code = "_Test Stock Balance Item"
+		warehouse = "_Test Warehouse - _TC"
+		create_item(item_code)
+
+		make_stock_entry(item_code=item_code, target=warehouse, qty=10, basic_rate=100,
+			posting_date=add_days(nowdate(), -10))
+		make_stock_entry(item_code=item_code, source=warehouse, qty=3,
+			posting_date=add_days(nowdate(), -6))
+		create_stock_reconciliation(item_code=item_code, warehouse=warehouse, qty=12, rate=110,
+			posting_date=add_days(nowdate(), -4))
+		make_stock_entry(item_code=item_code, source=warehouse, qty=2,
+			posting_date=add_days(nowdate(), -2))
+
+		filters = frappe._dict({
+			"company": "_Test Company",
+			"from_date": add_days(nowdate(), -5),
+			"to_date": nowdate(),
+			"item_code": item_code
+		})
+
+		items = [item_code]
+		expected = get_item_warehouse_map(filters, get_stock_ledger_entries(filters, items))
+
+		self.assertEqual(get_grouped_item_warehouse_map(filters, items), expected)
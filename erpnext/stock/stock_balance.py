@@ -2,8 +2,10 @@
 # License: GNU General Public License v3. See license.txt
 
 from __future__ import print_function, unicode_literals
-import frappe
-from frappe.utils import flt, cstr, nowdate, nowtime
+import frappe, erpnext
+import glob, json, os, zlib
+from frappe.utils import cint, flt, cstr, nowdate, nowtime
+from six import iteritems
 from erpnext.stock.utils import update_bin
 from erpnext.stock.stock_ledger import update_entries_after
 from erpnext.controllers.stock_controller import update_gl_entries_after
@@ -18,13 +20,7 @@ def repost(only_actual=False, allow_negative_stock=False, allow_zero_rate=False,
 		existing_allow_negative_stock = frappe.db.get_value("Stock Settings", None, "allow_negative_stock")
 		frappe.db.set_value("Stock Settings", None, "allow_negative_stock", 1)
 
-	item_warehouses = frappe.db.sql("""
-		select distinct item_code, warehouse
-		from
-			(select item_code, warehouse from tabBin
-			union
-			select item_code, warehouse from `tabStock Ledger Entry`) a
-	""")
+	item_warehouses = get_item_warehouses()
 	for d in item_warehouses:
 		try:
 			repost_stock(d[0], d[1], allow_zero_rate, only_actual, only_bin, allow_negative_stock)
@@ -36,6 +32,186 @@ def repost(only_actual=False, allow_negative_stock=False, allow_zero_rate=False,
 		frappe.db.set_value("Stock Settings", None, "allow_negative_stock", existing_allow_negative_stock)
 	frappe.db.auto_commit_on_many_writes = 0
 
+def get_item_warehouses():
+	return frappe.db.sql("""
+		select distinct item_code, warehouse
+		from
+			(select item_code, warehouse from tabBin
+			union
+			select item_code, warehouse from `tabStock Ledger Entry`) a
+		order by item_code, warehouse
+	""")
+
+def parallel_repost(site, workers=4, only_actual=False, allow_negative_stock=False, allow_zero_rate=False,
+	only_bin=False, resume=False, repost_gle=True):
+	"""
+	Repost everything, with the item-warehouses sharded by item across worker processes.
+
+	Every worker has its own database connection and appends the item-warehouses it has
+	committed to a checkpoint file, so an interrupted repost can be resumed. The GL Entries
+	of stock transactions are reposted after all workers are done, followed by a
+	consistency check of Bin, Stock Ledger and stock account balances.
+	"""
+	import multiprocessing, time
+
+	frappe.init(site=site)
+	frappe.connect()
+
+	checkpoint_files = get_repost_checkpoint_files()
+	if not resume:
+		for path in checkpoint_files:
+			os.remove(path)
+
+	done = get_reposted_item_warehouses()
+	item_warehouses = [d for d in get_item_warehouses() if tuple(d) not in done]
+
+	if allow_negative_stock:
+		existing_allow_negative_stock = frappe.db.get_value("Stock Settings", None, "allow_negative_stock")
+		frappe.db.set_value("Stock Settings", None, "allow_negative_stock", 1)
+		frappe.db.commit()
+
+	shards = [[] for i in range(workers)]
+	for item_code, warehouse in item_warehouses:
+		# all warehouses of an item go to the same worker, so that workers do not lock the same rows
+		shards[zlib.crc32(item_code.encode("utf-8")) % workers].append((item_code, warehouse))
+
+	sites_path = frappe.local.sites_path
+	print("Reposting {0} item-warehouses ({1} already done) in {2} workers".format(
+		len(item_warehouses), len(done), workers))
+
+	# workers open their own connections, the connection of this process is not shared
+	frappe.destroy()
+
+	progress = multiprocessing.Value("i", 0)
+	processes = [multiprocessing.Process(target=repost_shard, args=(site, sites_path, i, shard, progress,
+		allow_zero_rate, only_actual, only_bin, allow_negative_stock)) for i, shard in enumerate(shards) if shard]
+
+	start = time.time()
+	for process in processes:
+		process.start()
+
+	while any(process.is_alive() for process in processes):
+		time.sleep(10)
+		print_repost_progress(progress.value, len(item_warehouses), time.time() - start)
+
+	for process in processes:
+		process.join()
+
+	frappe.init(site=site, sites_path=sites_path)
+	frappe.connect()
+
+	try:
+		if allow_negative_stock:
+			frappe.db.set_value("Stock Settings", None, "allow_negative_stock", existing_allow_negative_stock)
+			frappe.db.commit()
+
+		failed = [d for d in item_warehouses if tuple(d) not in get_reposted_item_warehouses()]
+		if failed:
+			print("Reposting failed for {0} item-warehouses, run again with --resume:".format(len(failed)))
+			for item_code, warehouse in failed:
+				print(item_code, warehouse)
+			return
+
+		if repost_gle and not only_bin:
+			print("Reposting GL Entries of stock transactions")
+			repost_gle_for_stock_transactions()
+			frappe.db.commit()
+
+		check_stock_consistency()
+	finally:
+		frappe.destroy()
+
+def repost_shard(site, sites_path, shard_no, item_warehouses, progress, allow_zero_rate=False,
+	only_actual=False, only_bin=False, allow_negative_stock=False):
+	"""Repost the item-warehouses of one shard, in a worker process"""
+	frappe.init(site=site, sites_path=sites_path)
+	frappe.connect()
+	frappe.db.auto_commit_on_many_writes = 1
+
+	try:
+		with open(get_repost_checkpoint_file(shard_no), "a") as checkpoint:
+			for item_code, warehouse in item_warehouses:
+				try:
+					repost_stock(item_code, warehouse, allow_zero_rate, only_actual, only_bin, allow_negative_stock)
+					frappe.db.commit()
+				except Exception:
+					frappe.db.rollback()
+					print("Reposting failed for {0}, {1}".format(item_code, warehouse))
+					print(frappe.get_traceback())
+				else:
+					checkpoint.write(json.dumps([item_code, warehouse]) + "\n")
+					checkpoint.flush()
+
+				with progress.get_lock():
+					progress.value += 1
+	finally:
+		frappe.destroy()
+
+def get_repost_checkpoint_file(shard_no):
+	return frappe.get_site_path("private", "stock_repost_checkpoint_{0}.jsonl".format(shard_no))
+
+def get_repost_checkpoint_files():
+	return glob.glob(frappe.get_site_path("private", "stock_repost_checkpoint_*.jsonl"))
+
+def get_reposted_item_warehouses():
+	done = set()
+	for path in get_repost_checkpoint_files():
+		with open(path) as f:
+			for line in f:
+				if line.strip():
+					done.add(tuple(json.loads(line)))
+
+	return done
+
+def print_repost_progress(done, total, elapsed):
+	remaining = (total - done) * elapsed / done if done else 0
+	print("{0}/{1} item-warehouses reposted, {2:.0f}s elapsed, about {3:.0f}s remaining".format(
+		done, total, elapsed, remaining))
+
+def check_stock_consistency(verbose=True):
+	"""Compare Bin with the Stock Ledger, and the stock accounts with the Stock Ledger"""
+	stale_bins = get_stale_bins()
+	account_differences = get_stock_account_differences()
+
+	if verbose:
+		for d in stale_bins:
+			print("Bin out of sync: {0}, {1}: qty {2} (ledger {3}), value {4} (ledger {5})".format(
+				d.item_code, d.warehouse, d.actual_qty, d.sle_qty, d.stock_value, d.sle_stock_value))
+
+		for account, stock_value, account_balance in account_differences:
+			print("Stock account out of sync: {0}: stock value {1}, account balance {2}".format(
+				account, stock_value, account_balance))
+
+		if not (stale_bins or account_differences):
+			print("Bin, Stock Ledger and stock account balances are consistent")
+
+	return stale_bins, account_differences
+
+def get_stock_account_differences():
+	"""Returns (account, stock value, account balance) of the stock accounts of companies with
+		perpetual inventory, where the account balance differs from the Stock Ledger"""
+	from erpnext.stock import get_warehouse_account_map
+
+	stock_value = dict(frappe.db.sql("""select warehouse, sum(stock_value_difference)
+		from `tabStock Ledger Entry` where is_cancelled = 'No' group by warehouse"""))
+
+	account_stock_value = {}
+	for warehouse, d in iteritems(get_warehouse_account_map()):
+		if cint(erpnext.is_perpetual_inventory_enabled(d.company)):
+			account_stock_value.setdefault(d.account, 0.0)
+			account_stock_value[d.account] += flt(stock_value.get(warehouse))
+
+	if not account_stock_value:
+		return []
+
+	account_balance = dict(frappe.db.sql("""select account, sum(debit) - sum(credit)
+		from `tabGL Entry` where account in ({0}) group by account""".format(
+			", ".join(frappe.db.escape(d) for d in account_stock_value))))
+
+	return [(account, value, flt(account_balance.get(account)))
+		for account, value in sorted(iteritems(account_stock_value))
+		if abs(flt(value) - flt(account_balance.get(account))) > 0.01]
+
 def repost_stock(item_code, warehouse, allow_zero_rate=False,
 	only_actual=False, only_bin=False, allow_negative_stock=False):
 
@@ -155,6 +331,59 @@ def update_bin_qty(item_code, warehouse, qty_dict=None):
 		bin.db_update()
 		bin.clear_cache()
 
+def get_stale_bins(item_code=None, warehouse=None):
+	"""Returns bins whose balance does not match the last Stock Ledger Entry of the
+		item-warehouse, or whose projected qty does not match the other quantities"""
+	from erpnext.stock.doctype.bin.bin import get_projected_qty_expression, DELTA_QTY_FIELDS
+
+	conditions = ""
+	if item_code:
+		conditions += " and bin.item_code = %(item_code)s"
+	if warehouse:
+		conditions += " and bin.warehouse = %(warehouse)s"
+
+	last_sle_value = """ifnull((select sle.{0} from `tabStock Ledger Entry` sle
+		where sle.item_code = bin.item_code and sle.warehouse = bin.warehouse
+		and sle.is_cancelled = 'No'
+		order by sle.posting_datetime desc, sle.creation desc limit 1), 0)"""
+
+	return frappe.db.sql("""
+		select name, item_code, warehouse, actual_qty, stock_value, projected_qty,
+			sle_qty, sle_valuation_rate, sle_stock_value
+		from (
+			select bin.name, bin.item_code, bin.warehouse, bin.actual_qty, bin.stock_value,
+				bin.projected_qty, {projected_qty} as expected_projected_qty,
+				{sle_qty} as sle_qty, {sle_valuation_rate} as sle_valuation_rate,
+				{sle_stock_value} as sle_stock_value
+			from `tabBin` bin
+			where 1=1 {conditions}
+		) bin_balance
+		where abs(actual_qty - sle_qty) > 0.0001
+			or abs(stock_value - sle_stock_value) > 0.01
+			or abs(projected_qty - expected_projected_qty) > 0.0001
+	""".format(
+		projected_qty=get_projected_qty_expression("bin.actual_qty",
+			**{f: "bin." + f for f in DELTA_QTY_FIELDS}),
+		sle_qty=last_sle_value.format("qty_after_transaction"),
+		sle_valuation_rate=last_sle_value.format("valuation_rate"),
+		sle_stock_value=last_sle_value.format("stock_value"),
+		conditions=conditions
+	), {"item_code": item_code, "warehouse": warehouse}, as_dict=1)
+
+def reconcile_stale_bins(item_code=None, warehouse=None, verbose=False):
+	"""Reset the balance and projected qty of stale bins from the Stock Ledger,
+		e.g. `bench execute erpnext.stock.stock_balance.reconcile_stale_bins`"""
+	from erpnext.stock.doctype.bin.bin import set_stock_balance
+
+	stale_bins = get_stale_bins(item_code, warehouse)
+	for d in stale_bins:
+		if verbose:
+			print(d.item_code, d.warehouse, d.actual_qty, d.sle_qty)
+
+		set_stock_balance(d.name, d.sle_qty, d.sle_valuation_rate, d.sle_stock_value)
+
+	return stale_bins
+
 def set_stock_balance_as_per_serial_no(item_code=None, posting_date=None, posting_time=None,
 	 	fiscal_year=None):
 	if not posting_date: posting_date = nowdate()
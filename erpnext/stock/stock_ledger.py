@@ -5,8 +5,9 @@ from __future__ import unicode_literals
 import frappe, erpnext
 from frappe import _
 from frappe.utils import cint, flt, cstr, now
-from erpnext.stock.utils import get_valuation_method
-import json
+from erpnext.stock.utils import get_valuation_method, get_combine_datetime, get_or_make_bin
+from erpnext.stock.valuation import FIFOValuation
+from erpnext.stock.doctype.stock_closing_balance.stock_closing_balance import update_stock_closing_balances_after
 
 from six import iteritems
 
@@ -14,6 +15,10 @@ from six import iteritems
 class NegativeStockError(frappe.ValidationError): pass
 
 _exceptions = frappe.local('stockledger_exceptions')
+
+# fields recomputed for every entry while reposting
+REPOST_FIELDS = ("qty_after_transaction", "valuation_rate", "stock_value",
+	"stock_queue", "stock_value_difference")
 # _exceptions = []
 
 def make_sl_entries(sl_entries, is_amended=None, allow_negative_stock=False, via_landed_cost_voucher=False):
@@ -61,6 +66,7 @@ def make_entry(args, allow_negative_stock=False, via_landed_cost_voucher=False):
 def delete_cancelled_entry(voucher_type, voucher_no):
 	frappe.db.sql("""delete from `tabStock Ledger Entry`
 		where voucher_type=%s and voucher_no=%s""", (voucher_type, voucher_no))
+	clear_valuation_rate_cache()
 
 class update_entries_after(object):
 	"""
@@ -76,10 +82,13 @@ class update_entries_after(object):
 				"posting_time": "12:00"
 			}
 	"""
-	def __init__(self, args, allow_zero_rate=False, allow_negative_stock=None, via_landed_cost_voucher=False, verbose=1):
+	def __init__(self, args, allow_zero_rate=False, allow_negative_stock=None, via_landed_cost_voucher=False,
+		verbose=1, repost_future_entries=True, progress_callback=None):
 		from frappe.model.meta import get_field_precision
 
 		self.exceptions = []
+		self.repost_future_entries = repost_future_entries
+		self.progress_callback = progress_callback
 		self.verbose = verbose
 		self.allow_zero_rate = allow_zero_rate
 		self.allow_negative_stock = allow_negative_stock
@@ -103,48 +112,45 @@ class update_entries_after(object):
 			currency=frappe.get_cached_value('Company',  self.company,  "default_currency"))
 
 		self.prev_stock_value = self.previous_sle.stock_value or 0.0
-		self.stock_queue = json.loads(self.previous_sle.stock_queue or "[]")
+		self.stock_queue = FIFOValuation(self.previous_sle.stock_queue)
 		self.valuation_method = get_valuation_method(self.item_code)
 		self.stock_value_difference = 0.0
+		self.entries_to_update = []
+		self.valuation_rate_memo = {}
 		self.build()
 
 	def build(self):
 		# includes current entry!
 		entries_to_fix = self.get_sle_after_datetime()
 
-		for sle in entries_to_fix:
+		for i, sle in enumerate(entries_to_fix, 1):
 			self.process_sle(sle)
+			if self.progress_callback:
+				self.progress_callback(i)
 
 		if self.exceptions:
 			self.raise_exceptions()
 
-		self.update_bin()
+		self.update_sle_values()
 
-	def update_bin(self):
-		# update bin
-		bin_name = frappe.db.get_value("Bin", {
-			"item_code": self.item_code,
-			"warehouse": self.warehouse
-		})
+		# entries after the current time-bucket are reposted by the repost queue,
+		# which also sets the final valuation in the bin and the closing balances
+		if self.repost_future_entries:
+			self.update_bin()
+			update_stock_closing_balances_after(self.item_code, self.warehouse, self.args.get("posting_date"))
 
-		if not bin_name:
-			bin_doc = frappe.get_doc({
-				"doctype": "Bin",
-				"item_code": self.item_code,
-				"warehouse": self.warehouse
-			})
-			bin_doc.insert(ignore_permissions=True)
-		else:
-			bin_doc = frappe.get_doc("Bin", bin_name)
+	def update_sle_values(self):
+		"""write back the recomputed values of all reposted entries in bulk"""
+		bulk_update_sle_values(self.entries_to_update)
+		self.entries_to_update = []
+		clear_valuation_rate_cache(self.item_code)
 
-		bin_doc.update({
-			"valuation_rate": self.valuation_rate,
-			"actual_qty": self.qty_after_transaction,
-			"stock_value": self.stock_value
-		})
-		bin_doc.flags.via_stock_ledger_entry = True
+	def update_bin(self):
+		# update bin
+		from erpnext.stock.doctype.bin.bin import set_stock_balance
 
-		bin_doc.save(ignore_permissions=True)
+		set_stock_balance(get_or_make_bin(self.item_code, self.warehouse),
+			self.qty_after_transaction, self.valuation_rate, self.stock_value)
 
 	def process_sle(self, sle):
 		if (sle.serial_no and not self.via_landed_cost_voucher) or not cint(self.allow_negative_stock):
@@ -166,7 +172,7 @@ class update_entries_after(object):
 				# assert
 				self.valuation_rate = sle.valuation_rate
 				self.qty_after_transaction = sle.qty_after_transaction
-				self.stock_queue = [[self.qty_after_transaction, self.valuation_rate]]
+				self.stock_queue = FIFOValuation([[self.qty_after_transaction, self.valuation_rate]])
 				self.stock_value = flt(self.qty_after_transaction) * flt(self.valuation_rate)
 			else:
 				if self.valuation_method == "Moving Average":
@@ -176,7 +182,7 @@ class update_entries_after(object):
 				else:
 					self.get_fifo_values(sle)
 					self.qty_after_transaction += flt(sle.actual_qty)
-					self.stock_value = sum((flt(batch[0]) * flt(batch[1]) for batch in self.stock_queue))
+					self.stock_value = self.stock_queue.total_value
 
 		# rounding as per precision
 		self.stock_value = flt(self.stock_value, self.precision)
@@ -189,10 +195,9 @@ class update_entries_after(object):
 		sle.qty_after_transaction = self.qty_after_transaction
 		sle.valuation_rate = self.valuation_rate
 		sle.stock_value = self.stock_value
-		sle.stock_queue = json.dumps(self.stock_queue)
+		sle.stock_queue = self.stock_queue.to_json()
 		sle.stock_value_difference = stock_value_difference
-		sle.doctype="Stock Ledger Entry"
-		frappe.get_doc(sle).db_update()
+		self.entries_to_update.append(sle)
 
 	def validate_negative_stock(self, sle):
 		"""
@@ -240,9 +245,7 @@ class update_entries_after(object):
 		if not self.valuation_rate and sle.voucher_detail_no:
 			allow_zero_rate = self.check_if_allow_zero_valuation_rate(sle.voucher_type, sle.voucher_detail_no)
 			if not allow_zero_rate:
-				self.valuation_rate = get_valuation_rate(sle.item_code, sle.warehouse,
-					sle.voucher_type, sle.voucher_no, self.allow_zero_rate,
-					currency=erpnext.get_company_currency(sle.company))
+				self.valuation_rate = self.get_fallback_valuation_rate(sle)
 
 	def get_moving_average_values(self, sle):
 		actual_qty = flt(sle.actual_qty)
@@ -278,9 +281,7 @@ class update_entries_after(object):
 			if not self.valuation_rate and sle.voucher_detail_no:
 				allow_zero_valuation_rate = self.check_if_allow_zero_valuation_rate(sle.voucher_type, sle.voucher_detail_no)
 				if not allow_zero_valuation_rate:
-					self.valuation_rate = get_valuation_rate(sle.item_code, sle.warehouse,
-						sle.voucher_type, sle.voucher_no, self.allow_zero_rate,
-						currency=erpnext.get_company_currency(sle.company))
+					self.valuation_rate = self.get_fallback_valuation_rate(sle)
 
 	def get_fifo_values(self, sle):
 		incoming_rate = flt(sle.incoming_rate)
@@ -288,76 +289,35 @@ class update_entries_after(object):
 		outgoing_rate = flt(sle.outgoing_rate)
 
 		if actual_qty > 0:
-			if not self.stock_queue:
-				self.stock_queue.append([0, 0])
-
-			# last row has the same rate, just updated the qty
-			if self.stock_queue[-1][1]==incoming_rate:
-				self.stock_queue[-1][0] += actual_qty
-			else:
-				if self.stock_queue[-1][0] > 0:
-					self.stock_queue.append([actual_qty, incoming_rate])
-				else:
-					qty = self.stock_queue[-1][0] + actual_qty
-					self.stock_queue[-1] = [qty, incoming_rate]
+			self.stock_queue.add_stock(actual_qty, incoming_rate)
 		else:
-			qty_to_pop = abs(actual_qty)
-			while qty_to_pop:
-				if not self.stock_queue:
-					# Get valuation rate from last sle if exists or from valuation rate field in item master
-					allow_zero_valuation_rate = self.check_if_allow_zero_valuation_rate(sle.voucher_type, sle.voucher_detail_no)
-					if not allow_zero_valuation_rate:
-						_rate = get_valuation_rate(sle.item_code, sle.warehouse,
-							sle.voucher_type, sle.voucher_no, self.allow_zero_rate,
-							currency=erpnext.get_company_currency(sle.company))
-					else:
-						_rate = 0
-
-					self.stock_queue.append([0, _rate])
-
-				index = None
-				if outgoing_rate > 0:
-					# Find the entry where rate matched with outgoing rate
-					for i, v in enumerate(self.stock_queue):
-						if v[1] == outgoing_rate:
-							index = i
-							break
-
-					# If no entry found with outgoing rate, collapse stack
-					if index == None:
-						new_stock_value = sum((d[0]*d[1] for d in self.stock_queue)) - qty_to_pop*outgoing_rate
-						new_stock_qty = sum((d[0] for d in self.stock_queue)) - qty_to_pop
-						self.stock_queue = [[new_stock_qty, new_stock_value/new_stock_qty if new_stock_qty > 0 else outgoing_rate]]
-						break
+			def rate_generator():
+				# Get valuation rate from last sle if exists or from valuation rate field in item master
+				allow_zero_valuation_rate = self.check_if_allow_zero_valuation_rate(sle.voucher_type, sle.voucher_detail_no)
+				if not allow_zero_valuation_rate:
+					return self.get_fallback_valuation_rate(sle)
 				else:
-					index = 0
-
-				# select first batch or the batch with same rate
-				batch = self.stock_queue[index]
-				if qty_to_pop >= batch[0]:
-					# consume current batch
-					qty_to_pop = qty_to_pop - batch[0]
-					self.stock_queue.pop(index)
-					if not self.stock_queue and qty_to_pop:
-						# stock finished, qty still remains to be withdrawn
-						# negative stock, keep in as a negative batch
-						self.stock_queue.append([-qty_to_pop, outgoing_rate or batch[1]])
-						break
+					return 0
 
-				else:
-					# qty found in current batch
-					# consume it and exit
-					batch[0] = batch[0] - qty_to_pop
-					qty_to_pop = 0
+			self.stock_queue.remove_stock(abs(actual_qty), outgoing_rate, rate_generator=rate_generator)
 
-		stock_value = sum((flt(batch[0]) * flt(batch[1]) for batch in self.stock_queue))
-		stock_qty = sum((flt(batch[0]) for batch in self.stock_queue))
+		stock_qty, stock_value = self.stock_queue.get_total_stock_and_value()
 
 		if stock_qty:
 			self.valuation_rate = stock_value / flt(stock_qty)
 
 		if not self.stock_queue:
-			self.stock_queue.append([0, sle.incoming_rate or sle.outgoing_rate or self.valuation_rate])
+			self.stock_queue.append(0, sle.incoming_rate or sle.outgoing_rate or self.valuation_rate)
+
+	def get_fallback_valuation_rate(self, sle):
+		"""Valuation rate from the last entry or the Item, memoized per voucher for this repost"""
+		key = (sle.voucher_type, sle.voucher_no)
+		if key not in self.valuation_rate_memo:
+			self.valuation_rate_memo[key] = get_valuation_rate(sle.item_code, sle.warehouse,
+				sle.voucher_type, sle.voucher_no, self.allow_zero_rate,
+				currency=erpnext.get_company_currency(sle.company))
+
+		return self.valuation_rate_memo[key]
 
 	def check_if_allow_zero_valuation_rate(self, voucher_type, voucher_detail_no):
 		ref_item_dt = ""
@@ -378,9 +338,13 @@ class update_entries_after(object):
 
 	def get_sle_after_datetime(self):
 		"""get Stock Ledger Entries after a particular datetime, for reposting"""
+		till_timestamp = None
+		if not self.repost_future_entries:
+			till_timestamp = (self.args.get("posting_date"), self.args.get("posting_time") or "00:00")
+
 		return get_stock_ledger_entries(self.previous_sle or frappe._dict({
 				"item_code": self.args.get("item_code"), "warehouse": self.args.get("warehouse") }),
-			">", "asc", for_update=True, check_serial_no=False)
+			">", "asc", for_update=True, check_serial_no=False, till_timestamp=till_timestamp)
 
 	def raise_exceptions(self):
 		deficiency = min(e["diff"] for e in self.exceptions)
@@ -422,9 +386,22 @@ def get_previous_sle(args, for_update=False):
 	return sle and sle[0] or {}
 
 def get_stock_ledger_entries(previous_sle, operator=None,
-	order="desc", limit=None, for_update=False, debug=False, check_serial_no=True):
+	order="desc", limit=None, for_update=False, debug=False, check_serial_no=True, till_timestamp=None):
 	"""get stock ledger entries filtered by specific posting datetime conditions"""
-	conditions = " and timestamp(posting_date, posting_time) {0} timestamp(%(posting_date)s, %(posting_time)s)".format(operator)
+	if not previous_sle.get("posting_date"):
+		previous_sle["posting_date"] = "1900-01-01"
+	if not previous_sle.get("posting_time"):
+		previous_sle["posting_time"] = "00:00"
+
+	# range scan on the (item_code, warehouse, posting_datetime, creation) index
+	previous_sle["posting_datetime"] = get_combine_datetime(previous_sle["posting_date"],
+		previous_sle["posting_time"])
+
+	conditions = " and posting_datetime {0} %(posting_datetime)s".format(operator)
+	if till_timestamp:
+		previous_sle["till_posting_datetime"] = get_combine_datetime(*till_timestamp)
+		conditions += " and posting_datetime <= %(till_posting_datetime)s"
+
 	if previous_sle.get("warehouse"):
 		conditions += " and warehouse = %(warehouse)s"
 	elif previous_sle.get("warehouse_condition"):
@@ -433,19 +410,14 @@ def get_stock_ledger_entries(previous_sle, operator=None,
 	if check_serial_no and previous_sle.get("serial_no"):
 		conditions += " and serial_no like {}".format(frappe.db.escape('%{0}%'.format(previous_sle.get("serial_no"))))
 
-	if not previous_sle.get("posting_date"):
-		previous_sle["posting_date"] = "1900-01-01"
-	if not previous_sle.get("posting_time"):
-		previous_sle["posting_time"] = "00:00"
-
 	if operator in (">", "<=") and previous_sle.get("name"):
 		conditions += " and name!=%(name)s"
 
-	return frappe.db.sql("""select *, timestamp(posting_date, posting_time) as "timestamp" from `tabStock Ledger Entry`
+	return frappe.db.sql("""select *, posting_datetime as "timestamp" from `tabStock Ledger Entry`
 		where item_code = %%(item_code)s
 		and ifnull(is_cancelled, 'No')='No'
 		%(conditions)s
-		order by timestamp(posting_date, posting_time) %(order)s, creation %(order)s
+		order by posting_datetime %(order)s, creation %(order)s
 		%(limit)s %(for_update)s""" % {
 			"conditions": conditions,
 			"limit": limit or "",
@@ -453,52 +425,182 @@ def get_stock_ledger_entries(previous_sle, operator=None,
 			"order": order
 		}, previous_sle, as_dict=1, debug=debug)
 
+def has_future_sle(args):
+	"""Returns True if the item-warehouse has entries of other vouchers
+		on or after the posting datetime of the given entry"""
+	return frappe.db.sql("""select name from `tabStock Ledger Entry`
+		where item_code = %(item_code)s and warehouse = %(warehouse)s
+		and ifnull(is_cancelled, 'No') = 'No'
+		and posting_datetime >= %(posting_datetime)s
+		and not (voucher_type = %(voucher_type)s and voucher_no = %(voucher_no)s)
+		limit 1""", {
+			"item_code": args.get("item_code"),
+			"warehouse": args.get("warehouse"),
+			"posting_datetime": get_combine_datetime(args.get("posting_date"), args.get("posting_time")),
+			"voucher_type": args.get("voucher_type"),
+			"voucher_no": args.get("voucher_no")
+		})
+
+def validate_future_negative_qty(args):
+	"""Validate that an outgoing backdated entry does not make any future balance negative,
+		without reposting the future entries. A future reconciliation resets the balance,
+		so only entries before it are considered."""
+	actual_qty = flt(args.get("actual_qty"))
+	if actual_qty >= 0:
+		return
+
+	values = {
+		"item_code": args.get("item_code"),
+		"warehouse": args.get("warehouse"),
+		"posting_datetime": get_combine_datetime(args.get("posting_date"), args.get("posting_time"))
+	}
+
+	future_sle = frappe.db.sql("""select qty_after_transaction, posting_date, posting_time,
+			voucher_type, voucher_no
+		from `tabStock Ledger Entry`
+		where item_code = %(item_code)s and warehouse = %(warehouse)s
+		and ifnull(is_cancelled, 'No') = 'No'
+		and posting_datetime > %(posting_datetime)s
+		and posting_datetime < ifnull((select min(posting_datetime)
+			from `tabStock Ledger Entry`
+			where item_code = %(item_code)s and warehouse = %(warehouse)s
+			and ifnull(is_cancelled, 'No') = 'No' and voucher_type = 'Stock Reconciliation'
+			and posting_datetime > %(posting_datetime)s),
+			'9999-12-31')
+		order by qty_after_transaction asc limit 1""", values, as_dict=1)
+
+	if future_sle and flt(future_sle[0].qty_after_transaction) + actual_qty < -0.0001:
+		sle = future_sle[0]
+		frappe.throw(_("{0} units of {1} needed in {2} on {3} {4} for {5} to complete this transaction.").format(
+			abs(flt(sle.qty_after_transaction) + actual_qty), frappe.get_desk_link('Item', values["item_code"]),
+			frappe.get_desk_link('Warehouse', values["warehouse"]), sle.posting_date, sle.posting_time,
+			frappe.get_desk_link(sle.voucher_type, sle.voucher_no)), NegativeStockError, title=_('Insufficent Stock'))
+
+def bulk_update_sle_values(entries, batch_size=500):
+	"""Update the computed valuation fields of Stock Ledger Entries in a few
+		multi-row updates instead of one update per entry
+
+		:param entries: list of dicts with `name` and the fields in `REPOST_FIELDS`
+	"""
+	for i in range(0, len(entries), batch_size):
+		batch = entries[i:i + batch_size]
+
+		set_clauses, values = [], []
+		for fieldname in REPOST_FIELDS:
+			set_clauses.append("`{0}` = case name {1} end".format(fieldname,
+				" ".join(["when %s then %s"] * len(batch))))
+			for sle in batch:
+				values.extend([sle.name, sle.get(fieldname)])
+
+		values.extend([sle.name for sle in batch])
+
+		frappe.db.sql("""update `tabStock Ledger Entry`
+			set {0}
+			where name in ({1})""".format(", ".join(set_clauses), ", ".join(["%s"] * len(batch))),
+			tuple(values))
+
 def get_valuation_rate(item_code, warehouse, voucher_type, voucher_no,
 	allow_zero_rate=False, currency=None, company=None, raise_error_if_no_rate=True):
 	# Get valuation rate from last sle for the same item and warehouse
 	if not company:
 		company = erpnext.get_default_company()
 
-	last_valuation_rate = frappe.db.sql("""select valuation_rate
+	last_valuation_rate = get_last_valuation_rate(item_code, warehouse, voucher_type, voucher_no)
+	if last_valuation_rate is not None:
+		return last_valuation_rate # as there is previous records, it might come with zero rate
+
+	# If negative stock allowed, and item delivered without any incoming entry,
+	# system does not found any SLE, then take valuation rate from Item
+	valuation_rate = get_item_valuation_rate(item_code, currency)
+
+	if not allow_zero_rate and not valuation_rate and raise_error_if_no_rate \
+			and cint(erpnext.is_perpetual_inventory_enabled(company)):
+		frappe.local.message_log = []
+		frappe.throw(_("Valuation rate not found for the Item {0}, which is required to do accounting entries for {1} {2}. If the item is transacting as a zero valuation rate item in the {1}, please mention that in the {1} Item table. Otherwise, please create an incoming stock transaction for the item or mention valuation rate in the Item record, and then try submiting / cancelling this entry.")
+			.format(item_code, voucher_type, voucher_no))
+
+	return valuation_rate
+
+def get_last_valuation_rate(item_code, warehouse, voucher_type, voucher_no):
+	"""Returns the valuation rate of the last entry of the item in the warehouse, or else
+		in any warehouse, other than the given voucher. None if there is no such entry"""
+	cache = get_valuation_rate_cache(item_code)
+
+	def _get_last_valuation_rate(key, query, values):
+		# the last entry is cached once and holds for every other voucher,
+		# only the voucher which made the last entry needs its own lookup
+		if key not in cache:
+			cache[key] = frappe.db.sql(query.format(condition=""), values)
+
+		last_entry = cache[key]
+		if last_entry and (last_entry[0][1], last_entry[0][2]) == (voucher_type, voucher_no):
+			voucher_key = key + (voucher_type, voucher_no)
+			if voucher_key not in cache:
+				cache[voucher_key] = frappe.db.sql(query.format(
+					condition="AND NOT (voucher_no = %s AND voucher_type = %s)"), values + (voucher_no, voucher_type))
+			last_entry = cache[voucher_key]
+
+		return flt(last_entry[0][0]) if last_entry else None
+
+	last_valuation_rate = _get_last_valuation_rate(("warehouse", warehouse), """
+		select valuation_rate, voucher_type, voucher_no
 		from `tabStock Ledger Entry`
 		where
 			item_code = %s
 			AND warehouse = %s
 			AND valuation_rate >= 0
-			AND NOT (voucher_no = %s AND voucher_type = %s)
-		order by posting_date desc, posting_time desc, name desc limit 1""", (item_code, warehouse, voucher_no, voucher_type))
+			{condition}
+		order by posting_datetime desc, creation desc limit 1""", (item_code, warehouse))
 
-	if not last_valuation_rate:
+	if last_valuation_rate is None:
 		# Get valuation rate from last sle for the item against any warehouse
-		last_valuation_rate = frappe.db.sql("""select valuation_rate
+		last_valuation_rate = _get_last_valuation_rate(("any_warehouse",), """
+			select valuation_rate, voucher_type, voucher_no
 			from `tabStock Ledger Entry`
 			where
 				item_code = %s
 				AND valuation_rate > 0
-				AND NOT(voucher_no = %s AND voucher_type = %s)
-			order by posting_date desc, posting_time desc, name desc limit 1""", (item_code, voucher_no, voucher_type))
+				{condition}
+			order by posting_datetime desc, creation desc limit 1""", (item_code,))
 
-	if last_valuation_rate:
-		return flt(last_valuation_rate[0][0]) # as there is previous records, it might come with zero rate
+	return last_valuation_rate
 
-	# If negative stock allowed, and item delivered without any incoming entry,
-	# system does not found any SLE, then take valuation rate from Item
-	valuation_rate = frappe.db.get_value("Item", item_code, "valuation_rate")
+def get_item_valuation_rate(item_code, currency=None):
+	"""Returns the valuation rate from the Item, its standard rate or buying Item Price"""
+	cache = get_valuation_rate_cache(item_code)
+	key = ("item", currency)
 
-	if not valuation_rate:
-		# try Item Standard rate
-		valuation_rate = frappe.db.get_value("Item", item_code, "standard_rate")
+	if key not in cache:
+		valuation_rate = frappe.db.get_value("Item", item_code, "valuation_rate")
 
 		if not valuation_rate:
-			# try in price list
-			valuation_rate = frappe.db.get_value('Item Price',
-				dict(item_code=item_code, buying=1, currency=currency),
-				'price_list_rate')
+			# try Item Standard rate
+			valuation_rate = frappe.db.get_value("Item", item_code, "standard_rate")
 
-	if not allow_zero_rate and not valuation_rate and raise_error_if_no_rate \
-			and cint(erpnext.is_perpetual_inventory_enabled(company)):
-		frappe.local.message_log = []
-		frappe.throw(_("Valuation rate not found for the Item {0}, which is required to do accounting entries for {1} {2}. If the item is transacting as a zero valuation rate item in the {1}, please mention that in the {1} Item table. Otherwise, please create an incoming stock transaction for the item or mention valuation rate in the Item record, and then try submiting / cancelling this entry.")
-			.format(item_code, voucher_type, voucher_no))
+			if not valuation_rate:
+				# try in price list
+				valuation_rate = frappe.db.get_value('Item Price',
+					dict(item_code=item_code, buying=1, currency=currency),
+					'price_list_rate')
 
-	return valuation_rate
+		cache[key] = valuation_rate
+
+	return cache[key]
+
+def get_valuation_rate_cache(item_code):
+	"""Request-scoped cache of the valuation rate lookups of the item"""
+	if not hasattr(frappe.local, "valuation_rate_cache"):
+		frappe.local.valuation_rate_cache = {}
+
+	return frappe.local.valuation_rate_cache.setdefault(item_code, {})
+
+def clear_valuation_rate_cache(item_code=None):
+	"""Clear cached valuation rates of the item (or all items) when its Stock Ledger Entries change"""
+	cache = getattr(frappe.local, "valuation_rate_cache", None)
+	if not cache:
+		return
+
+	if item_code:
+		cache.pop(item_code, None)
+	else:
+		cache.clear()
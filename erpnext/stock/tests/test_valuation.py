@@ -0,0 +1,62 @@
+# Copyright (c) 2020, Frappe Technologies Pvt. Ltd. and Contributors
+# License: GNU General Public License v3. See license.txt
+
+from __future__ import unicode_literals
+import json
+import unittest
+from erpnext.stock.valuation import FIFOValuation
+
+class TestFIFOValuation(unittest.TestCase):
+	def assert_queue(self, queue, expected):
+		self.assertEqual(queue.get_state(), expected)
+		self.assertAlmostEqual(queue.total_qty, sum(d[0] for d in expected))
+		self.assertAlmostEqual(queue.total_value, sum(d[0] * d[1] for d in expected))
+
+	def test_incoming_batches(self):
+		queue = FIFOValuation([])
+		queue.add_stock(10, 100)
+		queue.add_stock(5, 100)
+		queue.add_stock(5, 200)
+		self.assert_queue(queue, [[15, 100], [5, 200]])
+
+	def test_consume_in_fifo_order(self):
+		queue = FIFOValuation([[10, 100], [10, 200], [10, 300]])
+		queue.remove_stock(15)
+		self.assert_queue(queue, [[5, 200], [10, 300]])
+
+	def test_consume_batch_with_outgoing_rate(self):
+		queue = FIFOValuation([[10, 100], [10, 200], [10, 300]])
+		queue.remove_stock(10, outgoing_rate=200)
+		self.assert_queue(queue, [[10, 100], [10, 300]])
+
+	def test_collapse_for_unmatched_outgoing_rate(self):
+		queue = FIFOValuation([[10, 100], [10, 200]])
+		queue.remove_stock(10, outgoing_rate=50)
+		self.assert_queue(queue, [[10, 250]])
+
+	def test_negative_stock(self):
+		queue = FIFOValuation([[5, 100]])
+		queue.remove_stock(8)
+		self.assert_queue(queue, [[-3, 100]])
+
+		# incoming stock fills up the negative batch
+		queue.add_stock(5, 120)
+		self.assert_queue(queue, [[2, 120]])
+
+	def test_empty_queue_uses_rate_generator(self):
+		queue = FIFOValuation([])
+		queue.remove_stock(2, rate_generator=lambda: 40)
+		self.assert_queue(queue, [[-2, 40]])
+
+	def test_large_queue(self):
+		queue = FIFOValuation([])
+		for i in range(5000):
+			queue.add_stock(1, i + 1)
+
+		queue.remove_stock(4990)
+		self.assert_queue(queue, [[1, i + 1] for i in range(4990, 5000)])
+
+	def test_serialized_form_is_compatible(self):
+		stock_queue = json.dumps([[10, 100], [5.5, 120.25]])
+		queue = FIFOValuation(stock_queue)
+		self.assertEqual(json.loads(queue.to_json()), json.loads(stock_queue))
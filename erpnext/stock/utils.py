@@ -5,12 +5,16 @@ from __future__ import unicode_literals
 import frappe, erpnext
 from frappe import _
 import json
-from frappe.utils import flt, cstr, nowdate, nowtime
+from frappe.utils import flt, cstr, nowdate, nowtime, get_datetime
 
 from six import string_types
 
 class InvalidWarehouseCompany(frappe.ValidationError): pass
 
+def get_combine_datetime(posting_date, posting_time):
+	"""Returns the posting datetime stored in `posting_datetime` of Stock Ledger Entry"""
+	return get_datetime("{0} {1}".format(posting_date, posting_time or "00:00"))
+
 def get_stock_value_from_bin(warehouse=None, item_code=None):
 	values = {}
 	conditions = ""
@@ -37,9 +41,11 @@ def get_stock_value_from_bin(warehouse=None, item_code=None):
 	return stock_value
 
 def get_stock_value_on(warehouse=None, posting_date=None, item_code=None):
+	from erpnext.stock.doctype.stock_closing_balance.stock_closing_balance import get_last_closing_date
+
 	if not posting_date: posting_date = nowdate()
 
-	values, condition = [posting_date], ""
+	values, condition = [], ""
 
 	if warehouse:
 
@@ -59,16 +65,31 @@ def get_stock_value_on(warehouse=None, posting_date=None, item_code=None):
 		values.append(item_code)
 		condition += " AND item_code = %s"
 
+	# start from the monthly closing balances, and only read the entries posted after them
+	sle_map = {}
+	closing_date = get_last_closing_date(posting_date)
+	if closing_date:
+		for d in frappe.db.sql("""
+			SELECT item_code, warehouse, stock_value
+			FROM `tabStock Closing Balance` sle
+			WHERE closing_date = %s {0}
+		""".format(condition), [closing_date] + values, as_dict=1):
+			sle_map[(d.item_code, d.warehouse)] = flt(d.stock_value)
+
+		condition += " AND posting_date > %s"
+		values.append(closing_date)
+
 	stock_ledger_entries = frappe.db.sql("""
 		SELECT item_code, stock_value, name, warehouse
 		FROM `tabStock Ledger Entry` sle
 		WHERE posting_date <= %s {0}
-		ORDER BY timestamp(posting_date, posting_time) DESC, creation DESC
-	""".format(condition), values, as_dict=1)
+		ORDER BY posting_datetime DESC, creation DESC
+	""".format(condition), [posting_date] + values, as_dict=1)
 
-	sle_map = {}
+	updated_keys = set()
 	for sle in stock_ledger_entries:
-		if not (sle.item_code, sle.warehouse) in sle_map:
+		if not (sle.item_code, sle.warehouse) in updated_keys:
+			updated_keys.add((sle.item_code, sle.warehouse))
 			sle_map[(sle.item_code, sle.warehouse)] = flt(sle.stock_value)
 
 	return sum(sle_map.values())
@@ -126,8 +147,14 @@ def get_latest_stock_balance():
 	return bin_map
 
 def get_bin(item_code, warehouse):
-	bin = frappe.db.get_value("Bin", {"item_code": item_code, "warehouse": warehouse})
-	if not bin:
+	bin_obj = frappe.get_doc("Bin", get_or_make_bin(item_code, warehouse))
+	bin_obj.flags.ignore_permissions = True
+	return bin_obj
+
+def get_or_make_bin(item_code, warehouse):
+	"""Returns the name of the Bin of the item-warehouse, creating it if missing"""
+	bin_name = frappe.db.get_value("Bin", {"item_code": item_code, "warehouse": warehouse})
+	if not bin_name:
 		bin_obj = frappe.get_doc({
 			"doctype": "Bin",
 			"item_code": item_code,
@@ -135,17 +162,18 @@ def get_bin(item_code, warehouse):
 		})
 		bin_obj.flags.ignore_permissions = 1
 		bin_obj.insert()
-	else:
-		bin_obj = frappe.get_doc('Bin', bin)
-	bin_obj.flags.ignore_permissions = True
-	return bin_obj
+		bin_name = bin_obj.name
+
+	return bin_name
 
 def update_bin(args, allow_negative_stock=False, via_landed_cost_voucher=False):
-	is_stock_item = frappe.db.get_value('Item', args.get("item_code"), 'is_stock_item')
+	from erpnext.stock.doctype.bin.bin import update_stock
+
+	is_stock_item = frappe.get_cached_value('Item', args.get("item_code"), 'is_stock_item')
 	if is_stock_item:
-		bin = get_bin(args.get("item_code"), args.get("warehouse"))
-		bin.update_stock(args, allow_negative_stock, via_landed_cost_voucher)
-		return bin
+		bin_name = get_or_make_bin(args.get("item_code"), args.get("warehouse"))
+		update_stock(bin_name, args, allow_negative_stock, via_landed_cost_voucher)
+		return bin_name
 	else:
 		frappe.msgprint(_("Item {0} ignored since it is not a stock item").format(args.get("item_code")))
 
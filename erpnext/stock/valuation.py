@@ -0,0 +1,163 @@
+# Copyright (c) 2020, Frappe Technologies Pvt. Ltd. and Contributors
+# License: GNU General Public License v3. See license.txt
+
+from __future__ import unicode_literals
+import json
+from frappe.utils import flt
+
+class FIFOValuation(object):
+	"""FIFO stock queue of `[qty, rate]` batches, as stored in `stock_queue` of Stock Ledger Entry.
+
+		Batches are kept in a list with a moving head, so consuming the oldest batch is O(1)
+		amortized. Running qty and value totals avoid re-summing the queue for every entry,
+		and a map of rate -> positions finds the batch matching an outgoing rate without a scan.
+		Batches consumed from the middle of the queue are left as `None` holes and skipped.
+	"""
+	def __init__(self, stock_queue=None):
+		if isinstance(stock_queue, FIFOValuation):
+			stock_queue = stock_queue.get_state()
+		elif not isinstance(stock_queue, list):
+			stock_queue = json.loads(stock_queue or "[]")
+
+		self.batches = []
+		self.head = 0
+		self.live_batches = 0
+		self.rate_map = {}
+		self.total_qty = 0.0
+		self.total_value = 0.0
+
+		for qty, rate in stock_queue:
+			self.append(qty, rate)
+
+	def __len__(self):
+		return self.live_batches
+
+	def __iter__(self):
+		for i in range(self.head, len(self.batches)):
+			if self.batches[i] is not None:
+				yield self.batches[i]
+
+	def get_state(self):
+		"""Returns the queue as a list of `[qty, rate]`"""
+		return [list(batch) for batch in self]
+
+	def to_json(self):
+		"""Compact serialized form, readable by `json.loads` like the old `stock_queue` values"""
+		return json.dumps(self.get_state(), separators=(",", ":"))
+
+	def get_total_stock_and_value(self):
+		return self.total_qty, self.total_value
+
+	def append(self, qty, rate):
+		position = len(self.batches)
+		self.batches.append([qty, rate])
+		self.rate_map.setdefault(rate, []).append(position)
+		self.live_batches += 1
+		self.total_qty += flt(qty)
+		self.total_value += flt(qty) * flt(rate)
+
+	def remove(self, position):
+		qty, rate = self.batches[position]
+		self.batches[position] = None
+		self.rate_map[rate].remove(position)
+		if not self.rate_map[rate]:
+			del self.rate_map[rate]
+
+		self.live_batches -= 1
+		self.total_qty -= flt(qty)
+		self.total_value -= flt(qty) * flt(rate)
+
+		self.compact()
+
+	def compact(self):
+		"""Drop holes at both ends and resync the running totals once the queue is (almost) empty"""
+		while self.batches and self.batches[-1] is None:
+			self.batches.pop()
+
+		self.head = min(self.head, len(self.batches))
+		while self.head < len(self.batches) and self.batches[self.head] is None:
+			self.head += 1
+
+		if self.head > 1000 and self.head * 2 > len(self.batches):
+			self.rebuild(self.get_state())
+		elif self.live_batches <= 1:
+			# avoid float drift of the running totals on long ledgers
+			self.total_qty = sum(flt(batch[0]) for batch in self)
+			self.total_value = sum(flt(batch[0]) * flt(batch[1]) for batch in self)
+
+	def rebuild(self, stock_queue):
+		self.__init__(stock_queue)
+
+	def set_batch(self, position, qty, rate):
+		old_qty, old_rate = self.batches[position]
+		if old_rate != rate:
+			self.rate_map[old_rate].remove(position)
+			if not self.rate_map[old_rate]:
+				del self.rate_map[old_rate]
+			# positions per rate stay sorted, since only the last batch changes rate
+			self.rate_map.setdefault(rate, []).append(position)
+
+		self.batches[position] = [qty, rate]
+		self.total_qty += flt(qty) - flt(old_qty)
+		self.total_value += flt(qty) * flt(rate) - flt(old_qty) * flt(old_rate)
+
+	def add_stock(self, qty, rate):
+		"""Add an incoming batch. Merges into the last batch if the rate is the same,
+			or fills up the last batch if it is negative"""
+		if not self.live_batches:
+			self.append(0, 0)
+
+		last = len(self.batches) - 1
+		last_qty, last_rate = self.batches[last]
+
+		if last_rate == rate:
+			# last row has the same rate, just updated the qty
+			self.set_batch(last, last_qty + qty, rate)
+		elif last_qty > 0:
+			self.append(qty, rate)
+		else:
+			self.set_batch(last, last_qty + qty, rate)
+
+	def remove_stock(self, qty, outgoing_rate=0, rate_generator=None):
+		"""Consume qty from the queue, from the oldest batch, or from the first batch
+			with the given outgoing rate.
+
+			:param rate_generator: callable returning the rate to use when the queue is empty
+		"""
+		qty_to_pop = abs(qty)
+		while qty_to_pop:
+			if not self.live_batches:
+				self.append(0, rate_generator() if rate_generator else 0)
+
+			if outgoing_rate > 0:
+				# Find the entry where rate matched with outgoing rate
+				positions = self.rate_map.get(outgoing_rate)
+
+				# If no entry found with outgoing rate, collapse stack
+				if not positions:
+					new_stock_value = self.total_value - qty_to_pop * outgoing_rate
+					new_stock_qty = self.total_qty - qty_to_pop
+					self.rebuild([[new_stock_qty,
+						new_stock_value / new_stock_qty if new_stock_qty > 0 else outgoing_rate]])
+					break
+
+				position = positions[0]
+			else:
+				position = self.head
+
+			# select first batch or the batch with same rate
+			batch_qty, batch_rate = self.batches[position]
+			if qty_to_pop >= batch_qty:
+				# consume current batch
+				qty_to_pop = qty_to_pop - batch_qty
+				self.remove(position)
+				if not self.live_batches and qty_to_pop:
+					# stock finished, qty still remains to be withdrawn
+					# negative stock, keep in as a negative batch
+					self.append(-qty_to_pop, outgoing_rate or batch_rate)
+					break
+			else:
+				# qty found in current batch
+				# consume it and exit
+				self.set_batch(position, batch_qty - qty_to_pop, batch_rate)
+				qty_to_pop = 0
@@ -0,0 +1,46 @@
+# Copyright (c) 2020, Frappe Technologies Pvt. Ltd. and Contributors
+# License: GNU General Public License v3. See license.txt
+
+from __future__ import unicode_literals
+import frappe
+
+def iterate_sql(query, values=(), as_dict=False, batch_size=1000):
+	"""Iterate over the result of a query with an unbuffered (server-side) cursor,
+		so that the result set is never held in memory as a whole.
+
+		The connection is busy until the iterator is exhausted or closed, so no other
+		query must be run on `frappe.db` while iterating."""
+	if frappe.db.db_type != "mariadb":
+		# other backends: buffered result, same interface
+		for row in frappe.db.sql(query, values, as_dict=as_dict):
+			yield row
+		return
+
+	import pymysql.cursors
+
+	cursor = frappe.db._conn.cursor(pymysql.cursors.SSCursor)
+	try:
+		cursor.execute(query, values or None)
+		columns = [d[0] for d in cursor.description] if as_dict else None
+
+		while True:
+			rows = cursor.fetchmany(batch_size)
+			if not rows:
+				break
+
+			for row in rows:
+				yield frappe._dict(zip(columns, row)) if as_dict else row
+	finally:
+		cursor.close()
+
+def get_connection():
+	"""Returns a new connection to the site's database. Its writes are committed
+		independently of the transaction open on `frappe.db`, close it when done."""
+	from frappe.database import get_db
+
+	return get_db(user=frappe.conf.db_name)
+
+def run_after_commit(method, **kwargs):
+	"""Run the method (again) in a background job once the current transaction is committed,
+		e.g. to reset a cache that another worker may have rebuilt from the data before the commit"""
+	frappe.enqueue(method, enqueue_after_commit=True, **kwargs)